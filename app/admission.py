@@ -0,0 +1,79 @@
+import math
+import time
+from collections import OrderedDict
+from fastapi import HTTPException
+from app.config import settings
+from app.dependencies import AuthUser
+from app.metrics import REJECTED_RATE_LIMIT
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        # Returns 0 when admitted, otherwise the seconds until it would be.
+        # A cost above the burst is charged as the burst, so a maximal batch
+        # is still admitted from a full bucket.
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+
+        return (cost - self.tokens) / self.rate
+
+
+class OrderRateLimiter:
+    # One bucket per API key, sized by the user's role. Buckets are kept in a
+    # bounded LRU; an evicted key starts again from a full bucket.
+    def __init__(self, limits: dict, max_keys: int):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, user: AuthUser, cost: int) -> float:
+        rate, burst = self.limits.get(user.role, self.limits["USER"])
+        if rate <= 0:
+            return 0.0
+
+        bucket = self._buckets.get(user.api_key)
+        if bucket is None or bucket.rate != rate or bucket.burst != burst:
+            bucket = TokenBucket(rate, burst)
+            self._buckets[user.api_key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(user.api_key)
+
+        return bucket.take(cost)
+
+
+order_rate_limiter = OrderRateLimiter(
+    {
+        "USER": (settings.order_rate_user, settings.order_burst_user),
+        "ADMIN": (settings.order_rate_admin, settings.order_burst_admin),
+    },
+    settings.order_rate_max_keys
+)
+
+
+def check_order_rate(user: AuthUser, orders: int = 1):
+    wait = order_rate_limiter.take(user, orders)
+    if wait > 0:
+        REJECTED_RATE_LIMIT.inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Order rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.db_models.candles import Candle_db
+from app.db_models.instruments import Instrument_db
+from app.db_models.transactions import Transaction_db
+from app.db_session_provider import AsyncSessionLocal
+from app.matching import TickerMatcher
+from app.invalidation import INSTRUMENT, on_invalidation
+
+logger = logging.getLogger(__name__)
+
+INTERVALS = {"1s": 1, "1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+
+_EPOCH = datetime(1970, 1, 1)
+_STORE_CHUNK_SIZE = 1000
+
+_series: Dict[Tuple[str, str], "CandleSeries"] = {}
+# Bars changed since the last flush, by (ticker, interval, start)
+_dirty: Dict[Tuple[str, str, int], "Candle"] = {}
+# Lower bound from which the candles table is complete, per (ticker, interval)
+_stored_from: Dict[Tuple[str, str], int] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+@dataclass(slots=True)
+class Candle:
+    start: int
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+
+
+def to_epoch(timestamp: datetime) -> int:
+    return int((timestamp - _EPOCH).total_seconds())
+
+
+def from_epoch(seconds: int) -> datetime:
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+class CandleSeries:
+    # Most recent bars of one ticker and interval, oldest first. Bars without
+    # trades are not stored. Every bar from `since` on is complete.
+    def __init__(self, seconds: int, capacity: int, since: int):
+        self.seconds = seconds
+        self.since = since
+        self.bars: Deque[Candle] = deque(maxlen=capacity)
+
+    def update(self, timestamp: int, price: int, qty: int) -> Candle:
+        start = timestamp - timestamp % self.seconds
+        bars = self.bars
+        if bars and start <= bars[-1].start:
+            bar = bars[-1]
+            bar.high = max(bar.high, price)
+            bar.low = min(bar.low, price)
+            bar.close = price
+            bar.volume += qty
+            return bar
+
+        if len(bars) == bars.maxlen:
+            self.since = bars[0].start + self.seconds
+        bar = Candle(start=start, open=price, high=price, low=price, close=price, volume=qty)
+        bars.append(bar)
+
+        return bar
+
+    def range(self, start: int, end: int) -> List[Candle]:
+        return [bar for bar in self.bars if start <= bar.start < end]
+
+
+def is_seeded(ticker: str) -> bool:
+    return (ticker, "1s") in _series
+
+
+async def seed_candles(db: AsyncSession, ticker: str):
+    # Starts the series of a ticker with the bars in progress, aggregated from
+    # transactions. Must run on the ticker's matcher so that no trade commits
+    # between the aggregation and the first record_trades call.
+    if is_seeded(ticker):
+        return
+
+    now = int(time.time())
+    series = {}
+    for interval, seconds in INTERVALS.items():
+        since = now - now % seconds
+        series[interval] = CandleSeries(seconds, settings.candle_history, since)
+        for bar in await _aggregate(db, ticker, seconds, since, None):
+            series[interval].bars.append(bar)
+            _dirty[(ticker, interval, bar.start)] = bar
+
+    for interval in INTERVALS:
+        _series[(ticker, interval)] = series[interval]
+        _stored_from[(ticker, interval)] = series[interval].since
+
+
+async def seed_instrument_candles(matcher: TickerMatcher):
+    async with AsyncSessionLocal() as db:
+        instrument = await db.get(Instrument_db, matcher.ticker)
+        if instrument is None:
+            raise HTTPException(status_code=422, detail="Instrument not found")
+
+        await seed_candles(db, matcher.ticker)
+
+
+def record_trades(ticker: str, timestamp: datetime, trades: List[Tuple[int, int]]):
+    # Called once the transaction holding the trades has committed
+    seconds = to_epoch(timestamp)
+    for interval in INTERVALS:
+        series = _series.get((ticker, interval))
+        if series is None:
+            return
+        for price, qty in trades:
+            bar = series.update(seconds, price, qty)
+            _dirty[(ticker, interval, bar.start)] = bar
+
+
+def discard_candles(ticker: str):
+    for interval in INTERVALS:
+        _series.pop((ticker, interval), None)
+        _stored_from.pop((ticker, interval), None)
+    for key in [key for key in _dirty if key[0] == ticker]:
+        del _dirty[key]
+
+
+@on_invalidation(INSTRUMENT)
+def _invalidate_candles(ticker: Optional[str], order_ids):
+    if ticker is not None:
+        discard_candles(ticker)
+
+
+async def get_candles(db: AsyncSession, ticker: str, interval: str, start: int, end: int) -> List[Candle]:
+    seconds = INTERVALS[interval]
+    start -= start % seconds
+    key = (ticker, interval)
+    series = _series.get(key)
+    if series is None:
+        # Discarded since the caller seeded it, e.g. by an invalidation:
+        # answered from transactions, and seeded again on next use
+        return await _aggregate(db, ticker, seconds, start, end)
+    if start >= series.since:
+        return series.range(start, end)
+
+    # Older bars come from the candles table. Flushes keep it complete from
+    # the moment the ticker was seeded; anything before that is immutable and
+    # rebuilt from transactions the first time it is asked for.
+    stored_from = _stored_from.get(key, series.since)
+    if start < stored_from:
+        await _store(db, [(ticker, interval, bar) for bar in await _aggregate(db, ticker, seconds, start, stored_from)])
+        await db.commit()
+        if _series.get(key) is series:
+            _stored_from[key] = start
+
+    stored_result = await db.execute(
+        select(Candle_db)
+        .where(
+            Candle_db.ticker == ticker,
+            Candle_db.interval == interval,
+            Candle_db.start >= from_epoch(start),
+            Candle_db.start < from_epoch(min(end, series.since))
+        )
+        .order_by(Candle_db.start)
+    )
+    candles = [
+        Candle(
+            start=to_epoch(row.start), open=row.open, high=row.high, low=row.low, close=row.close, volume=row.volume
+        )
+        for row in stored_result.scalars()
+    ]
+
+    return candles + series.range(series.since, end)
+
+
+async def _aggregate(db: AsyncSession, ticker: str, seconds: int, start: int, end: Optional[int]) -> List[Candle]:
+    bucket = func.floor(func.extract("epoch", Transaction_db.timestamp) / seconds) * seconds
+    query = (
+        select(
+            bucket,
+            array_agg(aggregate_order_by(Transaction_db.price, Transaction_db.timestamp, Transaction_db.id))[1],
+            func.max(Transaction_db.price),
+            func.min(Transaction_db.price),
+            array_agg(aggregate_order_by(
+                Transaction_db.price, Transaction_db.timestamp.desc(), Transaction_db.id.desc()
+            ))[1],
+            func.sum(Transaction_db.amount)
+        )
+        .where(Transaction_db.ticker == ticker, Transaction_db.timestamp >= from_epoch(start))
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+    if end is not None:
+        query = query.where(Transaction_db.timestamp < from_epoch(end))
+
+    bars_result = await db.execute(query)
+
+    return [
+        Candle(start=int(row[0]), open=row[1], high=row[2], low=row[3], close=row[4], volume=int(row[5]))
+        for row in bars_result
+    ]
+
+
+async def _store(db: AsyncSession, bars: List[Tuple[str, str, Candle]]):
+    # Chunked to stay well below the bind parameter limit of one statement
+    for offset in range(0, len(bars), _STORE_CHUNK_SIZE):
+        await _store_chunk(db, bars[offset:offset + _STORE_CHUNK_SIZE])
+
+
+async def _store_chunk(db: AsyncSession, bars: List[Tuple[str, str, Candle]]):
+    statement = insert(Candle_db).values([
+        {
+            "ticker": ticker,
+            "interval": interval,
+            "start": from_epoch(bar.start),
+            "open": bar.open,
+            "high": bar.high,
+            "low": bar.low,
+            "close": bar.close,
+            "volume": bar.volume
+        }
+        for ticker, interval, bar in bars
+    ])
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Candle_db.ticker, Candle_db.interval, Candle_db.start],
+            set_={
+                column: statement.excluded[column]
+                for column in ("open", "high", "low", "close", "volume")
+            }
+        )
+    )
+
+
+async def flush_candles():
+    global _dirty
+    if not _dirty:
+        return
+
+    dirty, _dirty = _dirty, {}
+    # Copy the bars: they keep changing while the upsert is in flight
+    bars = [
+        (ticker, interval, Candle(bar.start, bar.open, bar.high, bar.low, bar.close, bar.volume))
+        for (ticker, interval, _), bar in dirty.items()
+    ]
+    try:
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await _store(db, bars)
+    except Exception:
+        for key, bar in dirty.items():
+            # Bars of a ticker discarded meanwhile would fail forever
+            if key[:2] in _series:
+                _dirty.setdefault(key, bar)
+        raise
+
+
+async def _flush_periodically():
+    while True:
+        await asyncio.sleep(settings.candle_flush_interval)
+        try:
+            await flush_candles()
+        except Exception:
+            logger.exception("Candle flush failed")
+
+
+def start_candles():
+    global _flush_task
+    _flush_task = asyncio.create_task(_flush_periodically(), name="candle-flush")
+
+
+async def stop_candles():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+
+    await flush_candles()
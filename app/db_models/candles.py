@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey
+from app.db_session_provider import Base
+
+
+class Candle_db(Base):
+    __tablename__ = "candles"
+    ticker = Column(String(10), ForeignKey("instruments.ticker"), primary_key=True)
+    interval = Column(String(3), primary_key=True)
+    start = Column(DateTime, primary_key=True)
+    open = Column(Integer, nullable=False)
+    high = Column(Integer, nullable=False)
+    low = Column(Integer, nullable=False)
+    close = Column(Integer, nullable=False)
+    volume = Column(BigInteger, nullable=False)
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, UUID, DateTime, String, Enum, Integer, ForeignKey
+from sqlalchemy import Column, UUID, DateTime, String, Enum, Integer, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy import Enum as SQLEnum
 from sqlalchemy.sql import func
@@ -17,3 +17,7 @@ class LimitOrder_db(Base):
     ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False)
     qty = Column(Integer, nullable=False)
     filled = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_limit_orders_user_status_timestamp", "user_id", "status", "timestamp", "id"),
+    )
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, UUID, DateTime, String, Enum, Integer, ForeignKey
+from sqlalchemy import Column, UUID, DateTime, String, Enum, Integer, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy import Enum as SQLEnum
 from sqlalchemy.sql import func
@@ -15,3 +15,7 @@ class MarketOrder_db(Base):
     direction = Column(SQLEnum("BUY", "SELL", name="order_direction"), nullable=False)
     ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False)
     qty = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_market_orders_user_status_timestamp", "user_id", "status", "timestamp", "id"),
+    )
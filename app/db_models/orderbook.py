@@ -1,11 +1,10 @@
-from sqlalchemy import Column, Integer, String, JSON, ForeignKey
-from sqlalchemy.sql import func
+from sqlalchemy import Column, String, JSON
 from app.db_session_provider import Base
 
 
 class OrderBook_db(Base):
+    # Read-only view aggregated from resting_orders
     __tablename__ = "orderbook"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False, unique=True)
+    ticker = Column(String(10), primary_key=True)
     bid_levels = Column(JSON, nullable=False)
     ask_levels = Column(JSON, nullable=False)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.sql import func
+from app.db_session_provider import Base
+
+
+class RestingOrder_db(Base):
+    __tablename__ = "resting_orders"
+    order_id = Column(PG_UUID(as_uuid=True), ForeignKey("limit_orders.id"), primary_key=True)
+    ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False)
+    direction = Column(String(50), nullable=False)
+    user_id = Column(PG_UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    price = Column(Integer, nullable=False)
+    qty = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_resting_orders_book", "ticker", "direction", "price", "timestamp"),
+    )
@@ -5,6 +5,8 @@ from app.db_session_provider import Base
 
 
 class Transaction_db(Base):
+    # Partitioned by month on timestamp; keys and the (ticker, timestamp, id)
+    # index exist per partition (migrations/scheme/transactions_partitions.sql)
     __tablename__ = "transactions"
     id = Column(Integer, primary_key=True, autoincrement=True)
     ticker = Column(String(10), ForeignKey("instruments.ticker"), nullable=False)
@@ -1,13 +1,97 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from uuid import UUID
 from fastapi import HTTPException, Depends
 from fastapi.security import APIKeyHeader
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from app.config import settings
 from app.db_models.users import User_db
 from app.db_session_provider import get_db
+from app.metrics import AUTH_CACHE_HIT, AUTH_CACHE_MISS
+from app.invalidation import USER, on_invalidation
 
 api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
 
 
+@dataclass(frozen=True)
+class AuthUser:
+    id: UUID
+    name: str
+    role: str
+    api_key: str
+
+
+class UserCache:
+    # Bounded LRU with a TTL. Values are plain snapshots rather than ORM
+    # instances, so they are safe to share between sessions.
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, AuthUser]]" = OrderedDict()
+        self._keys_by_user: Dict[UUID, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, api_key: str) -> Optional[AuthUser]:
+        entry = self._entries.get(api_key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(api_key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(api_key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user: AuthUser) -> AuthUser:
+        self._entries[user.api_key] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user.api_key)
+        self._keys_by_user[user.id] = user.api_key
+
+        while len(self._entries) > self.max_size:
+            api_key = next(iter(self._entries))
+            self._remove(api_key)
+            self.evictions += 1
+
+        return user
+
+    def invalidate_user(self, user_id: UUID):
+        api_key = self._keys_by_user.get(user_id)
+        if api_key is not None:
+            self._remove(api_key)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _remove(self, api_key: str):
+        _, user = self._entries.pop(api_key)
+        if self._keys_by_user.get(user.id) == api_key:
+            del self._keys_by_user[user.id]
+
+
+user_cache = UserCache(settings.auth_cache_size, settings.auth_cache_ttl)
+
+
+@on_invalidation(USER)
+def _invalidate_user(user_id: Optional[str], order_ids):
+    if user_id is None:
+        user_cache.clear()
+    else:
+        user_cache.invalidate_user(UUID(user_id))
+
+
 async def get_api_key(api_key: str = Depends(api_key_header)):
     if not api_key:
         raise HTTPException(status_code=401, detail="Authorization header is required")
@@ -18,7 +102,13 @@ async def get_api_key(api_key: str = Depends(api_key_header)):
     return api_key.replace("TOKEN ", "").strip()
 
 
-async def get_user(api_key: str = Depends(get_api_key), db: AsyncSession = Depends(get_db)):
+async def get_user(api_key: str = Depends(get_api_key), db: AsyncSession = Depends(get_db)) -> AuthUser:
+    started = time.perf_counter()
+    user = user_cache.get(api_key)
+    if user is not None:
+        AUTH_CACHE_HIT.observe(time.perf_counter() - started)
+        return user
+
     user_result = await db.execute(
         select(User_db).where(User_db.api_key == api_key))
 
@@ -26,10 +116,13 @@ async def get_user(api_key: str = Depends(get_api_key), db: AsyncSession = Depen
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    user = user_cache.put(AuthUser(id=user.id, name=user.name, role=user.role, api_key=user.api_key))
+    AUTH_CACHE_MISS.observe(time.perf_counter() - started)
+
     return user
 
 
-async def check_admin_role(user: User_db = Depends(get_user)):
+async def check_admin_role(user: AuthUser = Depends(get_user)):
     if user.role != "ADMIN":
         raise HTTPException(status_code=403, detail="Access denied. Admin role required")
 
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+from uuid import uuid4
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.metrics import INVALIDATION_DELIVERY
+
+logger = logging.getLogger(__name__)
+
+# Event kinds; the key is a user id, a ticker or a ticker respectively
+USER = "user"
+INSTRUMENT = "instrument"
+BOOK = "book"
+
+# A book event lists the orders it touched so that order caches drop only
+# those; beyond this many it stands for every order of the ticker
+_MAX_ORDER_IDS = 100
+_RECONNECT_DELAY = 1.0
+
+# Identifies this process: its own events were applied when written
+_origin = uuid4().hex
+# kind -> handlers called with the key, or with None for everything of that kind
+_handlers: Dict[str, List[Callable[[Optional[str], Optional[List[str]]], None]]] = defaultdict(list)
+_listener: Optional["InvalidationListener"] = None
+
+
+def on_invalidation(kind: str):
+    def register(handler: Callable[[Optional[str], Optional[List[str]]], None]):
+        _handlers[kind].append(handler)
+        return handler
+
+    return register
+
+
+async def publish_invalidation(db: AsyncSession, kind: str, key, order_ids: Optional[Iterable] = None):
+    # NOTIFY is transactional: the event goes out when `db` commits and not
+    # at all on rollback, so listeners never drop state for a write that
+    # did not happen
+    if not settings.invalidation_bus:
+        return
+
+    payload = {"kind": kind, "key": str(key), "origin": _origin, "sent": time.time()}
+    if order_ids is not None:
+        order_ids = [str(order_id) for order_id in order_ids]
+        if len(order_ids) <= _MAX_ORDER_IDS:
+            payload["orders"] = order_ids
+
+    await db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": settings.invalidation_channel, "payload": json.dumps(payload, separators=(",", ":"))}
+    )
+
+
+def publishes_book_events() -> bool:
+    # Books only need invalidating when several processes each match every
+    # ticker; in a sharded deployment a book has exactly one owner
+    return settings.invalidation_bus and settings.matching_workers == 0
+
+
+async def publish_book_changed(db: AsyncSession, ticker: str, order_ids: Optional[Iterable] = None):
+    if publishes_book_events():
+        await publish_invalidation(db, BOOK, ticker, order_ids)
+
+
+def apply_invalidation(payload: str):
+    event = json.loads(payload)
+    if event["origin"] == _origin:
+        return
+
+    INVALIDATION_DELIVERY.labels(kind=event["kind"]).observe(max(0.0, time.time() - event["sent"]))
+    for handler in _handlers.get(event["kind"], ()):
+        try:
+            handler(event["key"], event.get("orders"))
+        except Exception:
+            logger.exception("Invalidation handler for %s failed", event["kind"])
+
+
+def _reset_all():
+    # Events sent while the listener was disconnected are lost for good
+    for kind, handlers in _handlers.items():
+        for handler in handlers:
+            try:
+                handler(None, None)
+            except Exception:
+                logger.exception("Invalidation reset for %s failed", kind)
+
+
+class InvalidationListener:
+    # Holds one dedicated connection outside the pools, LISTENing on the
+    # channel. After a lost connection every cache is reset once the
+    # listener is back, as events in between cannot be recovered.
+    def __init__(self, dsn: str, channel: str):
+        self.dsn = dsn
+        self.channel = channel
+        self.connected = False
+        self.reconnects = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="invalidation-listener")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Invalidation listener cannot connect: %s", e)
+                await asyncio.sleep(_RECONNECT_DELAY)
+                continue
+
+            lost = asyncio.Event()
+            try:
+                connection.add_termination_listener(lambda connection: lost.set())
+                await connection.add_listener(self.channel, self._deliver)
+                if self.reconnects:
+                    _reset_all()
+                self.connected = True
+                await lost.wait()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Invalidation listener failed: %s", e)
+            finally:
+                self.connected = False
+                if not connection.is_closed():
+                    connection.terminate()
+
+            self.reconnects += 1
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+    def _deliver(self, connection, pid: int, channel: str, payload: str):
+        apply_invalidation(payload)
+
+
+def listener_stats() -> Optional[dict]:
+    if _listener is None:
+        return None
+    return {"connected": _listener.connected, "reconnects": _listener.reconnects}
+
+
+def start_invalidation_listener():
+    global _listener
+    if not settings.invalidation_bus:
+        return
+
+    dsn = make_url(settings.database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+    _listener = InvalidationListener(dsn, settings.invalidation_channel)
+    _listener.start()
+
+
+async def stop_invalidation_listener():
+    global _listener
+    if _listener is not None:
+        await _listener.stop()
+        _listener = None
@@ -7,6 +7,16 @@ from app.routers.balance import admin_balance_router as admin_balance_router
 from app.routers.order import router as order_router
 from app.routers.admin import router as admin_router
 from app.routers.user import router as user_router
+from app.routers.metrics import router as metrics_router
+from app.metrics import MetricsMiddleware
+from app.matching import start_journal, stop_matchers
+from app.candles import start_candles, stop_candles
+from app.db_session_provider import dispose_engines
+from app.config import settings
+from app.sharding import check_socket_dir, is_sharded, prune_journals, shared_l2_path, socket_dir, stop_clients
+from app.shared_l2 import start_shared_l2_reader, stop_shared_l2
+from app.invalidation import start_invalidation_listener, stop_invalidation_listener
+from app.partitions import start_partition_maintenance, stop_partition_maintenance
 
 app = FastAPI(redirect_slashes=False)
 
@@ -16,6 +26,37 @@ app.include_router(order_router)
 app.include_router(admin_router)
 app.include_router(admin_balance_router)
 app.include_router(user_router)
+app.include_router(metrics_router)
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    start_invalidation_listener()
+    # With sharding, books, the journal and candle flushing live in the
+    # matching workers (python -m app.sharding serve)
+    if is_sharded():
+        check_socket_dir(socket_dir())
+        if settings.l2_shared_depth > 0:
+            start_shared_l2_reader(shared_l2_path())
+        return
+    if settings.journal_dir is not None:
+        prune_journals(settings.journal_dir, 0)
+    await start_journal()
+    start_candles()
+    start_partition_maintenance()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_invalidation_listener()
+    await stop_partition_maintenance()
+    await stop_clients()
+    await stop_matchers()
+    await stop_candles()
+    await dispose_engines()
+    stop_shared_l2()
 
 
 def custom_openapi():
@@ -0,0 +1,200 @@
+import asyncio
+import orjson
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+from app.order_book import EPOCH, OrderBook
+
+# ticker -> (book version, {limit: (etag, encoded body)})
+_l2_cache: Dict[str, Tuple[int, Dict[int, Tuple[str, bytes]]]] = {}
+_feeds: Dict[str, "TickerFeed"] = {}
+
+
+def encode_message(message: dict) -> str:
+    return orjson.dumps(message).decode()
+
+
+def l2_snapshot(book: OrderBook, limit: int) -> Tuple[str, bytes]:
+    version, by_limit = _l2_cache.get(book.ticker, (None, None))
+    if version != book.version:
+        by_limit = {}
+        _l2_cache[book.ticker] = (book.version, by_limit)
+
+    snapshot = by_limit.get(limit)
+    if snapshot is None:
+        body = orjson.dumps({
+            "bid_levels": [{"price": level.price, "qty": level.qty} for level in book.bids.levels(limit)],
+            "ask_levels": [{"price": level.price, "qty": level.qty} for level in book.asks.levels(limit)],
+        })
+        snapshot = (l2_etag(book.ticker, EPOCH, book.version, limit), body)
+        by_limit[limit] = snapshot
+
+    return snapshot
+
+
+def l2_etag(ticker: str, epoch: int, version: int, limit: int) -> str:
+    return f'"{ticker}-{epoch:016x}-{version}-{limit}"'
+
+
+def discard_market_data(ticker: str):
+    _l2_cache.pop(ticker, None)
+    feed = _feeds.get(ticker)
+    if feed is not None:
+        feed.book = None
+
+
+class Subscriber:
+    # Messages are queued pre-encoded. When the queue overflows the consumer
+    # is too slow: its backlog is dropped and every ticker it follows is
+    # resent as a fresh snapshot, so it catches up with the latest state
+    # instead of replaying stale deltas. Trades in the dropped backlog are lost.
+    def __init__(self, send: Callable[[str], Awaitable[None]], max_pending: int):
+        self.tickers: Set[str] = set()
+        self._send = send
+        self._max_pending = max_pending
+        self._queue: Deque[str] = deque()
+        self._resync: Set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    @property
+    def conflated(self) -> bool:
+        return bool(self._resync)
+
+    def push(self, ticker: str, data: str):
+        if ticker in self._resync:
+            return
+        if len(self._queue) >= self._max_pending:
+            self._queue.clear()
+            self._resync.update(self.tickers)
+        else:
+            self._queue.append(data)
+        self._wakeup.set()
+
+    def notify(self, message: dict):
+        self._queue.append(encode_message(message))
+        self._wakeup.set()
+
+    def resync(self, ticker: str):
+        self._resync.add(ticker)
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._queue or self._resync:
+                if self._queue:
+                    data = self._queue.popleft()
+                else:
+                    data = _feeds[self._resync.pop()].snapshot()
+                    if data is None:
+                        continue
+                await self._send(data)
+
+
+class TickerFeed:
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.seq = 0
+        self.book: Optional[OrderBook] = None
+        self.subscribers: Set[Subscriber] = set()
+        self._snapshot: Optional[Tuple[int, int, str]] = None
+
+    def publish(self, message: dict):
+        self.seq += 1
+        message["seq"] = self.seq
+        data = encode_message(message)
+        for subscriber in self.subscribers:
+            subscriber.push(self.ticker, data)
+
+    def resync_all(self):
+        for subscriber in self.subscribers:
+            subscriber.resync(self.ticker)
+
+    def snapshot(self) -> Optional[str]:
+        book = self.book
+        if book is None:
+            return None
+
+        if self._snapshot is None or self._snapshot[:2] != (book.version, self.seq):
+            data = encode_message({
+                "type": "snapshot",
+                "ticker": self.ticker,
+                "seq": self.seq,
+                "bid_levels": [{"price": level.price, "qty": level.qty} for level in book.bids.levels()],
+                "ask_levels": [{"price": level.price, "qty": level.qty} for level in book.asks.levels()],
+            })
+            self._snapshot = (book.version, self.seq, data)
+
+        return self._snapshot[2]
+
+
+def get_feed(ticker: str) -> TickerFeed:
+    feed = _feeds.get(ticker)
+    if feed is None:
+        feed = TickerFeed(ticker)
+        _feeds[ticker] = feed
+
+    return feed
+
+
+def set_feed(ticker: str, feed: TickerFeed):
+    # A sharded front-end serves the ticker from a mirror of the owner's feed
+    _feeds[ticker] = feed
+
+
+def remove_feed(ticker: str, feed: TickerFeed):
+    if _feeds.get(ticker) is feed:
+        del _feeds[ticker]
+
+
+def subscribe(subscriber: Subscriber, book: OrderBook):
+    feed = get_feed(book.ticker)
+    feed.book = book
+    attach(subscriber, feed)
+
+
+def attach(subscriber: Subscriber, feed: TickerFeed):
+    feed.subscribers.add(subscriber)
+    subscriber.tickers.add(feed.ticker)
+    subscriber.resync(feed.ticker)
+
+
+def unsubscribe(subscriber: Subscriber, ticker: str):
+    subscriber.tickers.discard(ticker)
+    feed = _feeds.get(ticker)
+    if feed is not None:
+        feed.subscribers.discard(subscriber)
+
+
+def publish_changes(book: OrderBook, reloaded: bool):
+    levels, trades = book.drain_changes()
+    feed = _feeds.get(book.ticker)
+    if feed is None or not feed.subscribers:
+        if feed is not None:
+            feed.book = book
+        return
+
+    if reloaded or feed.book is not book:
+        feed.book = book
+        feed.resync_all()
+        return
+
+    timestamp = datetime.utcnow().isoformat()
+    for direction, price, qty in trades:
+        feed.publish({
+            "type": "trade",
+            "ticker": book.ticker,
+            "side": direction,
+            "price": price,
+            "qty": qty,
+            "timestamp": timestamp,
+        })
+
+    if levels:
+        feed.publish({
+            "type": "l2",
+            "ticker": book.ticker,
+            "changes": [{"side": direction, "price": price, "qty": qty} for direction, price, qty in levels],
+        })
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.db_models.instruments import Instrument_db
+from app.db_models.resting_orders import RestingOrder_db
+from app.db_session_provider import AsyncSessionLocal
+from app.market_data import discard_market_data, publish_changes
+from app.metrics import REJECTED_IN_FLIGHT, REJECTED_QUEUE_FULL, STAGE_QUEUE, current_query_counter, \
+    use_query_counter
+from app.journal import Journal, Event, encode_snapshot, recover
+from app.shared_l2 import discard_shared_l2, publish_shared_l2
+from app.invalidation import BOOK, INSTRUMENT, on_invalidation, publishes_book_events
+from app.order_book import OrderBook
+
+logger = logging.getLogger(__name__)
+
+_matchers: Dict[str, "TickerMatcher"] = {}
+_journal: Optional[Journal] = None
+# Commands queued or running across all matchers
+_in_flight = 0
+
+
+class TickerMatcher:
+    # Single writer for one ticker: commands are executed one at a time by a
+    # dedicated task, so the in-memory book never needs locking.
+    def __init__(self, ticker: str, queue_size: int):
+        self.ticker = ticker
+        self.book: Optional[OrderBook] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._durable: Optional[asyncio.Future] = None
+        self._events_since_snapshot = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, command: Callable[["TickerMatcher"], Awaitable[Any]], sheddable: bool = False) -> Any:
+        # Sheddable commands (new orders) are refused once the matchers hold
+        # too much work overall; cancels are always let through.
+        global _in_flight
+        if sheddable:
+            check_capacity()
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((command, future, time.perf_counter(), current_query_counter()))
+        except asyncio.QueueFull:
+            REJECTED_QUEUE_FULL.inc()
+            raise HTTPException(
+                status_code=503, detail=f"Order queue for {self.ticker} is full", headers={"Retry-After": "1"}
+            )
+        _in_flight += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"matcher-{self.ticker}")
+
+        return await future
+
+    async def ensure_book(self, db: AsyncSession) -> OrderBook:
+        if self.book is None:
+            self.book = await load_book(db, self.ticker)
+
+        return self.book
+
+    def record(self, events: List[Event]):
+        # Called by a command once its transaction has committed
+        if _journal is None or not events:
+            return
+        self._durable = _journal.append(events)
+        self._events_since_snapshot += len(events)
+
+    async def stop(self):
+        global _in_flight
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        # Commands that never ran no longer count as in flight
+        while not self._queue.empty():
+            _, future, _, _ = self._queue.get_nowait()
+            future.cancel()
+            _in_flight -= 1
+
+    async def _run(self):
+        global _in_flight
+        while True:
+            command, future, submitted, query_counter = await self._queue.get()
+            try:
+                await self._execute(command, future, submitted, query_counter)
+            finally:
+                _in_flight -= 1
+
+            if self.book is None and self._queue.empty():
+                if _matchers.get(self.ticker) is self:
+                    del _matchers[self.ticker]
+                return
+
+    async def _execute(self, command, future: asyncio.Future, submitted: float, query_counter):
+        if future.done():
+            return
+        STAGE_QUEUE.observe(time.perf_counter() - submitted)
+        # Statements run by the command count towards the submitting request
+        use_query_counter(query_counter)
+
+        book = self.book
+        version = book.version if book is not None else None
+        try:
+            result = await command(self)
+        except Exception as e:
+            # The transaction behind the command was rolled back, so a book
+            # mutated by it no longer matches the database.
+            if self.book is not None and (self.book is not book or self.book.version != version):
+                self._discard()
+            self._durable = None
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        durable, self._durable = self._durable, None
+        if self.book is not None:
+            publish_changes(self.book, reloaded=self.book is not book)
+            publish_shared_l2(self.book)
+        if _journal is not None and self.book is not None and (
+                self.book is not book or self._events_since_snapshot >= settings.journal_snapshot_interval
+        ):
+            await self._snapshot()
+
+        if durable is None:
+            if not future.done():
+                future.set_result(result)
+        else:
+            durable.add_done_callback(
+                lambda done, future=future, result=result: self._resolve(future, done, result)
+            )
+
+    def _resolve(self, future: asyncio.Future, durable: asyncio.Future, result: Any):
+        # The transaction has committed by now, so the command's result stands
+        # whatever happened to the journal: failing the request would only
+        # make the client retry an order that may already have filled.
+        if durable.exception() is not None:
+            logger.error("Journal write failed for %s: %s", self.ticker, durable.exception())
+            self._journal_degraded()
+        if not future.done():
+            future.set_result(result)
+
+    def _journal_degraded(self):
+        # The journal is missing committed events of this ticker. Without a
+        # snapshot recovery loads the book from the database, and the next
+        # command writes a fresh snapshot that replay can start from again.
+        if _journal is not None:
+            _journal.remove_snapshot(self.ticker)
+        self._events_since_snapshot = settings.journal_snapshot_interval
+
+    async def _snapshot(self):
+        seq = _journal.last_seq
+        await _journal.write_snapshot(self.ticker, seq, encode_snapshot(self.book, seq))
+        self._events_since_snapshot = 0
+
+    def _discard(self):
+        self.book = None
+        discard_market_data(self.ticker)
+        discard_shared_l2(self.ticker)
+        if _journal is not None:
+            _journal.remove_snapshot(self.ticker)
+
+
+async def load_book(db: AsyncSession, ticker: str) -> OrderBook:
+    resting_orders = await db.execute(
+        select(RestingOrder_db)
+        .where(RestingOrder_db.ticker == ticker)
+        .order_by(RestingOrder_db.direction, RestingOrder_db.price, RestingOrder_db.timestamp)
+    )
+
+    book = OrderBook(ticker)
+    for resting_order in resting_orders.scalars():
+        book.add(
+            order_id=resting_order.order_id,
+            user_id=resting_order.user_id,
+            direction=resting_order.direction,
+            price=resting_order.price,
+            qty=resting_order.qty
+        )
+
+    return book
+
+
+async def _load_instrument_book(matcher: TickerMatcher) -> OrderBook:
+    async with AsyncSessionLocal() as db:
+        instrument = await db.get(Instrument_db, matcher.ticker)
+        if instrument is None:
+            raise HTTPException(status_code=422, detail="Instrument not found")
+
+        return await matcher.ensure_book(db)
+
+
+def get_matcher(ticker: str) -> TickerMatcher:
+    matcher = _matchers.get(ticker)
+    if matcher is None:
+        matcher = TickerMatcher(ticker, settings.order_queue_size)
+        _matchers[ticker] = matcher
+
+    return matcher
+
+
+def get_loaded_book(ticker: str) -> Optional[OrderBook]:
+    matcher = _matchers.get(ticker)
+    return matcher.book if matcher is not None else None
+
+
+async def get_book(ticker: str) -> OrderBook:
+    book = get_loaded_book(ticker)
+    if book is not None:
+        return book
+
+    return await get_matcher(ticker).submit(_load_instrument_book)
+
+
+def loaded_matchers() -> List[TickerMatcher]:
+    return list(_matchers.values())
+
+
+def in_flight() -> int:
+    return _in_flight
+
+
+def check_capacity():
+    if _in_flight >= settings.order_max_in_flight:
+        REJECTED_IN_FLIGHT.inc()
+        raise HTTPException(status_code=503, detail="Too many orders in flight", headers={"Retry-After": "1"})
+
+
+def discard_matcher(ticker: str):
+    matcher = _matchers.get(ticker)
+    if matcher is not None:
+        matcher._discard()
+    else:
+        discard_market_data(ticker)
+
+
+@on_invalidation(BOOK)
+def _invalidate_book(ticker: Optional[str], order_ids):
+    # Another process changed the book: reloaded from the database on next use
+    if not publishes_book_events():
+        return
+    for matched_ticker in [ticker] if ticker is not None else list(_matchers):
+        discard_matcher(matched_ticker)
+
+
+@on_invalidation(INSTRUMENT)
+def _invalidate_instrument(ticker: Optional[str], order_ids):
+    if ticker is not None:
+        discard_matcher(ticker)
+
+
+async def start_journal():
+    global _journal
+    if settings.journal_dir is None:
+        return
+
+    os.makedirs(settings.journal_dir, exist_ok=True)
+    books, snapshot_seqs, last_seq = await asyncio.get_running_loop().run_in_executor(
+        None, recover, settings.journal_dir
+    )
+    _journal = Journal(settings.journal_dir, last_seq, snapshot_seqs, settings.journal_segment_size)
+
+    stale = await _stale_books(books)
+    for ticker, book in books.items():
+        if ticker in stale:
+            # Loaded from the database on first use, then snapshotted afresh
+            logger.warning("Recovered book of %s does not match resting_orders, reloading it", ticker)
+            _journal.remove_snapshot(ticker)
+            continue
+        book.drain_changes()
+        get_matcher(ticker).book = book
+        publish_shared_l2(book)
+
+
+async def _stale_books(books: Dict[str, OrderBook]) -> Set[str]:
+    # Events are journaled after their transaction commits, so a crash in
+    # between leaves a recovered book short of orders the database holds
+    if not books:
+        return set()
+
+    async with AsyncSessionLocal() as db:
+        totals_result = await db.execute(
+            select(RestingOrder_db.ticker, func.count(), func.sum(RestingOrder_db.qty))
+            .where(RestingOrder_db.ticker.in_(list(books)))
+            .group_by(RestingOrder_db.ticker)
+        )
+        totals = {ticker: (count, qty) for ticker, count, qty in totals_result}
+
+    return {
+        ticker for ticker, book in books.items()
+        if totals.get(ticker, (0, 0)) != (len(book), book.bids.qty + book.asks.qty)
+    }
+
+
+async def stop_matchers():
+    global _journal
+    matchers = list(_matchers.values())
+    _matchers.clear()
+    await asyncio.gather(*(matcher.stop() for matcher in matchers))
+
+    if _journal is not None:
+        await _journal.close()
+        _journal = None
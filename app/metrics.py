@@ -0,0 +1,109 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from prometheus_client import Counter, Histogram
+
+# Mutable per-request counter: set once by the middleware and shared with the
+# matcher task that executes the request's command.
+_request_queries: ContextVar[Optional[List[int]]] = ContextVar("request_queries", default=None)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "Database statements issued per HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf"))
+)
+AUTH_LATENCY = Histogram(
+    "auth_duration_seconds", "API key authentication latency", ["cache"]
+)
+ORDER_STAGE_LATENCY = Histogram(
+    "order_stage_duration_seconds", "Time spent in each stage of order creation", ["stage"]
+)
+MATCHED_LEVELS = Histogram(
+    "order_matched_levels", "Price levels consumed by one order",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, float("inf"))
+)
+INVALIDATION_DELIVERY = Histogram(
+    "invalidation_delivery_seconds", "Time from writing an invalidation event to applying it in another process",
+    ["kind"], buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float("inf"))
+)
+ORDER_REJECTIONS = Counter(
+    "order_rejections", "Order submissions refused by admission control", ["reason"]
+)
+
+# Children are resolved once: labels() takes a lock and a dict lookup
+AUTH_CACHE_HIT = AUTH_LATENCY.labels(cache="hit")
+AUTH_CACHE_MISS = AUTH_LATENCY.labels(cache="miss")
+STAGE_QUEUE = ORDER_STAGE_LATENCY.labels(stage="queue")
+STAGE_CHECK_FUNDS = ORDER_STAGE_LATENCY.labels(stage="check_funds")
+STAGE_CREATE_RECORD = ORDER_STAGE_LATENCY.labels(stage="create_record")
+STAGE_LOAD_BOOK = ORDER_STAGE_LATENCY.labels(stage="load_book")
+STAGE_MATCHING = ORDER_STAGE_LATENCY.labels(stage="matching")
+STAGE_COMMIT = ORDER_STAGE_LATENCY.labels(stage="commit")
+REJECTED_RATE_LIMIT = ORDER_REJECTIONS.labels(reason="rate_limit")
+REJECTED_IN_FLIGHT = ORDER_REJECTIONS.labels(reason="in_flight")
+REJECTED_QUEUE_FULL = ORDER_REJECTIONS.labels(reason="queue_full")
+
+
+def count_query(*args):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def current_query_counter() -> Optional[List[int]]:
+    return _request_queries.get()
+
+
+def use_query_counter(counter: Optional[List[int]]):
+    return _request_queries.set(counter)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: BaseHTTPMiddleware would add a task and a stream
+    # per request and buffer streaming responses.
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        counter = [0]
+        token = _request_queries.set(counter)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_queries.reset(token)
+            route = self._route(scope)
+            REQUEST_LATENCY.labels(scope["method"], route, status).observe(elapsed)
+            REQUEST_QUERIES.labels(route).observe(counter[0])
+
+    def _route(self, scope) -> str:
+        # Label by route template, not by raw path, to bound cardinality
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+
+        route = self._routes.get(endpoint)
+        if route is None:
+            route = next(
+                (candidate.path for candidate in scope["app"].routes if getattr(candidate, "endpoint", None) is endpoint),
+                "unmatched"
+            )
+            self._routes[endpoint] = route
+
+        return route
@@ -1,6 +1,6 @@
 import datetime
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 from enum import Enum
 from uuid import UUID
 
@@ -43,6 +43,15 @@ class Transaction(BaseModel):
     timestamp: str
 
 
+class Candle(BaseModel):
+    timestamp: str
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+
+
 class Body_deposit_api_v1_balance_deposit_post(BaseModel):
     user_id: UUID
     ticker: str
@@ -64,6 +73,14 @@ class Direction(str, Enum):
     SELL = "SELL"
 
 
+class Quote(BaseModel):
+    direction: Direction
+    qty: int
+    available: int
+    vwap: Optional[float]
+    worst_price: Optional[int]
+
+
 class OrderStatus(str, Enum):
     NEW = "NEW"
     EXECUTED = "EXECUTED"
@@ -104,3 +121,8 @@ class MarketOrder(BaseModel):
 class CreateOrderResponse(BaseModel):
     success: bool = True
     order_id: UUID
+
+
+class BatchOrderError(BaseModel):
+    success: bool = False
+    error: str
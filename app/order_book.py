@@ -0,0 +1,327 @@
+import heapq
+import itertools
+import secrets
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from uuid import UUID
+
+BUY = "BUY"
+SELL = "SELL"
+
+# Shared by all books so a reloaded book never reuses an earlier version
+_versions = itertools.count(1)
+# Versions restart with every process; the epoch tells apart books of
+# different processes and boots that happen to share a version
+EPOCH = secrets.randbits(64)
+
+
+@dataclass(slots=True)
+class RestingOrder:
+    order_id: UUID
+    user_id: UUID
+    direction: str
+    price: int
+    qty: int
+
+
+@dataclass(slots=True)
+class Fill:
+    maker_order_id: UUID
+    maker_user_id: UUID
+    price: int
+    qty: int
+    maker_remaining: int
+
+
+class PriceLevel:
+    __slots__ = ("price", "qty", "orders")
+
+    def __init__(self, price: int):
+        self.price = price
+        self.qty = 0
+        self.orders: "OrderedDict[UUID, RestingOrder]" = OrderedDict()
+
+
+class DepthIndex:
+    # Fenwick trees of quantity and notional (price * qty) over a side's
+    # prices ordered best first, so the cost of taking any quantity is
+    # O(log n). A price keeps its slot with zero quantity once its level
+    # empties; a price missing from the index makes the index stale, and the
+    # side rebuilds it the next time it is asked for a quote.
+    __slots__ = ("prices", "positions", "_qty", "_notional", "_top")
+
+    def __init__(self, levels: Iterable[PriceLevel]):
+        self.prices: List[int] = []
+        self.positions: Dict[int, int] = {}
+        self._qty = [0]
+        self._notional = [0]
+        for level in levels:
+            self.positions[level.price] = len(self.prices) + 1
+            self.prices.append(level.price)
+            self._qty.append(level.qty)
+            self._notional.append(level.price * level.qty)
+
+        size = len(self.prices)
+        for index in range(1, size + 1):
+            parent = index + (index & -index)
+            if parent <= size:
+                self._qty[parent] += self._qty[index]
+                self._notional[parent] += self._notional[index]
+        self._top = 1 << (size.bit_length() - 1) if size else 0
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def update(self, price: int, qty: int):
+        index = self.positions[price]
+        notional = price * qty
+        size = len(self.prices)
+        while index <= size:
+            self._qty[index] += qty
+            self._notional[index] += notional
+            index += index & -index
+
+    def cost(self, qty: int) -> Optional[Tuple[int, int]]:
+        # (total price, worst price) of taking `qty` from the best price on,
+        # or None if the side holds less than that
+        position = 0
+        remaining = qty
+        cost = 0
+        size = len(self.prices)
+        step = self._top
+        while step:
+            index = position + step
+            if index <= size and self._qty[index] < remaining:
+                position = index
+                remaining -= self._qty[index]
+                cost += self._notional[index]
+            step >>= 1
+
+        if position >= size:
+            return None
+        price = self.prices[position]
+        return cost + remaining * price, price
+
+
+class BookSide:
+    # Prices live in a dict for O(1) lookup and in a heap for O(log n) insert
+    # and O(1) best price. Emptied levels are dropped from the dict only and
+    # their heap keys are discarded lazily once they surface at the top.
+    def __init__(self, direction: str):
+        self.direction = direction
+        self.qty = 0
+        self._sign = -1 if direction == BUY else 1
+        self._levels: Dict[int, PriceLevel] = {}
+        self._heap: List[int] = []
+        self._depth: Optional[DepthIndex] = None
+
+    def __len__(self) -> int:
+        return len(self._levels)
+
+    def best(self) -> Optional[PriceLevel]:
+        heap = self._heap
+        while heap:
+            level = self._levels.get(heap[0] * self._sign)
+            if level is not None:
+                return level
+            heapq.heappop(heap)
+        return None
+
+    def get_level(self, price: int) -> Optional[PriceLevel]:
+        return self._levels.get(price)
+
+    def add(self, order: RestingOrder):
+        level = self._levels.get(order.price)
+        if level is None:
+            level = PriceLevel(order.price)
+            self._levels[order.price] = level
+            heapq.heappush(self._heap, order.price * self._sign)
+            if len(self._heap) > 2 * len(self._levels) + 64:
+                self._compact()
+            if self._depth is not None and order.price not in self._depth.positions:
+                self._depth = None
+
+        level.orders[order.order_id] = order
+        level.qty += order.qty
+        self.qty += order.qty
+        if self._depth is not None:
+            self._depth.update(order.price, order.qty)
+
+    def remove(self, order: RestingOrder):
+        level = self._levels[order.price]
+        del level.orders[order.order_id]
+        self.reduce_level(level, order.qty)
+        if not level.orders:
+            del self._levels[order.price]
+
+    def reduce_level(self, level: PriceLevel, qty: int):
+        level.qty -= qty
+        self.qty -= qty
+        if self._depth is not None:
+            self._depth.update(level.price, -qty)
+
+    def discard_level(self, price: int):
+        del self._levels[price]
+
+    def levels(self, limit: Optional[int] = None) -> Iterator[PriceLevel]:
+        if limit is None:
+            keys = sorted(self._levels, reverse=self.direction == BUY)
+        elif self.direction == BUY:
+            keys = heapq.nlargest(limit, self._levels)
+        else:
+            keys = heapq.nsmallest(limit, self._levels)
+
+        for price in keys:
+            yield self._levels[price]
+
+    def cost(self, qty: int) -> Optional[Tuple[int, int]]:
+        # Built on the first quote and then kept up to date by every change,
+        # until a new price or too many emptied slots call for a rebuild
+        depth = self._depth
+        if depth is None or len(depth) > 2 * len(self._levels) + 64:
+            depth = self._depth = DepthIndex(self.levels())
+        return depth.cost(qty)
+
+    def _compact(self):
+        self._heap = [price * self._sign for price in self._levels]
+        heapq.heapify(self._heap)
+
+
+class OrderBook:
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.bids = BookSide(BUY)
+        self.asks = BookSide(SELL)
+        self.version = next(_versions)
+        self._orders: Dict[UUID, RestingOrder] = {}
+        self._changed_levels: Set[Tuple[str, int]] = set()
+        self._trades: List[Tuple[str, int, int]] = []
+
+    def __contains__(self, order_id: UUID) -> bool:
+        return order_id in self._orders
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    @property
+    def best_bid(self) -> Optional[int]:
+        level = self.bids.best()
+        return level.price if level else None
+
+    @property
+    def best_ask(self) -> Optional[int]:
+        level = self.asks.best()
+        return level.price if level else None
+
+    def side(self, direction: str) -> BookSide:
+        return self.bids if direction == BUY else self.asks
+
+    def opposite(self, direction: str) -> BookSide:
+        return self.asks if direction == BUY else self.bids
+
+    def get(self, order_id: UUID) -> Optional[RestingOrder]:
+        return self._orders.get(order_id)
+
+    def add(self, order_id: UUID, user_id: UUID, direction: str, price: int, qty: int) -> RestingOrder:
+        if order_id in self._orders:
+            raise ValueError(f"Order {order_id} is already in the book")
+
+        order = RestingOrder(order_id=order_id, user_id=user_id, direction=direction, price=price, qty=qty)
+        self._orders[order_id] = order
+        self.side(direction).add(order)
+        self._changed_levels.add((direction, price))
+        self.version = next(_versions)
+
+        return order
+
+    def cancel(self, order_id: UUID) -> Optional[RestingOrder]:
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self.side(order.direction).remove(order)
+            self._changed_levels.add((order.direction, order.price))
+            self.version = next(_versions)
+
+        return order
+
+    def can_fill(self, direction: str, qty: int) -> bool:
+        return self.opposite(direction).qty >= qty
+
+    def quote(self, direction: str, qty: int) -> Optional[Tuple[int, int]]:
+        # (total price, worst price) a market order of `qty` would pay or
+        # receive against the book as it is, or None if it cannot fill
+        return self.opposite(direction).cost(qty)
+
+    def match(self, direction: str, qty: int, price: Optional[int] = None) -> List[Fill]:
+        side = self.opposite(direction)
+        is_buy = direction == BUY
+        fills = []
+        remaining = qty
+
+        while remaining > 0:
+            level = side.best()
+            if level is None:
+                break
+            if price is not None and ((is_buy and level.price > price) or (not is_buy and level.price < price)):
+                break
+
+            self._changed_levels.add((side.direction, level.price))
+            orders = level.orders
+            level_qty = remaining
+            while remaining > 0 and orders:
+                maker = next(iter(orders.values()))
+                trade_qty = min(remaining, maker.qty)
+                remaining -= trade_qty
+                maker.qty -= trade_qty
+
+                fills.append(Fill(
+                    maker_order_id=maker.order_id,
+                    maker_user_id=maker.user_id,
+                    price=level.price,
+                    qty=trade_qty,
+                    maker_remaining=maker.qty
+                ))
+                self._trades.append((direction, level.price, trade_qty))
+
+                if maker.qty == 0:
+                    orders.popitem(last=False)
+                    del self._orders[maker.order_id]
+
+            side.reduce_level(level, level_qty - remaining)
+            if not orders:
+                side.discard_level(level.price)
+
+        if fills:
+            self.version = next(_versions)
+
+        return fills
+
+    def reduce(self, order_id: UUID, qty: int) -> Optional[RestingOrder]:
+        order = self._orders.get(order_id)
+        if order is None:
+            return None
+
+        if qty >= order.qty:
+            return self.cancel(order_id)
+
+        side = self.side(order.direction)
+        order.qty -= qty
+        side.reduce_level(side.get_level(order.price), qty)
+        self._changed_levels.add((order.direction, order.price))
+        self.version = next(_versions)
+
+        return order
+
+    def drain_changes(self) -> Tuple[List[Tuple[str, int, int]], List[Tuple[str, int, int]]]:
+        # Levels touched since the last call with their current total qty
+        # (0 if the level is gone), and trades as (taker direction, price, qty)
+        levels = []
+        for direction, price in self._changed_levels:
+            level = self.side(direction).get_level(price)
+            levels.append((direction, price, level.qty if level is not None else 0))
+        trades = self._trades
+
+        self._changed_levels = set()
+        self._trades = []
+
+        return levels, trades
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List, Optional
+from uuid import UUID
+from app.config import settings
+from app.invalidation import BOOK, INSTRUMENT, USER, on_invalidation
+
+LIMIT = "LIMIT"
+MARKET = "MARKET"
+
+FINAL_STATUSES = ("EXECUTED", "CANCELLED")
+
+
+@dataclass(slots=True)
+class OrderEntry:
+    # Field names follow the columns of the order queries in routers/order.py
+    # so an entry and a result row convert to a response the same way.
+    id: UUID
+    kind: str
+    user_id: UUID
+    ticker: str
+    direction: str
+    qty: int
+    price: Optional[int]
+    timestamp: datetime
+    # None when only the location is known and the state must be read
+    status: Optional[str]
+    filled: int = 0
+
+
+class OrderRegistry:
+    # Bounded LRU from order id to its kind, owner and ticker. An entry only
+    # carries state when that state is authoritative: written by the matcher
+    # after its transaction committed, or final and so unable to change.
+    # State read back from the database for an open order is not kept, as a
+    # concurrent fill could already have made it stale.
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[UUID, OrderEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, order_id: UUID) -> Optional[OrderEntry]:
+        entry = self._entries.get(order_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(order_id)
+        self.hits += 1
+        return entry
+
+    def put(self, entry: OrderEntry) -> OrderEntry:
+        self._entries[entry.id] = entry
+        self._entries.move_to_end(entry.id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return entry
+
+    def put_read(self, entry: OrderEntry) -> OrderEntry:
+        # For entries built from a database read outside the matcher
+        if entry.status not in FINAL_STATUSES:
+            entry.status = None
+        existing = self._entries.get(entry.id)
+        if existing is not None and existing.status is not None:
+            return existing
+
+        return self.put(entry)
+
+    def fill(self, order_id: UUID, qty: int, remaining: int):
+        entry = self._entries.get(order_id)
+        if entry is None or entry.status is None:
+            return
+
+        entry.filled += qty
+        entry.status = "EXECUTED" if remaining == 0 else "PARTIALLY_EXECUTED"
+
+    def cancel(self, order_id: UUID):
+        entry = self._entries.get(order_id)
+        if entry is not None and entry.status is not None:
+            entry.status = "CANCELLED"
+
+    def discard(self, user_id: Optional[UUID] = None, ticker: Optional[str] = None):
+        # Orders changed in bulk outside the matcher; rare enough to scan
+        for order_id in [
+            entry.id for entry in self._entries.values()
+            if entry.user_id == user_id or entry.ticker == ticker
+        ]:
+            del self._entries[order_id]
+
+    def forget(self, order_ids: Iterable[UUID]):
+        for order_id in order_ids:
+            self._entries.pop(order_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+order_registry = OrderRegistry(settings.order_cache_size)
+
+
+@on_invalidation(USER)
+def _invalidate_user_orders(user_id: Optional[str], order_ids: Optional[List[str]]):
+    if user_id is None:
+        order_registry.clear()
+    else:
+        order_registry.discard(user_id=UUID(user_id))
+
+
+@on_invalidation(INSTRUMENT)
+def _invalidate_instrument_orders(ticker: Optional[str], order_ids: Optional[List[str]]):
+    if ticker is None:
+        order_registry.clear()
+    else:
+        order_registry.discard(ticker=ticker)
+
+
+@on_invalidation(BOOK)
+def _invalidate_book_orders(ticker: Optional[str], order_ids: Optional[List[str]]):
+    # Another process matched these orders, so any state cached here is stale
+    if ticker is None:
+        order_registry.clear()
+    elif order_ids is None:
+        order_registry.discard(ticker=ticker)
+    else:
+        order_registry.forget(UUID(order_id) for order_id in order_ids)
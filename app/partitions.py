@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from app.config import settings
+from app.db_session_provider import dispose_engines, engine
+
+logger = logging.getLogger(__name__)
+
+# transactions is range partitioned by month, one transactions_pYYYYMM table
+# per month (migrations/scheme/transactions_partitions.sql)
+_PARTITION_NAME = re.compile(r"transactions_p(\d{4})(\d{2})")
+# Held for a whole archiving run, so only one process detaches and drops
+_ARCHIVE_LOCK = "archive_transactions_partitions"
+
+_maintenance_task: Optional[asyncio.Task] = None
+
+
+def month_start(moment: datetime, months: int = 0) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def hot_partition_start() -> datetime:
+    # Trades are stamped with datetime.utcnow(), so this is where the
+    # partition receiving new ones begins
+    return month_start(datetime.utcnow())
+
+
+async def create_partitions(ahead: int) -> List[str]:
+    # The current month and `ahead` more; an insert into a month without a
+    # partition fails, there is no default partition in PostgreSQL 10
+    now = datetime.utcnow()
+    async with engine.begin() as connection:
+        return [
+            (await connection.execute(
+                text("SELECT create_transactions_partition(:month)"), {"month": month_start(now, months).date()}
+            )).scalar_one()
+            for months in range(ahead + 1)
+        ]
+
+
+async def archive_partitions(directory: str, retention: int) -> List[str]:
+    # Partitions whose month ended more than `retention` full months ago are
+    # detached, so queries stop reading them, written to
+    # <directory>/<partition>.csv.gz and then dropped. A partition an
+    # interrupted run left detached is found again by its name.
+    cutoff = month_start(datetime.utcnow(), -retention)
+    os.makedirs(directory, exist_ok=True)
+    archived = []
+
+    async with engine.connect() as connection:
+        locked = (await connection.execute(
+            text("SELECT pg_try_advisory_lock(hashtext(:lock))"), {"lock": _ARCHIVE_LOCK}
+        )).scalar_one()
+        await connection.commit()
+        if not locked:
+            return archived
+
+        try:
+            for name, attached in await _list_partitions(connection):
+                match = _PARTITION_NAME.fullmatch(name)
+                if match is None or month_start(datetime(int(match[1]), int(match[2]), 1), 1) > cutoff:
+                    continue
+
+                if attached:
+                    # Detaching locks the whole table; rather than stall trades
+                    # behind a long read, give up until the next run
+                    await connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+                    await connection.execute(text(f'ALTER TABLE transactions DETACH PARTITION "{name}"'))
+                    await connection.commit()
+
+                rows = await _export(connection, name, os.path.join(directory, f"{name}.csv.gz"))
+                await connection.execute(text(f'DROP TABLE "{name}"'))
+                await connection.commit()
+                logger.info("Archived %s rows of %s", rows, name)
+                archived.append(name)
+        finally:
+            # A failed statement leaves the transaction aborted, and the
+            # unlock would fail too, keeping the lock on the pooled connection
+            await connection.rollback()
+            await connection.execute(text("SELECT pg_advisory_unlock(hashtext(:lock))"), {"lock": _ARCHIVE_LOCK})
+            await connection.commit()
+
+    return archived
+
+
+async def _list_partitions(connection: AsyncConnection) -> List[tuple]:
+    result = await connection.execute(text(
+        "SELECT c.relname, i.inhparent IS NOT NULL FROM pg_class c "
+        "LEFT JOIN pg_inherits i ON i.inhrelid = c.oid "
+        "WHERE c.relkind = 'r' AND c.relname LIKE 'transactions\\_p%' AND pg_table_is_visible(c.oid) "
+        "ORDER BY c.relname"
+    ))
+    partitions = result.all()
+    await connection.commit()
+    return partitions
+
+
+async def _export(connection: AsyncConnection, name: str, path: str) -> int:
+    # Written next to its final name and moved there once on disk, so an
+    # archive file is always complete. Compressing and writing a month of
+    # trades take a while, so they run in a thread and keep the loop free.
+    raw = await connection.get_raw_connection()
+    loop = asyncio.get_running_loop()
+    partial = f"{path}.partial"
+    file = await loop.run_in_executor(None, open, partial, "wb")
+    try:
+        archive = gzip.GzipFile(filename=f"{name}.csv", mode="wb", fileobj=file)
+
+        async def write(data: bytes):
+            await loop.run_in_executor(None, archive.write, data)
+
+        status = await raw.driver_connection.copy_from_table(
+            name, columns=["id", "ticker", "amount", "price", "timestamp"], output=write,
+            format="csv", header=True
+        )
+        await loop.run_in_executor(None, _complete_archive, archive, file, partial, path)
+    finally:
+        file.close()
+
+    return int(status.split()[-1])
+
+
+def _complete_archive(archive: gzip.GzipFile, file, partial: str, path: str):
+    archive.close()
+    file.flush()
+    os.fsync(file.fileno())
+    os.replace(partial, path)
+
+
+async def maintain_partitions():
+    await create_partitions(settings.transactions_partitions_ahead)
+    if settings.transactions_archive_dir is not None and settings.transactions_retention_months > 0:
+        await archive_partitions(settings.transactions_archive_dir, settings.transactions_retention_months)
+
+
+async def _maintain_periodically():
+    while True:
+        try:
+            await maintain_partitions()
+        except Exception:
+            logger.exception("Transactions partition maintenance failed")
+        await asyncio.sleep(settings.transactions_maintenance_interval)
+
+
+def start_partition_maintenance():
+    global _maintenance_task
+    _maintenance_task = asyncio.create_task(_maintain_periodically(), name="partition-maintenance")
+
+
+async def stop_partition_maintenance():
+    global _maintenance_task
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
+
+
+async def _run_once(ahead: int, directory: Optional[str], retention: int):
+    try:
+        for name in await create_partitions(ahead):
+            print(f"partition {name}")
+        if directory is not None and retention > 0:
+            for name in await archive_partitions(directory, retention):
+                print(f"archived {name} to {os.path.join(directory, name)}.csv.gz")
+    finally:
+        await dispose_engines()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create transactions partitions ahead and archive expired ones")
+    parser.add_argument("--ahead", type=int, default=settings.transactions_partitions_ahead)
+    parser.add_argument("--archive-dir", default=settings.transactions_archive_dir)
+    parser.add_argument("--retention", type=int, default=settings.transactions_retention_months)
+    args = parser.parse_args()
+
+    asyncio.run(_run_once(args.ahead, args.archive_dir, args.retention))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,14 @@ from sqlalchemy.exc import IntegrityError, DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete
 from app.db_models.instruments import Instrument_db
-from app.db_models.users import User_db
 from app.models import Instrument as InstrumentSchema, Ok
 from app.db_session_provider import get_db
-from app.dependencies import check_admin_role
+from app.dependencies import AuthUser, check_admin_role
+from app.matching import discard_matcher
+from app.candles import discard_candles
+from app.sharding import dispatch, is_sharded, owner_operation
+from app.order_registry import order_registry
+from app.invalidation import INSTRUMENT, publish_invalidation
 
 router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 
@@ -15,7 +19,7 @@ router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
 @router.post("/instrument", responses={200: {"model": Ok}})
 async def add_instrument(
         instrument: InstrumentSchema,
-        user: User_db = Depends(check_admin_role),
+        user: AuthUser = Depends(check_admin_role),
         db: AsyncSession = Depends(get_db)
 ):
     existing_instrument = await db.execute(
@@ -49,7 +53,7 @@ async def add_instrument(
 @router.delete("/instrument/{ticker}", responses={200: {"model": Ok}})
 async def delete_instrument(
         ticker: str,
-        user: User_db = Depends(check_admin_role),
+        user: AuthUser = Depends(check_admin_role),
         db: AsyncSession = Depends(get_db)
 ):
     existing_instrument = await db.execute(
@@ -63,7 +67,18 @@ async def delete_instrument(
     await db.execute(
         delete(Instrument_db).where(Instrument_db.ticker == ticker)
     )
+    await publish_invalidation(db, INSTRUMENT, ticker)
 
     await db.commit()
+    await dispatch(ticker, _discard_instrument, ticker)
+    if is_sharded():
+        order_registry.discard(ticker=ticker)
 
     return Ok()
+
+
+@owner_operation
+async def _discard_instrument(ticker: str):
+    discard_matcher(ticker)
+    discard_candles(ticker)
+    order_registry.discard(ticker=ticker)
@@ -1,12 +1,13 @@
 from uuid import UUID
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from app.models import Body_deposit_api_v1_balance_deposit_post, Body_withdraw_api_v1_balance_withdraw_post, Ok
 from app.db_models.balances import Balance_db
 from app.db_models.users import User_db
 from typing import Dict
-from app.dependencies import check_admin_role, get_api_key
-from app.db_session_provider import get_db
+from app.dependencies import AuthUser, check_admin_role, get_api_key, get_user
+from app.db_session_provider import get_db, get_read_db
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
@@ -15,28 +16,19 @@ admin_balance_router = APIRouter(prefix="/api/v1/admin/balance", tags=["admin",
 
 
 @router.get("", responses={200: {"model": Dict[str, float]}})
-async def get_balances(api_key: str = Depends(get_api_key), db: AsyncSession = Depends(get_db)):
-    user_result = await db.execute(
-        select(User_db).where(User_db.api_key == api_key)
-    )
-    user = user_result.scalar_one_or_none()
-
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+async def get_balances(user: AuthUser = Depends(get_user), db: AsyncSession = Depends(get_read_db)):
     balances_result = await db.execute(
-        select(Balance_db).where(Balance_db.user_id == user.id)
+        select(Balance_db.ticker, Balance_db.amount).where(Balance_db.user_id == user.id)
     )
-    balances = balances_result.scalars().all()
 
-    return {balance.ticker: balance.amount for balance in balances}
+    return ORJSONResponse({ticker: amount for ticker, amount in balances_result})
 
 
 @admin_balance_router.post("/deposit", responses={200: {"model": Ok}})
 async def deposit(
         request: Body_deposit_api_v1_balance_deposit_post,
         api_key: str = Depends(get_api_key),
-        user: User_db = Depends(check_admin_role),
+        user: AuthUser = Depends(check_admin_role),
         db: AsyncSession = Depends(get_db)
 ):
     user_result = await db.execute(
@@ -72,7 +64,7 @@ async def deposit(
 async def withdraw(
         request: Body_withdraw_api_v1_balance_withdraw_post,
         api_key: str = Depends(get_api_key),
-        user: User_db = Depends(check_admin_role),
+        user: AuthUser = Depends(check_admin_role),
         db: AsyncSession = Depends(get_db)
 ):
     user_result = await db.execute(
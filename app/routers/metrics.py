@@ -0,0 +1,79 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from app.db_session_provider import engine, read_engine
+from app.dependencies import user_cache
+from app.matching import in_flight, loaded_matchers
+from app.metrics import count_query
+from app.order_registry import order_registry
+from app.invalidation import listener_stats
+
+router = APIRouter(tags=["metrics"])
+
+_engines = {"primary": engine}
+if read_engine is not engine:
+    _engines["replica"] = read_engine
+
+for _engine in _engines.values():
+    event.listen(_engine.sync_engine, "before_cursor_execute", count_query)
+
+
+class ExchangeCollector:
+    # State that already lives in memory is read at scrape time, so it costs
+    # nothing on the request path.
+    def collect(self):
+        depth = GaugeMetricFamily("orderbook_levels", "Price levels in the book", labels=["ticker", "side"])
+        quantity = GaugeMetricFamily("orderbook_quantity", "Resting quantity in the book", labels=["ticker", "side"])
+        queue = GaugeMetricFamily("matcher_queue_depth", "Commands waiting for the matcher", labels=["ticker"])
+        for matcher in loaded_matchers():
+            ticker = matcher.ticker
+            queue.add_metric([ticker], matcher.queue_depth)
+            book = matcher.book
+            if book is None:
+                continue
+            for side in (book.bids, book.asks):
+                depth.add_metric([ticker, side.direction], len(side))
+                quantity.add_metric([ticker, side.direction], side.qty)
+        yield depth
+        yield quantity
+        yield queue
+        yield GaugeMetricFamily("matcher_in_flight", "Commands queued or running across all matchers",
+                                value=in_flight())
+
+        pool_size = GaugeMetricFamily("db_pool_size", "Connections kept in the pool", labels=["engine"])
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections in use", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Connections opened above pool size", labels=["engine"])
+        for name, db_engine in _engines.items():
+            pool = db_engine.pool
+            pool_size.add_metric([name], pool.size())
+            checked_out.add_metric([name], pool.checkedout())
+            overflow.add_metric([name], max(pool.overflow(), 0))
+        yield pool_size
+        yield checked_out
+        yield overflow
+
+        stats = user_cache.stats()
+        yield GaugeMetricFamily("auth_cache_size", "API keys in the auth cache", value=stats["size"])
+        for name in ("hits", "misses", "evictions"):
+            yield CounterMetricFamily(f"auth_cache_{name}", f"Auth cache {name}", value=stats[name])
+
+        stats = order_registry.stats()
+        yield GaugeMetricFamily("order_cache_size", "Orders in the order registry", value=stats["size"])
+        for name in ("hits", "misses", "evictions"):
+            yield CounterMetricFamily(f"order_cache_{name}", f"Order registry {name}", value=stats[name])
+
+        stats = listener_stats()
+        if stats is not None:
+            yield GaugeMetricFamily("invalidation_listener_connected", "Whether the invalidation listener is connected",
+                                    value=int(stats["connected"]))
+            yield CounterMetricFamily("invalidation_listener_reconnects", "Invalidation listener reconnections",
+                                      value=stats["reconnects"])
+
+
+REGISTRY.register(ExchangeCollector())
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,252 +1,403 @@
+import asyncio
+import time
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Union, Optional
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Dict, List, Optional, Tuple, Type, Union
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db_models.users import User_db
 from app.db_models.limit_orders import LimitOrder_db
 from app.db_models.market_orders import MarketOrder_db
-from app.db_models.orderbook import OrderBook_db
+from app.db_models.resting_orders import RestingOrder_db
 from app.db_models.transactions import Transaction_db
 from app.db_models.balances import Balance_db
+from app.order_book import OrderBook, Fill
+from app.config import settings
+from app.matching import TickerMatcher, get_matcher, load_book
+from app.order_registry import LIMIT, MARKET, OrderEntry, order_registry
+from app.candles import record_trades, seed_candles
+from app.metrics import MATCHED_LEVELS, STAGE_CHECK_FUNDS, STAGE_COMMIT, STAGE_CREATE_RECORD, STAGE_LOAD_BOOK, \
+    STAGE_MATCHING
+from app.journal import Event, order_event, fill_event, cancel_event
 from app.models import LimitOrderBody, LimitOrder, MarketOrder, MarketOrderBody, CreateOrderResponse, Direction, \
-    OrderStatus, Ok
-from app.db_session_provider import get_db
+    OrderStatus, Ok, BatchOrderError
+from app.db_session_provider import get_db, get_read_db, AsyncSessionLocal
 from uuid import uuid4, UUID
-from app.dependencies import get_api_key, get_user
-from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import cast, String
-from sqlalchemy import select
+from app.dependencies import AuthUser, get_user
+from app.admission import check_order_rate
+from app.sharding import dispatch, owner_operation
+from app.invalidation import publish_book_changed
+from sqlalchemy import DateTime, Integer, String, case, column, literal, null, type_coerce, union_all, values
+from sqlalchemy import select, update, delete, tuple_
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert
 from sqlalchemy.exc import IntegrityError, DBAPIError
 
 router = APIRouter(prefix="/api/v1/order", tags=["order"])
 
+ACTIVE_STATUSES = [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED, OrderStatus.EXECUTED]
+# Page size when a cursor is given without a limit
+DEFAULT_ORDER_PAGE = 100
+
 
 @router.post("", responses={200: {"model": CreateOrderResponse}})
 async def create_order(
         order_body: LimitOrderBody | MarketOrderBody,
-        api_key: str = Depends(get_api_key),
-        db: AsyncSession = Depends(get_db)
+        user: AuthUser = Depends(get_user)
 ):
-    async with db.begin():
-        try:
-            user = await get_user(api_key, db)
-
-            await _check_and_reserve_funds(
-                db=db,
-                user_id=user.id,
-                ticker=order_body.ticker,
-                direction=order_body.direction,
-                qty=order_body.qty,
-                price=order_body.price if isinstance(order_body, LimitOrderBody) else None
-            )
+    check_order_rate(user)
+
+    return await dispatch(order_body.ticker, _submit_order, user, order_body)
 
-            order = await _create_order_record(db, user, order_body)
 
-            orderbook = await _get_or_create_orderbook(db, order_body.ticker)
+@router.post("/batch", responses={200: {"model": List[Union[CreateOrderResponse, BatchOrderError]]}})
+async def create_orders_batch(
+        order_bodies: List[Union[LimitOrderBody, MarketOrderBody]],
+        user: AuthUser = Depends(get_user)
+):
+    if not order_bodies or len(order_bodies) > settings.order_batch_size:
+        raise HTTPException(
+            status_code=422, detail=f"Batch must contain from 1 to {settings.order_batch_size} orders"
+        )
+    check_order_rate(user, len(order_bodies))
 
-            await _execute_order(db, order, orderbook, order_body)
+    indexes_by_ticker: Dict[str, List[int]] = defaultdict(list)
+    for index, order_body in enumerate(order_bodies):
+        indexes_by_ticker[order_body.ticker].append(index)
 
-            return CreateOrderResponse(success=True, order_id=order.id)
+    results: List[Union[CreateOrderResponse, BatchOrderError]] = [None] * len(order_bodies)
+    # Load is shed by the process owning each ticker, so capacity is
+    # checked there rather than here
+    shed: List[HTTPException] = []
 
+    async def submit_group(ticker: str, indexes: List[int]):
+        group = [order_bodies[index] for index in indexes]
+        try:
+            group_results = await dispatch(ticker, _submit_order_batch, user, ticker, group)
         except Exception as e:
-            await db.rollback()
-            raise _handle_error(e)
+            error = _handle_error(e)
+            if error.status_code == 503:
+                shed.append(error)
+            group_results = [BatchOrderError(error=str(error.detail))] * len(indexes)
 
+        for index, result in zip(indexes, group_results):
+            results[index] = result
 
-@router.get("", responses={200: {"model": List[Union[LimitOrder, MarketOrder]]}})
-async def list_orders(
-        api_key: str = Depends(get_api_key),
-        db: AsyncSession = Depends(get_db)
-):
-    user_result = await db.execute(
-        select(User_db).where(User_db.api_key == api_key)
-    )
+    await asyncio.gather(*(submit_group(ticker, indexes) for ticker, indexes in indexes_by_ticker.items()))
 
-    user = user_result.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    if len(shed) == len(indexes_by_ticker):
+        # Nothing was placed, so the whole batch can be retried later
+        raise shed[0]
 
-    limit_orders_result = await db.execute(
-        select(LimitOrder_db).where(
-            (LimitOrder_db.user_id == user.id) &
-            (cast(LimitOrder_db.status, String) != "CANCELLED")
-        )
-    )
-    limit_orders = limit_orders_result.scalars().all()
+    return results
 
-    market_orders_result = await db.execute(
-        select(MarketOrder_db).where(
-            (MarketOrder_db.user_id == user.id) &
-            (cast(MarketOrder_db.status, String) != "CANCELLED")
-        )
-    )
-    market_orders = market_orders_result.scalars().all()
 
-    orders = []
-    for order in limit_orders:
-        orders.append(LimitOrder(
-            id=order.id,
-            status=OrderStatus(order.status),
-            user_id=order.user_id,
-            timestamp=order.timestamp.isoformat() + "Z",
-            body=LimitOrderBody(
-                direction=Direction(order.direction),
-                ticker=order.ticker,
-                qty=order.qty,
-                price=order.price
-            ),
-            filled=order.filled
-        ))
+@router.get("", responses={200: {"model": List[Union[LimitOrder, MarketOrder]]}})
+async def list_orders(
+        status: Optional[OrderStatus] = None,
+        ticker: Optional[str] = None,
+        direction: Optional[Direction] = None,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = None,
+        user: AuthUser = Depends(get_user),
+        db: AsyncSession = Depends(get_read_db)
+):
+    # Newest first across both order tables, paged by the (timestamp, id) key
+    # of the last row returned in X-Next-Cursor. Without a limit or a cursor
+    # every order is returned, as before paging. Cancelled orders are listed
+    # only when asked for by status.
+    statuses = [status] if status is not None else ACTIVE_STATUSES
+    after = _parse_order_cursor(cursor) if cursor is not None else None
+    if limit is None and cursor is not None:
+        limit = DEFAULT_ORDER_PAGE
+
+    # One branch per table and status, so each is a range scan of the
+    # (user_id, status, timestamp, id) index that stops after `limit` rows
+    branches = [
+        _order_page_query(model, user.id, order_status, ticker, direction, after, limit)
+        for model in (LimitOrder_db, MarketOrder_db)
+        for order_status in statuses
+    ]
+    page = union_all(*branches).subquery()
+    orders_result = await db.execute(
+        select(page).order_by(page.c.timestamp.desc(), page.c.id.desc()).limit(limit)
+    )
+    rows = orders_result.all()
 
-    for order in market_orders:
-        orders.append(MarketOrder(
-            id=order.id,
-            status=OrderStatus(order.status),
-            user_id=order.user_id,
-            timestamp=order.timestamp.isoformat() + "Z",
-            body=MarketOrderBody(
-                direction=Direction(order.direction),
-                ticker=order.ticker,
-                qty=order.qty
-            )
-        ))
+    headers = {}
+    if limit is not None and len(rows) == limit:
+        headers["X-Next-Cursor"] = f"{rows[-1].timestamp.isoformat()}_{rows[-1].id}"
 
-    return orders
+    return ORJSONResponse([_order_to_dict(row) for row in rows], headers=headers)
 
 
 @router.get("/{order_id}", responses={200: {"model": Union[LimitOrder, MarketOrder]}})
 async def get_order(
         order_id: UUID,
-        api_key: str = Depends(get_api_key),
+        user: AuthUser = Depends(get_user),
         db: AsyncSession = Depends(get_db)
 ):
-    user_result = await db.execute(
-        select(User_db).where(User_db.api_key == api_key)
-    )
+    order = await _locate_order(db, order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
 
-    user = user_result.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    if order.user_id != user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
 
-    limit_order_result = await db.execute(
-        select(LimitOrder_db).where(LimitOrder_db.id == order_id)
-    )
-    limit_order = limit_order_result.scalar_one_or_none()
+    if order.status is None:
+        # Only the location is cached: read the state from the one table
+        model = LimitOrder_db if order.kind == LIMIT else MarketOrder_db
+        order_result = await db.execute(select(*_order_columns(model)).where(model.id == order_id))
+        order = order_result.one()
 
-    market_order_result = await db.execute(
-        select(MarketOrder_db).where(MarketOrder_db.id == order_id)
-    )
-    market_order = market_order_result.scalar_one_or_none()
-
-    if limit_order:
-        if limit_order.user_id != user.id:
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        return LimitOrder(
-            id=limit_order.id,
-            status=OrderStatus(limit_order.status),
-            user_id=limit_order.user_id,
-            timestamp=limit_order.timestamp.isoformat() + "Z",
-            body=LimitOrderBody(
-                direction=Direction(limit_order.direction),
-                ticker=limit_order.ticker,
-                qty=limit_order.qty,
-                price=limit_order.price
-            ),
-            filled=limit_order.filled
-        )
-    elif market_order:
-        if market_order.user_id != user.id:
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        return MarketOrder(
-            id=market_order.id,
-            status=OrderStatus(market_order.status),
-            user_id=market_order.user_id,
-            timestamp=market_order.timestamp.isoformat() + "Z",
-            body=MarketOrderBody(
-                direction=Direction(market_order.direction),
-                ticker=market_order.ticker,
-                qty=market_order.qty
-            )
-        )
+    return ORJSONResponse(_order_to_dict(order))
+
+
+@router.delete("", responses={200: {"model": Ok}})
+async def cancel_orders(
+        ticker: Optional[str] = None,
+        side: Optional[Direction] = None,
+        user: AuthUser = Depends(get_user),
+        db: AsyncSession = Depends(get_db)
+):
+    if ticker is not None:
+        tickers = [ticker]
     else:
-        raise HTTPException(status_code=404, detail="Order not found")
+        tickers_result = await db.execute(
+            select(RestingOrder_db.ticker).where(RestingOrder_db.user_id == user.id).distinct()
+        )
+        tickers = tickers_result.scalars().all()
+
+    await asyncio.gather(*(dispatch(ticker, _submit_mass_cancel, user.id, ticker, side) for ticker in tickers))
+
+    return Ok()
 
 
 @router.delete("/{order_id}", responses={200: {"model": Ok}})
 async def cancel_order(
         order_id: UUID,
-        api_key: str = Depends(get_api_key),
+        user: AuthUser = Depends(get_user),
         db: AsyncSession = Depends(get_db)
 ):
-    user_result = await db.execute(
-        select(User_db).where(User_db.api_key == api_key)
-    )
-    user = user_result.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    limit_order_result = await db.execute(
-        select(LimitOrder_db).where(LimitOrder_db.id == order_id)
-    )
-    order = limit_order_result.scalar_one_or_none()
+    order = await _locate_order(db, order_id)
 
-    if not order:
+    if order is None or order.kind != LIMIT:
         raise HTTPException(status_code=404, detail="Limit order not found (cannot cancel market orders)")
 
     if order.user_id != user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    if order.status not in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]:
-        raise HTTPException(status_code=400, detail="Order cannot be cancelled")
+    return await dispatch(order.ticker, _submit_cancel, user.id, order.ticker, order_id)
 
-    unfilled_qty = order.qty - order.filled
-    if unfilled_qty <= 0:
-        raise HTTPException(status_code=400, detail="Order already fully executed")
 
-    if order.direction == "BUY":
-        refund_amount = unfilled_qty * order.price
-        balance = await _get_balance(db, user.id, "RUB")
-        balance.amount += refund_amount
-    else:
-        balance = await _get_balance(db, user.id, order.ticker)
-        balance.amount += unfilled_qty
+# Matcher commands are submitted through these in the process owning the
+# ticker, which is this one unless matching is sharded across workers.
+@owner_operation
+async def _submit_order(user: AuthUser, order_body: LimitOrderBody | MarketOrderBody) -> CreateOrderResponse:
+    return await get_matcher(order_body.ticker).submit(
+        lambda matcher: _process_order(matcher, user, order_body), sheddable=True
+    )
 
-    db.add(balance)
 
-    orderbook_result = await db.execute(
-        select(OrderBook_db).where(OrderBook_db.ticker == order.ticker)
+@owner_operation
+async def _submit_order_batch(
+        user: AuthUser,
+        ticker: str,
+        order_bodies: List[Union[LimitOrderBody, MarketOrderBody]]
+) -> List[Union[CreateOrderResponse, BatchOrderError]]:
+    return await get_matcher(ticker).submit(
+        lambda matcher: _process_order_batch(matcher, user, order_bodies), sheddable=True
     )
-    orderbook = orderbook_result.scalar_one_or_none()
 
-    if orderbook:
-        levels = orderbook.bid_levels if order.direction == "BUY" else orderbook.ask_levels
-        for level in levels:
-            if level["price"] == order.price:
-                level["qty"] -= unfilled_qty
-                break
 
-        levels[:] = [lvl for lvl in levels if lvl["qty"] > 0]
+@owner_operation
+async def _submit_cancel(user_id: UUID, ticker: str, order_id: UUID) -> Ok:
+    return await get_matcher(ticker).submit(lambda matcher: _process_cancel(matcher, user_id, order_id))
 
-        if order.direction == "BUY":
-            orderbook.bid_levels = sorted(levels, key=lambda x: -x["price"])
-            flag_modified(orderbook, "bid_levels")
-        else:
-            orderbook.ask_levels = sorted(levels, key=lambda x: x["price"])
-            flag_modified(orderbook, "ask_levels")
 
-    order.status = OrderStatus.CANCELLED
-    db.add(order)
+@owner_operation
+async def _submit_mass_cancel(user_id: UUID, ticker: str, side: Optional[Direction]) -> Ok:
+    return await get_matcher(ticker).submit(lambda matcher: _process_mass_cancel(matcher, user_id, side))
+
+
+async def _process_order(
+        matcher: TickerMatcher,
+        user: AuthUser,
+        order_body: LimitOrderBody | MarketOrderBody
+) -> CreateOrderResponse:
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            try:
+                order, fills = await _place_order(db, matcher, user, order_body)
+                await publish_book_changed(db, matcher.ticker, (fill.maker_order_id for fill in fills))
+
+            except Exception as e:
+                await db.rollback()
+                raise _handle_error(e)
+
+            commit_started = time.perf_counter()
+        STAGE_COMMIT.observe(time.perf_counter() - commit_started)
+
+    matcher.record(_order_events(order, fills))
+    _record_trades(order, fills)
+    _register_orders([(order, fills)])
+
+    return CreateOrderResponse(success=True, order_id=order.id)
+
+
+async def _process_order_batch(
+        matcher: TickerMatcher,
+        user: AuthUser,
+        order_bodies: List[LimitOrderBody | MarketOrderBody]
+) -> List[Union[CreateOrderResponse, BatchOrderError]]:
+    # All orders of one ticker share a transaction; each runs in its own
+    # savepoint so a rejected order does not undo the others.
+    results = []
+    events = []
+    placed = []
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            for order_body in order_bodies:
+                book = matcher.book
+                version = book.version if book is not None else None
+                try:
+                    async with db.begin_nested():
+                        order, fills = await _place_order(db, matcher, user, order_body)
+
+                except Exception as e:
+                    if matcher.book is not None and (matcher.book is not book or matcher.book.version != version):
+                        # The savepoint undid changes the book already applied
+                        matcher.book = await load_book(db, matcher.ticker)
+                    results.append(BatchOrderError(error=str(_handle_error(e).detail)))
+                    continue
+
+                events.extend(_order_events(order, fills))
+                placed.append((order, fills))
+                results.append(CreateOrderResponse(success=True, order_id=order.id))
+
+            if placed:
+                await publish_book_changed(
+                    db, matcher.ticker, (fill.maker_order_id for _, fills in placed for fill in fills)
+                )
+
+    matcher.record(events)
+    for order, fills in placed:
+        _record_trades(order, fills)
+    _register_orders(placed)
+
+    return results
+
+
+async def _place_order(
+        db: AsyncSession,
+        matcher: TickerMatcher,
+        user: AuthUser,
+        order_body: LimitOrderBody | MarketOrderBody
+) -> Tuple[Union[LimitOrder_db, MarketOrder_db], List[Fill]]:
+    with STAGE_CHECK_FUNDS.time():
+        await _check_and_reserve_funds(
+            db=db,
+            user_id=user.id,
+            ticker=order_body.ticker,
+            direction=order_body.direction,
+            qty=order_body.qty,
+            price=order_body.price if isinstance(order_body, LimitOrderBody) else None
+        )
+
+    with STAGE_CREATE_RECORD.time():
+        order = await _create_order_record(db, user, order_body)
+
+    with STAGE_LOAD_BOOK.time():
+        book = await matcher.ensure_book(db)
+        await seed_candles(db, matcher.ticker)
+
+    with STAGE_MATCHING.time():
+        fills = await _execute_order(db, order, book, order_body)
+    MATCHED_LEVELS.observe(len({fill.price for fill in fills}))
+
+    return order, fills
+
 
-    await db.commit()
+async def _process_cancel(matcher: TickerMatcher, user_id: UUID, order_id: UUID) -> Ok:
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            order = await db.get(LimitOrder_db, order_id)
+
+            if order.status not in [OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]:
+                raise HTTPException(status_code=400, detail="Order cannot be cancelled")
+
+            unfilled_qty = order.qty - order.filled
+            if unfilled_qty <= 0:
+                raise HTTPException(status_code=400, detail="Order already fully executed")
+
+            # A relative upsert: matchers of other tickers may be settling the
+            # same user's RUB balance concurrently
+            if order.direction == "BUY":
+                await _apply_balance_deltas(db, {(user_id, "RUB"): unfilled_qty * order.price})
+            else:
+                await _apply_balance_deltas(db, {(user_id, order.ticker): unfilled_qty})
+
+            book = await matcher.ensure_book(db)
+            book.cancel(order.id)
+            await db.execute(
+                delete(RestingOrder_db).where(RestingOrder_db.order_id == order.id)
+            )
+
+            order.status = OrderStatus.CANCELLED
+            db.add(order)
+            await publish_book_changed(db, matcher.ticker, [order.id])
+
+    matcher.record([cancel_event(order.ticker, order.id)])
+    order_registry.cancel(order.id)
+
+    return Ok()
+
+
+async def _process_mass_cancel(matcher: TickerMatcher, user_id: UUID, side: Optional[Direction]) -> Ok:
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            query = select(RestingOrder_db).where(
+                RestingOrder_db.ticker == matcher.ticker,
+                RestingOrder_db.user_id == user_id
+            )
+            if side is not None:
+                query = query.where(RestingOrder_db.direction == side.value)
+            resting_orders = (await db.execute(query)).scalars().all()
+            if not resting_orders:
+                return Ok()
+
+            refunds: Dict[Tuple[UUID, str], int] = defaultdict(int)
+            for resting_order in resting_orders:
+                if resting_order.direction == "BUY":
+                    refunds[(user_id, "RUB")] += resting_order.qty * resting_order.price
+                else:
+                    refunds[(user_id, matcher.ticker)] += resting_order.qty
+            await _apply_balance_deltas(db, refunds)
+
+            order_ids = [resting_order.order_id for resting_order in resting_orders]
+            await db.execute(
+                delete(RestingOrder_db).where(RestingOrder_db.order_id.in_(order_ids))
+            )
+            await db.execute(
+                update(LimitOrder_db)
+                .where(LimitOrder_db.id.in_(order_ids))
+                .values(status="CANCELLED")
+            )
+
+            book = await matcher.ensure_book(db)
+            for order_id in order_ids:
+                book.cancel(order_id)
+            await publish_book_changed(db, matcher.ticker, order_ids)
+
+    matcher.record([cancel_event(matcher.ticker, order_id) for order_id in order_ids])
+    for order_id in order_ids:
+        order_registry.cancel(order_id)
 
     return Ok()
 
 
 async def _create_order_record(
         db: AsyncSession,
-        user: User_db,
+        user: AuthUser,
         order_body: LimitOrderBody | MarketOrderBody
 ) -> Union[LimitOrder_db, MarketOrder_db]:
     order_id = uuid4()
@@ -280,282 +431,258 @@ async def _create_order_record(
     return order
 
 
-async def _get_or_create_orderbook(
-        db: AsyncSession,
-        ticker: str
-) -> OrderBook_db:
-    orderbook = await db.execute(
-        select(OrderBook_db)
-        .where(OrderBook_db.ticker == ticker)
-    )
-    result_orderbook = orderbook.scalar_one_or_none()
-
-    if not result_orderbook:
-        result_orderbook = OrderBook_db(
-            ticker=ticker,
-            bid_levels=[],
-            ask_levels=[]
-        )
-        db.add(result_orderbook)
-        await db.flush()
-
-    return result_orderbook
-
-
 async def _execute_order(
         db: AsyncSession,
         order: Union[LimitOrder_db, MarketOrder_db],
-        orderbook: OrderBook_db,
+        book: OrderBook,
         order_body: LimitOrderBody | MarketOrderBody
-):
+) -> List[Fill]:
     if isinstance(order_body, MarketOrderBody):
-        await _execute_market_order(db, order, orderbook)
+        return await _execute_market_order(db, order, book)
     else:
-        await _execute_limit_order(db, order, orderbook, order_body)
+        return await _execute_limit_order(db, order, book, order_body)
 
 
 async def _execute_market_order(
         db: AsyncSession,
         order: MarketOrder_db,
-        orderbook: OrderBook_db
-):
-    is_buy = order.direction == "BUY"
-    levels = orderbook.ask_levels if is_buy else orderbook.bid_levels
-
-    total_available_qty = sum(level["qty"] for level in levels)
-    if total_available_qty < order.qty:
+        book: OrderBook
+) -> List[Fill]:
+    if not book.can_fill(order.direction, order.qty):
         order.filled = 0
         order.status = OrderStatus.NEW
-        return
-
-    remaining_qty = order.qty
-    executed_levels = []
-    executed_qty = 0
-
-    for level in levels:
-        if remaining_qty <= 0:
-            break
+        return []
 
-        price = level["price"]
-        trade_qty = min(level["qty"], remaining_qty)
-        remaining_qty -= trade_qty
-        executed_qty += trade_qty
+    fills = book.match(order.direction, order.qty)
+    await _settle_fills(db, order, fills)
 
-        buyer_id = order.user_id if is_buy else UUID(level["user_id"])
-        seller_id = UUID(level["user_id"]) if is_buy else order.user_id
-
-        await _create_transaction(
-            db=db,
-            ticker=order.ticker,
-            amount=trade_qty,
-            price=price,
-            buyer_id=buyer_id,
-            seller_id=seller_id
-        )
-
-        if is_buy:
-            level["reserved_funds"] -= trade_qty * price
-        else:
-            level["reserved_funds"] -= trade_qty
-        level["reserved_funds"] = max(level["reserved_funds"], 0)
-
-        level["qty"] -= trade_qty
-
-        if "order_id" in level:
-            matched_order_id = UUID(level["order_id"])
-            matched_order = await db.get(LimitOrder_db, matched_order_id)
-            if matched_order:
-                matched_order.filled += trade_qty
-                if matched_order.filled >= matched_order.qty:
-                    matched_order.status = OrderStatus.EXECUTED
-                else:
-                    matched_order.status = OrderStatus.PARTIALLY_EXECUTED
-                db.add(matched_order)
-
-        if level["qty"] <= 0:
-            executed_levels.append(level)
-
-    for level in executed_levels:
-        levels.remove(level)
-
-    if is_buy:
-        orderbook.ask_levels = levels
-        flag_modified(orderbook, "ask_levels")
-    else:
-        orderbook.bid_levels = levels
-        flag_modified(orderbook, "bid_levels")
-
-    order.filled = executed_qty
+    order.filled = sum(fill.qty for fill in fills)
     order.status = OrderStatus.EXECUTED
 
+    return fills
+
 
 async def _execute_limit_order(
         db: AsyncSession,
         order: LimitOrder_db,
-        orderbook: OrderBook_db,
+        book: OrderBook,
         order_body: LimitOrderBody
-):
-    levels = orderbook.ask_levels if order.direction == "BUY" else orderbook.bid_levels
-    is_buy = order.direction == "BUY"
-
-    matched_qty = 0
-    remaining_qty = order.qty
-    executed_levels = []
-
-    for level in levels:
-        if remaining_qty <= 0:
-            break
-
-        level_price = level["price"]
-        if (is_buy and level_price > order.price) or (not is_buy and level_price < order.price):
-            break
-
-        trade_qty = min(remaining_qty, level["qty"])
-        remaining_qty -= trade_qty
-        matched_qty += trade_qty
-
-        buyer_id = order.user_id if is_buy else UUID(level["user_id"])
-        seller_id = UUID(level["user_id"]) if is_buy else order.user_id
-
-        await _create_transaction(
-            db=db,
-            ticker=order.ticker,
-            amount=trade_qty,
-            price=level_price,
-            buyer_id=buyer_id,
-            seller_id=seller_id
-        )
-
-        if is_buy:
-            level["reserved_funds"] -= trade_qty
-        else:
-            level["reserved_funds"] -= trade_qty * level_price
-        level["reserved_funds"] = max(level["reserved_funds"], 0)
-
-        level["qty"] -= trade_qty
-        if level["qty"] <= 0:
-            executed_levels.append(level)
-
-            if "order_id" in level:
-                matched_order_id = UUID(level["order_id"])
-                matched_order = await db.get(LimitOrder_db, matched_order_id)
-                if matched_order:
-                    matched_order.filled = matched_order.qty
-                    matched_order.status = OrderStatus.EXECUTED
-                    db.add(matched_order)
-        else:
-            if "order_id" in level:
-                matched_order_id = UUID(level["order_id"])
-                matched_order = await db.get(LimitOrder_db, matched_order_id)
-                if matched_order:
-                    matched_order.filled += trade_qty
-                    matched_order.status = OrderStatus.PARTIALLY_EXECUTED
-                    db.add(matched_order)
-
-    for lvl in executed_levels:
-        levels.remove(lvl)
-
-    if is_buy:
-        orderbook.ask_levels = levels
-        flag_modified(orderbook, "ask_levels")
-    else:
-        orderbook.bid_levels = levels
-        flag_modified(orderbook, "bid_levels")
+) -> List[Fill]:
+    fills = book.match(order.direction, order.qty, order.price)
+    await _settle_fills(db, order, fills)
 
+    matched_qty = sum(fill.qty for fill in fills)
     order.filled = matched_qty
 
     if matched_qty == 0:
         order.status = OrderStatus.NEW
-        await _add_to_orderbook(orderbook, order_body, 0, order.user_id, order.id)
-    elif remaining_qty == 0:
+        await _add_to_orderbook(db, book, order, 0)
+    elif matched_qty == order.qty:
         order.status = OrderStatus.EXECUTED
     else:
         order.status = OrderStatus.PARTIALLY_EXECUTED
-        await _add_to_orderbook(orderbook, order_body, matched_qty, order.user_id, order.id)
+        await _add_to_orderbook(db, book, order, matched_qty)
 
+    return fills
 
-async def _create_transaction(
-        db: AsyncSession,
-        ticker: str,
-        amount: int,
-        price: int,
-        buyer_id: UUID,
-        seller_id: UUID
-):
-    transaction = Transaction_db(
-        ticker=ticker,
-        amount=amount,
-        price=price,
-        timestamp=datetime.utcnow()
+
+def _order_events(order: Union[LimitOrder_db, MarketOrder_db], fills: List[Fill]) -> List[Event]:
+    price = order.price if isinstance(order, LimitOrder_db) else None
+    events = [order_event(order.ticker, order.id, order.user_id, order.direction, price, order.qty)]
+    events.extend(
+        fill_event(order.ticker, order.id, fill.maker_order_id, fill.price, fill.qty)
+        for fill in fills
     )
-    db.add(transaction)
 
-    total_cost = amount * price
+    return events
 
-    buyer_rub_balance = await _get_balance(db, buyer_id, "RUB")
-    buyer_rub_balance.amount -= total_cost
-    db.add(buyer_rub_balance)
 
-    await _update_balance(db, buyer_id, ticker, amount)
+def _record_trades(order: Union[LimitOrder_db, MarketOrder_db], fills: List[Fill]):
+    if fills:
+        record_trades(order.ticker, order.timestamp, [(fill.price, fill.qty) for fill in fills])
 
-    seller_asset_balance = await _get_balance(db, seller_id, ticker)
-    seller_asset_balance.amount -= amount
-    db.add(seller_asset_balance)
 
-    await _update_balance(db, seller_id, "RUB", total_cost)
+def _register_orders(placed: List[Tuple[Union[LimitOrder_db, MarketOrder_db], List[Fill]]]):
+    # Called once the orders are committed. Fills go first: a maker placed
+    # earlier in the same batch is then overwritten by its committed state,
+    # which already includes them.
+    for _, fills in placed:
+        for fill in fills:
+            order_registry.fill(fill.maker_order_id, fill.qty, fill.maker_remaining)
 
+    for order, _ in placed:
+        is_limit = isinstance(order, LimitOrder_db)
+        order_registry.put(OrderEntry(
+            id=order.id,
+            kind=LIMIT if is_limit else MARKET,
+            user_id=order.user_id,
+            ticker=order.ticker,
+            direction=Direction(order.direction).value,
+            qty=order.qty,
+            price=order.price if is_limit else None,
+            timestamp=order.timestamp,
+            status=OrderStatus(order.status).value,
+            filled=order.filled if is_limit else 0
+        ))
 
-def _merge_level(levels: list[dict], new_level: dict):
-    for level in levels:
-        if (
-                level["price"] == new_level["price"] and
-                level.get("user_id") == new_level.get("user_id") and
-                level.get("order_id") == new_level.get("order_id")
-        ):
-            level["qty"] += new_level["qty"]
-            for key in ["reserved_rub", "reserved_funds"]:
-                if key in new_level:
-                    level[key] = level.get(key, 0) + new_level.get(key, 0)
-            return
 
-    levels.append(new_level)
+async def _settle_fills(
+        db: AsyncSession,
+        order: Union[LimitOrder_db, MarketOrder_db],
+        fills: List[Fill]
+):
+    if not fills:
+        return
+
+    is_buy = order.direction == "BUY"
+    # Trades carry the order's timestamp so candles built in memory match
+    # the ones rebuilt from transactions
+    timestamp = order.timestamp
+    deltas: Dict[Tuple[UUID, str], int] = defaultdict(int)
+    transactions = []
+
+    for fill in fills:
+        buyer_id = order.user_id if is_buy else fill.maker_user_id
+        seller_id = fill.maker_user_id if is_buy else order.user_id
+        total_cost = fill.qty * fill.price
+
+        deltas[(buyer_id, "RUB")] -= total_cost
+        deltas[(buyer_id, order.ticker)] += fill.qty
+        deltas[(seller_id, order.ticker)] -= fill.qty
+        deltas[(seller_id, "RUB")] += total_cost
+
+        transactions.append({
+            "ticker": order.ticker,
+            "amount": fill.qty,
+            "price": fill.price,
+            "timestamp": timestamp
+        })
+
+    await db.execute(insert(Transaction_db).values(transactions))
+    await _apply_balance_deltas(db, deltas)
+
+    # Makers are taken off resting_orders only where their quantity is still
+    # what the book expected, so a book that no longer matches the database
+    # (another process filled a maker first) fails the transaction and is
+    # reloaded instead of filling the same maker twice
+    executed = [fill for fill in fills if fill.maker_remaining == 0]
+    partial = [fill for fill in fills if fill.maker_remaining > 0]
+    settled = 0
+    if executed:
+        makers = _fill_values(executed)
+        result = await db.execute(
+            delete(RestingOrder_db)
+            .where(RestingOrder_db.order_id == makers.c.order_id, RestingOrder_db.qty == makers.c.expected_qty)
+            .execution_options(synchronize_session=False)
+        )
+        settled += result.rowcount
+    if partial:
+        makers = _fill_values(partial)
+        result = await db.execute(
+            update(RestingOrder_db)
+            .where(RestingOrder_db.order_id == makers.c.order_id, RestingOrder_db.qty == makers.c.expected_qty)
+            .values(qty=RestingOrder_db.qty - makers.c.qty)
+            .execution_options(synchronize_session=False)
+        )
+        settled += result.rowcount
+    if settled != len(fills):
+        raise HTTPException(status_code=409, detail="Order book changed, retry the order")
+
+    # Returning the rows refreshes makers placed earlier in the same batch,
+    # which are still in the session
+    makers = _fill_values(fills)
+    await db.execute(
+        update(LimitOrder_db)
+        .where(LimitOrder_db.id == makers.c.order_id)
+        .values(
+            filled=LimitOrder_db.filled + makers.c.qty,
+            status=case(
+                (makers.c.expected_qty == makers.c.qty, OrderStatus.EXECUTED.value),
+                else_=OrderStatus.PARTIALLY_EXECUTED.value
+            )
+        )
+        .returning(LimitOrder_db)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+
+
+def _fill_values(fills: List[Fill]):
+    # (order_id, expected_qty, qty) of each maker, joined in by the bulk
+    # statements above
+    return values(
+        column("order_id", PG_UUID(as_uuid=True)),
+        column("expected_qty", Integer),
+        column("qty", Integer),
+        name="fills"
+    ).data([(fill.maker_order_id, fill.maker_remaining + fill.qty, fill.qty) for fill in fills])
+
+
+async def _apply_balance_deltas(db: AsyncSession, deltas: Dict[Tuple[UUID, str], int]):
+    # Net changes per (user_id, ticker) are written with one upsert. Rows are
+    # upserted in key order so concurrent settlements lock them consistently.
+    keys = sorted(key for key, delta in deltas.items() if delta != 0)
+    if not keys:
+        return
+
+    balances_result = await db.execute(
+        select(Balance_db.user_id, Balance_db.ticker, Balance_db.amount)
+        .where(tuple_(Balance_db.user_id, Balance_db.ticker).in_(keys))
+    )
+    amounts = {(user_id, ticker): amount for user_id, ticker, amount in balances_result}
+
+    for key in keys:
+        # Debits were checked when the orders were placed; a credit must
+        # still not leave a balance negative.
+        if deltas[key] > 0 and amounts.get(key, 0) + deltas[key] < 0:
+            raise HTTPException(status_code=400, detail=f"Insufficient balance for {key[1]}")
+
+    statement = insert(Balance_db).values([
+        {"user_id": user_id, "ticker": ticker, "amount": deltas[(user_id, ticker)]}
+        for user_id, ticker in keys
+    ])
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Balance_db.user_id, Balance_db.ticker],
+            set_={"amount": Balance_db.amount + statement.excluded.amount}
+        )
+    )
 
 
 async def _add_to_orderbook(
-        orderbook: OrderBook_db,
-        order_body: LimitOrderBody,
-        executed_qty: int,
-        user_id: UUID,
-        order_id: UUID
+        db: AsyncSession,
+        book: OrderBook,
+        order: LimitOrder_db,
+        executed_qty: int
 ):
-    qty_left = order_body.qty - executed_qty
+    qty_left = order.qty - executed_qty
     if qty_left <= 0:
         return
 
-    reserved_funds = qty_left * order_body.price if order_body.direction == "BUY" else qty_left
-
-    new_level = {
-        "price": order_body.price,
-        "qty": qty_left,
-        "user_id": str(user_id),
-        "order_id": str(order_id),
-        "reserved_funds": reserved_funds
-    }
-
-    levels = orderbook.bid_levels if order_body.direction == "BUY" else orderbook.ask_levels
+    book.add(
+        order_id=order.id,
+        user_id=order.user_id,
+        direction=order.direction,
+        price=order.price,
+        qty=qty_left
+    )
 
-    _merge_level(levels, new_level)
-    if order_body.direction == "BUY":
-        orderbook.bid_levels = sorted(levels, key=lambda x: -x["price"])
-        flag_modified(orderbook, "bid_levels")
-    else:
-        orderbook.ask_levels = sorted(levels, key=lambda x: x["price"])
-        flag_modified(orderbook, "ask_levels")
+    db.add(RestingOrder_db(
+        order_id=order.id,
+        ticker=order.ticker,
+        direction=order.direction,
+        user_id=order.user_id,
+        price=order.price,
+        qty=qty_left,
+        timestamp=order.timestamp
+    ))
 
 
 async def _get_balance(db: AsyncSession, user_id: UUID, ticker: str) -> Balance_db:
+    # Balances are also changed by bulk upserts that bypass the identity map
     result = await db.execute(
-        select(Balance_db).where(Balance_db.user_id == user_id, Balance_db.ticker == ticker)
+        select(Balance_db)
+        .where(Balance_db.user_id == user_id, Balance_db.ticker == ticker)
+        .execution_options(populate_existing=True)
     )
     balance = result.scalar_one_or_none()
     if balance is None:
@@ -567,17 +694,6 @@ async def _get_balance(db: AsyncSession, user_id: UUID, ticker: str) -> Balance_
     return balance
 
 
-async def _update_balance(db: AsyncSession, user_id: UUID, ticker: str, delta: int):
-    balance = await _get_balance(db, user_id, ticker)
-
-    new_amount = balance.amount + delta
-    if new_amount < 0:
-        raise HTTPException(status_code=400, detail=f"Insufficient balance for {ticker}")
-    balance.amount = new_amount
-
-    db.add(balance)
-
-
 async def _check_and_reserve_funds(
         db: AsyncSession,
         user_id: UUID,
@@ -601,32 +717,105 @@ async def _check_and_reserve_funds(
             raise HTTPException(status_code=400, detail="Insufficient RUB balance for BUY order")
 
 
-async def _refund_unused_funds(
-        db: AsyncSession,
+def _order_page_query(
+        model: Union[Type[LimitOrder_db], Type[MarketOrder_db]],
         user_id: UUID,
-        ticker: str,
-        direction: str,
-        qty: int,
-        filled: Optional[int],
-        price: Optional[int] = None
+        status: OrderStatus,
+        ticker: Optional[str],
+        direction: Optional[Direction],
+        after: Optional[Tuple[datetime, UUID]],
+        limit: Optional[int]
 ):
-    unfilled_qty = qty - (filled or 0)
+    # Status and timestamp are compared through type_coerce: the columns are
+    # VARCHAR and TIMESTAMP in the database, and a CAST would hide the index
+    timestamp = type_coerce(model.timestamp, DateTime())
+    query = select(*_order_columns(model)).where(
+        model.user_id == user_id, type_coerce(model.status, String) == status.value
+    )
 
-    if unfilled_qty <= 0 or price is None:
-        return
+    if ticker is not None:
+        query = query.where(model.ticker == ticker)
+    if direction is not None:
+        query = query.where(type_coerce(model.direction, String) == direction.value)
+    if after is not None:
+        query = query.where(tuple_(timestamp, model.id) < tuple_(*after))
 
-    if direction == "BUY" and price is not None:
-        refund_amount = unfilled_qty * price
-        rub_balance = await _get_balance(db, user_id, "RUB")
-        rub_balance.amount += refund_amount
+    return query.order_by(timestamp.desc(), model.id.desc()).limit(limit)
 
-        db.add(rub_balance)
 
-    elif direction == "SELL":
-        asset_balance = await _get_balance(db, user_id, ticker)
-        asset_balance.amount += unfilled_qty
+def _order_columns(model: Union[Type[LimitOrder_db], Type[MarketOrder_db]]) -> list:
+    # The same columns for both tables so their rows can be combined
+    if model is LimitOrder_db:
+        columns = [literal(LIMIT).label("kind"), model.price, model.filled]
+    else:
+        columns = [literal(MARKET).label("kind"), null().label("price"), null().label("filled")]
+
+    return [
+        model.id, model.status, model.user_id, type_coerce(model.timestamp, DateTime()).label("timestamp"),
+        model.direction, model.ticker, model.qty, *columns
+    ]
+
+
+async def _locate_order(db: AsyncSession, order_id: UUID):
+    # The registry answers without the database for orders it has seen;
+    # otherwise both tables are probed by primary key in one statement
+    entry = order_registry.get(order_id)
+    if entry is not None:
+        return entry
+
+    order_result = await db.execute(union_all(
+        select(*_order_columns(LimitOrder_db)).where(LimitOrder_db.id == order_id),
+        select(*_order_columns(MarketOrder_db)).where(MarketOrder_db.id == order_id)
+    ))
+    row = order_result.first()
+    if row is None:
+        return None
+
+    order_registry.put_read(_entry_from_row(row))
+    return row
+
+
+def _entry_from_row(row) -> OrderEntry:
+    return OrderEntry(
+        id=row.id,
+        kind=row.kind,
+        user_id=row.user_id,
+        ticker=row.ticker,
+        direction=row.direction,
+        qty=row.qty,
+        price=row.price,
+        timestamp=row.timestamp,
+        status=row.status,
+        filled=row.filled or 0
+    )
+
+
+def _order_to_dict(row) -> dict:
+    # Encoded as LimitOrder / MarketOrder would be, without building the
+    # models: rows come from the database or the registry and are trusted.
+    # Ids are converted here as orjson only knows the exact uuid.UUID type,
+    # not asyncpg's subclass.
+    body = {"direction": row.direction, "ticker": row.ticker, "qty": row.qty}
+    order = {
+        "id": str(row.id),
+        "status": row.status,
+        "user_id": str(row.user_id),
+        "timestamp": row.timestamp.isoformat() + "Z",
+        "body": body
+    }
+    if row.kind == LIMIT:
+        body["price"] = row.price
+        order["filled"] = row.filled
+
+    return order
+
 
-        db.add(asset_balance)
+def _parse_order_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    timestamp, _, order_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(timestamp), UUID(order_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
 
 
 def _handle_error(e: Exception) -> HTTPException:
@@ -1,17 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends
-from app.models import NewUser, User, Instrument, L2OrderBook, Transaction, Level
+import asyncio
+import time
+from datetime import datetime, timezone
+import orjson
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from app.models import NewUser, User, Instrument, L2OrderBook, Transaction, Candle, Direction, Quote
 from app.db_models.users import User_db
 from app.db_models.instruments import Instrument_db
 from app.db_models.transactions import Transaction_db
-from app.db_models.orderbook import OrderBook_db
-from app.db_session_provider import get_db
-from sqlalchemy import select
+from app.matching import get_book, get_matcher
+from app.candles import INTERVALS, get_candles, is_seeded, seed_instrument_candles, to_epoch, from_epoch
+from app.market_data import Subscriber, l2_snapshot, subscribe, unsubscribe
+from app.sharding import dispatch, is_sharded, owner_operation, subscribe_remote
+from app.shared_l2 import read_shared_l2
+from app.partitions import hot_partition_start, month_start
+from app.config import settings
+from app.db_session_provider import get_db, get_read_db, AsyncSessionLocal, ReadSessionLocal
+from sqlalchemy import literal_column, select, tuple_
 from uuid import uuid4
-from typing import List
+from typing import Any, AsyncIterator, Callable, List, Literal, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/api/v1/public", tags=["public"])
 
+_EXPORT_CHUNK_SIZE = 1000
+# Every distinct limit is cached per book version, so the choice is bounded
+_MAX_ORDERBOOK_LIMIT = 1000
+
 
 @router.post("/register", responses={200: {"model": User}})
 async def register(new_user: NewUser, db: AsyncSession = Depends(get_db)):
@@ -33,7 +48,7 @@ async def register(new_user: NewUser, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/instrument", responses={200: {"model": List[Instrument]}})
-async def list_instruments(db: AsyncSession = Depends(get_db)):
+async def list_instruments(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(Instrument_db))
     instruments = result.scalars().all()
 
@@ -41,40 +56,206 @@ async def list_instruments(db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/orderbook/{ticker}", responses={200: {"model": L2OrderBook}})
-async def get_orderbook(ticker: str, limit: int = 10, db: AsyncSession = Depends(get_db)):
-    instrument_result = await db.execute(
-        select(Instrument_db).where(Instrument_db.ticker == ticker)
-    )
+async def get_orderbook(
+        ticker: str,
+        limit: int = Query(10, ge=1, le=_MAX_ORDERBOOK_LIMIT),
+        if_none_match: Optional[str] = Header(None)
+):
+    # Front-ends of a sharded deployment read the owner's published book
+    snapshot = read_shared_l2(ticker, limit)
+    if snapshot is None:
+        snapshot = await dispatch(ticker, _orderbook_snapshot, ticker, limit)
+    etag, body = snapshot
 
-    instrument = instrument_result.scalar_one_or_none()
-    if not instrument:
-        raise HTTPException(status_code=422, detail="Instrument not found")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
 
-    orderbook_result = await db.execute(
-        select(OrderBook_db).where(OrderBook_db.ticker == ticker)
-    )
+    return Response(content=body, media_type="application/json", headers=headers)
 
-    orderbook = orderbook_result.scalar_one_or_none()
-    if not orderbook:
-        raise HTTPException(status_code=404, detail="Orderbook not found")
 
-    bid_levels = [
-        Level(price=level["price"], qty=level["qty"])
-        for level in orderbook.bid_levels[:limit]
-    ]
-    ask_levels = [
-        Level(price=level["price"], qty=level["qty"])
-        for level in orderbook.ask_levels[:limit]
+@router.get("/quote/{ticker}", responses={200: {"model": Quote}})
+async def get_quote(ticker: str, side: Direction, qty: int = Query(gt=0)):
+    # What a market order of `side` and `qty` would pay or receive right now;
+    # vwap and worst_price are null when the book cannot fill it
+    return await dispatch(ticker, _quote, ticker, side, qty)
+
+
+@router.websocket("/ws")
+async def market_data_feed(websocket: WebSocket):
+    await websocket.accept()
+
+    subscriber = Subscriber(websocket.send_text, settings.ws_max_pending)
+    sender = asyncio.create_task(subscriber.run())
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+                action, ticker = message["action"], message["ticker"]
+            except (ValueError, KeyError, TypeError):
+                subscriber.notify({"type": "error", "detail": "Expected {\"action\": ..., \"ticker\": ...}"})
+                continue
+
+            if action == "subscribe":
+                try:
+                    if is_sharded():
+                        await subscribe_remote(subscriber, ticker)
+                    else:
+                        subscribe(subscriber, await get_book(ticker))
+                except HTTPException as e:
+                    subscriber.notify({"type": "error", "ticker": ticker, "detail": e.detail})
+            elif action == "unsubscribe":
+                unsubscribe(subscriber, ticker)
+            else:
+                subscriber.notify({"type": "error", "ticker": ticker, "detail": f"Unknown action: {action}"})
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        for ticker in list(subscriber.tickers):
+            unsubscribe(subscriber, ticker)
+
+
+@router.get("/transactions/{ticker}", responses={200: {"model": List[Transaction]}})
+async def get_transaction_history(
+        ticker: str,
+        limit: int = 10,
+        cursor: Optional[str] = None,
+        since_id: Optional[int] = None,
+        db: AsyncSession = Depends(get_read_db)
+):
+    # Newest first, paged by the (timestamp, id) key of the last row returned
+    # in X-Next-Cursor. With since_id, returns rows added after that id in
+    # insertion order instead, for incremental polling.
+    await _get_instrument(db, ticker)
+
+    query = select(
+        Transaction_db.id, Transaction_db.ticker, Transaction_db.amount, Transaction_db.price, Transaction_db.timestamp
+    ).where(Transaction_db.ticker == ticker)
+    if since_id is not None:
+        query = query.where(Transaction_db.id > since_id).order_by(Transaction_db.id)
+        transactions = (await db.execute(query.limit(limit))).all()
+    elif cursor is not None:
+        timestamp, transaction_id = _parse_cursor(cursor)
+        # The plain bound lets the planner skip partitions newer than the
+        # cursor; it cannot see through the row comparison
+        query = query.where(
+            Transaction_db.timestamp <= timestamp,
+            tuple_(Transaction_db.timestamp, Transaction_db.id) < tuple_(timestamp, transaction_id)
+        ).order_by(Transaction_db.timestamp.desc(), Transaction_db.id.desc())
+        transactions = (await db.execute(query.limit(limit))).all()
+    else:
+        transactions = await _latest_transactions(db, query, limit)
+
+    headers = {}
+    if transactions:
+        headers["X-Last-Id"] = str(max(transaction.id for transaction in transactions))
+        if since_id is None and len(transactions) == limit:
+            last = transactions[-1]
+            headers["X-Next-Cursor"] = f"{last.timestamp.isoformat()}_{last.id}"
+
+    # Plain dicts in Transaction's field order, encoded without the models
+    response_body = [
+        {
+            "ticker": transaction.ticker,
+            "amount": transaction.amount,
+            "price": transaction.price,
+            "timestamp": transaction.timestamp.isoformat()
+        }
+        for transaction in transactions
     ]
 
-    return L2OrderBook(
-        bid_levels=bid_levels,
-        ask_levels=ask_levels,
+    return ORJSONResponse(response_body, headers=headers)
+
+
+@router.get("/transactions/{ticker}/export")
+async def export_transaction_history(
+        ticker: str,
+        format: Literal["ndjson", "csv"] = "ndjson",
+        db: AsyncSession = Depends(get_read_db)
+):
+    await _get_instrument(db, ticker)
+
+    if format == "csv":
+        media_type = "text/csv"
+        encode = _encode_csv_row
+    else:
+        media_type = "application/x-ndjson"
+        encode = _encode_ndjson_row
+
+    return StreamingResponse(
+        _stream_transactions(ticker, encode, header=format == "csv"),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{ticker}-transactions.{format}"'}
     )
 
 
-@router.get("/transactions/{ticker}", responses={200: {"model": List[Transaction]}})
-async def get_transaction_history(ticker: str, limit: int = 10, db: AsyncSession = Depends(get_db)):
+@router.get("/candles/{ticker}", responses={200: {"model": List[Candle]}})
+async def get_candle_history(
+        ticker: str,
+        interval: str = "1m",
+        from_: Optional[datetime] = Query(None, alias="from"),
+        to: Optional[datetime] = None
+):
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=422, detail=f"Interval must be one of {', '.join(INTERVALS)}")
+
+    seconds = INTERVALS[interval]
+    end = _to_utc_epoch(to) if to is not None else int(time.time()) + 1
+    start = _to_utc_epoch(from_) if from_ is not None else end - seconds * settings.candle_history
+    if (end - start) // seconds > settings.candle_max_bars:
+        raise HTTPException(status_code=422, detail=f"Range is limited to {settings.candle_max_bars} bars")
+
+    candles = await dispatch(ticker, _load_candles, ticker, interval, start, end)
+
+    return [
+        Candle(
+            timestamp=from_epoch(candle.start).isoformat(),
+            open=candle.open,
+            high=candle.high,
+            low=candle.low,
+            close=candle.close,
+            volume=candle.volume
+        )
+        for candle in candles
+    ]
+
+
+@owner_operation
+async def _orderbook_snapshot(ticker: str, limit: int) -> Tuple[str, bytes]:
+    return l2_snapshot(await get_book(ticker), limit)
+
+
+@owner_operation
+async def _quote(ticker: str, direction: Direction, qty: int) -> Quote:
+    book = await get_book(ticker)
+    quote = book.quote(direction, qty)
+    available = book.opposite(direction).qty
+    if quote is None:
+        return Quote(direction=direction, qty=qty, available=available, vwap=None, worst_price=None)
+
+    cost, worst_price = quote
+    return Quote(direction=direction, qty=qty, available=available, vwap=cost / qty, worst_price=worst_price)
+
+
+@owner_operation
+async def _load_candles(ticker: str, interval: str, start: int, end: int) -> list:
+    # Bars in progress live with the ticker's matcher
+    if not is_seeded(ticker):
+        await get_matcher(ticker).submit(seed_instrument_candles)
+
+    async with AsyncSessionLocal() as db:
+        return await get_candles(db, ticker, interval, start, end)
+
+
+def _to_utc_epoch(timestamp: datetime) -> int:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return to_epoch(timestamp)
+
+
+async def _get_instrument(db: AsyncSession, ticker: str) -> Instrument_db:
     instrument_result = await db.execute(
         select(Instrument_db).where(Instrument_db.ticker == ticker)
     )
@@ -83,22 +264,73 @@ async def get_transaction_history(ticker: str, limit: int = 10, db: AsyncSession
     if not instrument:
         raise HTTPException(status_code=422, detail="Instrument not found")
 
-    transactions_result = await db.execute(
-        select(Transaction_db)
-        .where(Transaction_db.ticker == ticker)
-        .order_by(Transaction_db.timestamp.desc())
-        .limit(limit)
+    return instrument
+
+
+async def _latest_transactions(db: AsyncSession, query, limit: int) -> list:
+    # The first page reads the current month's partition alone and goes
+    # further back only when it is short. The bound is inlined rather than
+    # bound so that PostgreSQL 10 prunes the other partitions in cached
+    # generic plans too; it changes once a month.
+    start = hot_partition_start()
+    hot_start, hot_end = (
+        literal_column(f"'{bound.isoformat(sep=' ')}'::timestamp") for bound in (start, month_start(start, 1))
     )
-    transactions = transactions_result.scalars().all()
-
-    response = [
-        Transaction(
-            ticker=transaction.ticker,
-            amount=transaction.amount,
-            price=transaction.price,
-            timestamp=transaction.timestamp.isoformat()
-        )
-        for transaction in transactions
-    ]
+    newest_first = (Transaction_db.timestamp.desc(), Transaction_db.id.desc())
+
+    transactions = (await db.execute(
+        query.where(Transaction_db.timestamp >= hot_start, Transaction_db.timestamp < hot_end)
+        .order_by(*newest_first).limit(limit)
+    )).all()
+    if len(transactions) < limit:
+        transactions += (await db.execute(
+            query.where(Transaction_db.timestamp < hot_start).order_by(*newest_first).limit(limit - len(transactions))
+        )).all()
+
+    return transactions
+
+
+def _parse_cursor(cursor: str) -> Tuple[datetime, int]:
+    timestamp, _, transaction_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(timestamp), int(transaction_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
 
-    return response
+
+def _encode_ndjson_row(row) -> str:
+    return orjson.dumps({
+        "id": row.id,
+        "ticker": row.ticker,
+        "amount": row.amount,
+        "price": row.price,
+        "timestamp": row.timestamp.isoformat()
+    }, option=orjson.OPT_APPEND_NEWLINE).decode()
+
+
+def _encode_csv_row(row) -> str:
+    return f"{row.id},{row.ticker},{row.amount},{row.price},{row.timestamp.isoformat()}\n"
+
+
+async def _stream_transactions(ticker: str, encode: Callable[[Any], str], header: bool) -> AsyncIterator[str]:
+    # Rows come from a server-side cursor in chunks, so memory use does not
+    # depend on the length of the history. The session is owned by the
+    # generator because it outlives the request handler.
+    if header:
+        yield "id,ticker,amount,price,timestamp\n"
+
+    async with ReadSessionLocal() as db:
+        result = await db.stream(
+            select(
+                Transaction_db.id,
+                Transaction_db.ticker,
+                Transaction_db.amount,
+                Transaction_db.price,
+                Transaction_db.timestamp
+            )
+            .where(Transaction_db.ticker == ticker)
+            .order_by(Transaction_db.timestamp, Transaction_db.id)
+            .execution_options(yield_per=_EXPORT_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            yield "".join(encode(row) for row in rows)
@@ -4,10 +4,15 @@ from sqlalchemy import delete, select, update, cast, String
 from app.db_models.users import User_db
 from app.db_models.market_orders import MarketOrder_db
 from app.db_models.limit_orders import LimitOrder_db
+from app.db_models.resting_orders import RestingOrder_db
 from app.models import User
 from app.db_session_provider import get_db
 from uuid import UUID
-from app.dependencies import check_admin_role, get_api_key
+from app.dependencies import AuthUser, check_admin_role, get_api_key, user_cache
+from app.matching import discard_matcher
+from app.order_registry import order_registry
+from app.sharding import dispatch, owner_operation
+from app.invalidation import USER, publish_book_changed, publish_invalidation
 
 router = APIRouter(prefix="/api/v1/admin/user", tags=["user", "admin"])
 
@@ -16,7 +21,7 @@ router = APIRouter(prefix="/api/v1/admin/user", tags=["user", "admin"])
 async def delete_user(
         user_id: UUID,
         api_key: str = Depends(get_api_key),
-        user: User_db = Depends(check_admin_role),
+        user: AuthUser = Depends(check_admin_role),
         db: AsyncSession = Depends(get_db)
 ):
     user_result = await db.execute(
@@ -40,10 +45,30 @@ async def delete_user(
         .values(status="CANCELLED")
     )
 
+    resting_tickers_result = await db.execute(
+        select(RestingOrder_db.ticker).where(RestingOrder_db.user_id == user_id).distinct()
+    )
+    resting_tickers = resting_tickers_result.scalars().all()
+
     await db.execute(
         delete(User_db).where(User_db.id == user_id)
     )
+    await publish_invalidation(db, USER, user_id)
+    for ticker in resting_tickers:
+        await publish_book_changed(db, ticker)
 
     await db.commit()
+    user_cache.invalidate_user(user_id)
+    order_registry.discard(user_id=user_id)
+
+    for ticker in resting_tickers:
+        await dispatch(ticker, _discard_user_book, user_id, ticker)
 
     return user
+
+
+@owner_operation
+async def _discard_user_book(user_id: UUID, ticker: str):
+    # The user's resting orders were cancelled behind the matcher's back
+    discard_matcher(ticker)
+    order_registry.discard(user_id=user_id)
@@ -0,0 +1,512 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import shutil
+import signal
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+import orjson
+from fastapi import HTTPException
+from prometheus_client import start_http_server
+from app.candles import start_candles, stop_candles
+from app.config import settings
+from app.db_session_provider import dispose_engines
+from app.journal import SNAPSHOT_PREFIX
+from app.market_data import Subscriber, TickerFeed, attach, encode_message, remove_feed, set_feed, subscribe, \
+    unsubscribe
+from app.matching import get_book, start_journal, stop_matchers
+from app.shared_l2 import start_shared_l2_writer, stop_shared_l2
+from app.invalidation import start_invalidation_listener, stop_invalidation_listener
+from app.partitions import start_partition_maintenance, stop_partition_maintenance
+
+logger = logging.getLogger(__name__)
+
+# Frames on the IPC socket: a 4-byte big-endian length, then a pickled tuple.
+# Requests are (request_id, operation, args), responses (request_id, ok, value)
+# with value holding (status_code, detail, headers) when not ok. Market data
+# pushed by the owner travels as (None, encoded message).
+_HEADER = struct.Struct("!I")
+_FEED = "__feed__"
+_RECONNECT_DELAY = 1.0
+_STARTUP_TIMEOUT = 30.0
+
+_operations: Dict[str, Callable[..., Awaitable[Any]]] = {}
+_clients: Dict[int, "WorkerClient"] = {}
+_mirrors: Dict[str, "MirrorFeed"] = {}
+# Set in matching worker processes, None in front-ends and single-process mode
+_worker_index: Optional[int] = None
+
+
+def is_sharded() -> bool:
+    # True in a front-end that forwards matching to worker processes
+    return settings.matching_workers > 0 and _worker_index is None
+
+
+def owner_of(ticker: str, workers: int) -> int:
+    # Rendezvous hashing: changing the number of workers only moves the
+    # tickers whose highest-scoring worker was added or removed
+    return max(
+        range(workers),
+        key=lambda index: hashlib.blake2b(f"{index}:{ticker}".encode(), digest_size=8).digest()
+    )
+
+
+def socket_dir() -> str:
+    if settings.matching_socket_dir is not None:
+        return settings.matching_socket_dir
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "exchange-matching")
+    return os.path.join(tempfile.gettempdir(), f"exchange-matching-{os.getuid()}")
+
+
+def check_socket_dir(directory: str):
+    # Both ends unpickle what arrives on the sockets, so anyone able to put
+    # a socket in the directory or connect to one could run code here
+    status = os.lstat(directory)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise RuntimeError(
+            f"Matching socket directory {directory} must be a directory owned by uid {os.getuid()} with mode 0700"
+        )
+
+
+def socket_path(index: int) -> str:
+    return os.path.join(socket_dir(), f"worker-{index}.sock")
+
+
+def shared_l2_path() -> str:
+    return os.path.join(socket_dir(), "l2")
+
+
+def journal_path(index: int, workers: int) -> str:
+    return os.path.join(settings.journal_dir, f"worker-{index}-of-{workers}")
+
+
+def owner_operation(function: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    # Registers a coroutine that must run in the process owning the ticker.
+    # Arguments and results cross the socket pickled.
+    _operations[_operation_name(function)] = function
+    return function
+
+
+async def dispatch(ticker: str, function: Callable[..., Awaitable[Any]], *args) -> Any:
+    if not is_sharded():
+        return await function(*args)
+
+    return await _client(owner_of(ticker, settings.matching_workers)).call(_operation_name(function), args)
+
+
+def _operation_name(function: Callable) -> str:
+    return f"{function.__module__}.{function.__qualname__}"
+
+
+def _frame(message: tuple) -> bytes:
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(payload)) + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple:
+    header = await reader.readexactly(_HEADER.size)
+    return pickle.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+
+
+def _unavailable(index: int) -> HTTPException:
+    return HTTPException(
+        status_code=503, detail=f"Matching worker {index} is unavailable", headers={"Retry-After": "1"}
+    )
+
+
+class WorkerClient:
+    # One connection from a front-end to a matching worker, shared by all of
+    # the front-end's requests. Responses are matched to requests by id, so
+    # calls to different tickers on the same worker do not wait on each other.
+    def __init__(self, index: int):
+        self.index = index
+        self.tickers: Set[str] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._connecting: Optional[asyncio.Lock] = None
+        self._resubscribe: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._closed = False
+
+    async def call(self, name: str, args: tuple) -> Any:
+        writer = await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            writer.write(_frame((request_id, name, args)))
+            await writer.drain()
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def follow(self, ticker: str):
+        # Market data of the ticker is pushed over this connection from now on
+        await self.call(_FEED, (ticker,))
+        self.tickers.add(ticker)
+
+    async def close(self):
+        self._closed = True
+        for task in (self._resubscribe, self._reader):
+            if task is not None:
+                task.cancel()
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.close()
+            await writer.wait_closed()
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        if self._writer is not None:
+            return self._writer
+
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._writer is None:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(socket_path(self.index))
+                except OSError:
+                    raise _unavailable(self.index)
+                self._writer = writer
+                self._reader = asyncio.create_task(self._read(reader), name=f"matching-worker-{self.index}")
+
+        return self._writer
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                request_id, *message = await _read_frame(reader)
+                if request_id is None:
+                    _push(message[0])
+                    continue
+
+                future = self._pending.get(request_id)
+                if future is None or future.done():
+                    continue
+                ok, value = message
+                if ok:
+                    future.set_result(value)
+                else:
+                    status_code, detail, headers = value
+                    future.set_exception(HTTPException(status_code=status_code, detail=detail, headers=headers))
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            self._disconnected()
+
+    def _disconnected(self):
+        # Calls in flight fail: whether the worker executed them is unknown
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(_unavailable(self.index))
+
+        for ticker in self.tickers:
+            mirror = _mirrors.get(ticker)
+            if mirror is not None:
+                mirror.synced = False
+        if self.tickers and not self._closed and (self._resubscribe is None or self._resubscribe.done()):
+            self._resubscribe = asyncio.create_task(self._follow_again())
+
+    async def _follow_again(self):
+        while True:
+            await asyncio.sleep(_RECONNECT_DELAY)
+            try:
+                for ticker in list(self.tickers):
+                    await self.follow(ticker)
+                return
+            except HTTPException:
+                logger.warning("Matching worker %s is unavailable, retrying", self.index)
+
+
+def _client(index: int) -> WorkerClient:
+    client = _clients.get(index)
+    if client is None:
+        client = WorkerClient(index)
+        _clients[index] = client
+
+    return client
+
+
+async def stop_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
+
+
+class MirrorFeed(TickerFeed):
+    # Front-end copy of a feed published by the owning worker. Levels are
+    # rebuilt from the owner's snapshot and l2 messages, and every message is
+    # relayed as encoded by the owner, sequence numbers included.
+    def __init__(self, ticker: str):
+        super().__init__(ticker)
+        self.synced = False
+        self._levels: Dict[str, Dict[int, int]] = {"BUY": {}, "SELL": {}}
+
+    def apply(self, data: str, message: dict):
+        if message["type"] == "snapshot":
+            self._levels = {
+                "BUY": {level["price"]: level["qty"] for level in message["bid_levels"]},
+                "SELL": {level["price"]: level["qty"] for level in message["ask_levels"]},
+            }
+            self.seq = message["seq"]
+            self.synced = True
+            self._snapshot = (None, self.seq, data)
+            self.resync_all()
+            return
+
+        if not self.synced:
+            return
+        if message["type"] == "l2":
+            for change in message["changes"]:
+                levels = self._levels[change["side"]]
+                if change["qty"]:
+                    levels[change["price"]] = change["qty"]
+                else:
+                    levels.pop(change["price"], None)
+        self.seq = message["seq"]
+        for subscriber in self.subscribers:
+            subscriber.push(self.ticker, data)
+
+    def snapshot(self) -> Optional[str]:
+        if not self.synced:
+            return None
+
+        if self._snapshot is None or self._snapshot[1] != self.seq:
+            data = encode_message({
+                "type": "snapshot",
+                "ticker": self.ticker,
+                "seq": self.seq,
+                "bid_levels": [
+                    {"price": price, "qty": qty} for price, qty in sorted(self._levels["BUY"].items(), reverse=True)
+                ],
+                "ask_levels": [{"price": price, "qty": qty} for price, qty in sorted(self._levels["SELL"].items())],
+            })
+            self._snapshot = (None, self.seq, data)
+
+        return self._snapshot[2]
+
+
+def _push(data: str):
+    message = orjson.loads(data)
+    mirror = _mirrors.get(message["ticker"])
+    if mirror is not None:
+        mirror.apply(data, message)
+
+
+async def subscribe_remote(subscriber: Subscriber, ticker: str):
+    # Front-end side of the WebSocket subscribe: the owner streams the ticker
+    # once per front-end, whatever the number of local subscribers
+    mirror = _mirrors.get(ticker)
+    if mirror is None:
+        # Registered first: the owner's snapshot may arrive before its reply
+        mirror = MirrorFeed(ticker)
+        _mirrors[ticker] = mirror
+        set_feed(ticker, mirror)
+        try:
+            await _client(owner_of(ticker, settings.matching_workers)).follow(ticker)
+        except HTTPException:
+            if _mirrors.get(ticker) is mirror:
+                del _mirrors[ticker]
+                remove_feed(ticker, mirror)
+            raise
+
+    attach(subscriber, mirror)
+
+
+async def _serve_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    # Worker side of one front-end connection. Every request runs as its own
+    # task so that the matcher queues, not this loop, order the work.
+    async def send(data: str):
+        writer.write(_frame((None, data)))
+        await writer.drain()
+
+    feed = Subscriber(send, settings.ws_max_pending)
+    sender = asyncio.create_task(feed.run())
+    tasks: Set[asyncio.Task] = set()
+    try:
+        while True:
+            request_id, name, args = await _read_frame(reader)
+            task = asyncio.create_task(_handle(writer, feed, request_id, name, args))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, OSError):
+        pass
+    finally:
+        sender.cancel()
+        for ticker in list(feed.tickers):
+            unsubscribe(feed, ticker)
+        writer.close()
+
+
+async def _handle(writer: asyncio.StreamWriter, feed: Subscriber, request_id: int, name: str, args: tuple):
+    try:
+        if name == _FEED:
+            subscribe(feed, await get_book(*args))
+            result = None
+        else:
+            result = await _operations[name](*args)
+        data = _frame((request_id, True, result))
+    except HTTPException as e:
+        data = _frame((request_id, False, (e.status_code, e.detail, e.headers)))
+    except Exception as e:
+        logger.exception("Operation %s failed", name)
+        data = _frame((request_id, False, (500, f"Internal server error: {e}", None)))
+
+    if not writer.is_closing():
+        writer.write(data)
+        try:
+            await writer.drain()
+        except OSError:
+            pass
+
+
+def prune_journals(directory: str, workers: int):
+    # Snapshots are trusted on recovery, so any left by another layout would
+    # be stale once a ticker has traded under its new owner. Switching the
+    # number of workers, or between sharded and single-process mode, starts
+    # every book from the database instead.
+    if not os.path.isdir(directory):
+        return
+
+    keep = {os.path.basename(journal_path(index, workers)) for index in range(workers)}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("worker-") and os.path.isdir(path) and name not in keep:
+            shutil.rmtree(path)
+        elif workers and name.startswith(SNAPSHOT_PREFIX):
+            os.remove(path)
+
+
+async def run_worker(index: int):
+    global _worker_index
+    from app import main  # noqa: F401 - registers the owner operations of every router
+
+    _worker_index = index
+    check_socket_dir(socket_dir())
+    if settings.journal_dir is not None:
+        settings.journal_dir = journal_path(index, settings.matching_workers)
+    if settings.l2_shared_depth > 0:
+        start_shared_l2_writer(shared_l2_path(), settings.l2_shared_depth)
+    await start_journal()
+    start_candles()
+    start_invalidation_listener()
+    # Transactions partitions are shared by all tickers, so one worker keeps them
+    if index == 0:
+        start_partition_maintenance()
+    if settings.matching_metrics_port:
+        start_http_server(settings.matching_metrics_port + index)
+
+    path = socket_path(index)
+    if os.path.exists(path):
+        os.remove(path)
+    server = await asyncio.start_unix_server(_serve_connection, path)
+    os.chmod(path, 0o600)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+
+    server.close()
+    await stop_invalidation_listener()
+    await stop_partition_maintenance()
+    await stop_matchers()
+    await stop_candles()
+    await dispose_engines()
+    stop_shared_l2()
+
+
+def serve(workers: int, http_workers: int, host: str, port: int) -> int:
+    # Starts the matching workers, then the HTTP front-ends, and stops all of
+    # them once any one exits or a signal arrives
+    directory = socket_dir()
+    env = dict(os.environ, MATCHING_WORKERS=str(workers), MATCHING_SOCKET_DIR=directory)
+    # makedirs leaves the mode of an existing directory alone
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    try:
+        check_socket_dir(directory)
+    except RuntimeError as e:
+        logger.error("%s", e)
+        return 1
+    # Book versions restart with the workers, so published books are dropped
+    shutil.rmtree(shared_l2_path(), ignore_errors=True)
+    if settings.journal_dir is not None:
+        prune_journals(settings.journal_dir, workers)
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+
+    processes = []
+    try:
+        for index in range(workers):
+            if os.path.exists(socket_path(index)):
+                os.remove(socket_path(index))
+            processes.append(subprocess.Popen([sys.executable, "-m", "app.sharding", "worker", str(index)], env=env))
+
+        deadline = time.monotonic() + _STARTUP_TIMEOUT
+        while not all(os.path.exists(socket_path(index)) for index in range(workers)):
+            if stopping or time.monotonic() > deadline or any(process.poll() is not None for process in processes):
+                logger.error("Matching workers failed to start")
+                return 1
+            time.sleep(0.1)
+
+        processes.append(subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", host, "--port", str(port), "--workers", str(http_workers)
+        ], env=env))
+
+        while not stopping and all(process.poll() is None for process in processes):
+            time.sleep(0.5)
+        return 0 if stopping else 1
+    finally:
+        # Front-ends first, so requests in flight still reach their worker
+        for process in reversed(processes):
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the exchange with matching sharded across processes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="matching workers and HTTP front-ends")
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="matching worker processes")
+    serve_parser.add_argument("--http-workers", type=int, default=os.cpu_count(), help="uvicorn worker processes")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    worker_parser = commands.add_parser("worker", help="one matching worker, normally started by serve")
+    worker_parser.add_argument("index", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        sys.exit(serve(args.workers, args.http_workers, args.host, args.port))
+    asyncio.run(run_worker(args.index))
+
+
+if __name__ == "__main__":
+    # Run as app.sharding rather than __main__: the routers register their
+    # owner operations in the imported module
+    from app.sharding import main
+    main()
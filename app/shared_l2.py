@@ -0,0 +1,206 @@
+import mmap
+import os
+import struct
+from typing import Dict, Optional, Tuple
+import orjson
+from app.market_data import l2_etag
+from app.order_book import EPOCH, OrderBook
+
+# One file per ticker, mapped by the owning matching worker and by every
+# front-end. Header: seqlock counter, epoch of the writing process, book
+# version, loaded flag, bid and ask level counts; then up to `depth`
+# (price, qty) pairs per side, bids first.
+_HEADER = struct.Struct("<QQQIII4x")
+_SEQ = struct.Struct("<Q")
+_LEVEL_SIZE = 16
+_READ_ATTEMPTS = 100
+
+_writer: Optional["SharedL2Writer"] = None
+_reader: Optional["SharedL2Reader"] = None
+
+
+class SharedL2Writer:
+    # Seqlock writer: the counter is odd while a snapshot is being written
+    # and is bumped to the next even value once it is complete. There is a
+    # single writer per ticker, the matcher of the owning worker.
+    def __init__(self, directory: str, depth: int):
+        self.directory = directory
+        self.depth = depth
+        self._levels = struct.Struct(f"<{depth * 2}q")
+        self._maps: Dict[str, mmap.mmap] = {}
+        self._seqs: Dict[str, int] = {}
+        self._versions: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def publish(self, book: OrderBook):
+        if self._versions.get(book.ticker) == book.version:
+            return
+
+        bids = [value for level in book.bids.levels(self.depth) for value in (level.price, level.qty)]
+        asks = [value for level in book.asks.levels(self.depth) for value in (level.price, level.qty)]
+        padding = self.depth * 2
+
+        mapped, seq = self._begin(book.ticker)
+        self._levels.pack_into(mapped, _HEADER.size, *bids, *[0] * (padding - len(bids)))
+        self._levels.pack_into(mapped, _HEADER.size + self.depth * _LEVEL_SIZE, *asks, *[0] * (padding - len(asks)))
+        _HEADER.pack_into(mapped, 0, seq, EPOCH, book.version, 1, len(bids) // 2, len(asks) // 2)
+        self._end(book.ticker, mapped, seq)
+        self._versions[book.ticker] = book.version
+
+    def discard(self, ticker: str):
+        # Readers fall back to asking the owner, which reloads the book
+        self._versions.pop(ticker, None)
+        if ticker not in self._maps:
+            return
+        mapped, seq = self._begin(ticker)
+        _HEADER.pack_into(mapped, 0, seq, EPOCH, 0, 0, 0, 0)
+        self._end(ticker, mapped, seq)
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+
+    def _begin(self, ticker: str) -> Tuple[mmap.mmap, int]:
+        mapped = self._maps.get(ticker)
+        if mapped is None:
+            mapped = _map(os.path.join(self.directory, ticker), _HEADER.size + self.depth * 2 * _LEVEL_SIZE)
+            self._maps[ticker] = mapped
+            self._seqs[ticker] = _SEQ.unpack_from(mapped)[0] & ~1
+
+        seq = self._seqs[ticker] + 1
+        _SEQ.pack_into(mapped, 0, seq)
+        return mapped, seq
+
+    def _end(self, ticker: str, mapped: mmap.mmap, seq: int):
+        _SEQ.pack_into(mapped, 0, seq + 1)
+        self._seqs[ticker] = seq + 1
+
+
+class SharedL2Reader:
+    # Seqlock reader: a snapshot is used only if the counter was even before
+    # the copy and unchanged after it, so a torn write is never served. An
+    # encoded body is kept per ticker and limit until the version changes,
+    # and an unchanged version is answered from the header alone.
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.retries = 0
+        self._maps: Dict[str, Tuple[mmap.mmap, int]] = {}
+        # ticker -> ((epoch, book version), {limit: (etag, encoded body)}), as in market_data
+        self._cache: Dict[str, Tuple[Tuple[int, int], Dict[int, Tuple[str, bytes]]]] = {}
+
+    def read(self, ticker: str, limit: int) -> Optional[Tuple[str, bytes]]:
+        # None when the owner has not published the book or `limit` is deeper
+        # than what is published
+        mapping = self._open(ticker)
+        if mapping is None:
+            return None
+        mapped, depth = mapping
+        if not 0 < limit <= depth:
+            return None
+
+        for _ in range(_READ_ATTEMPTS):
+            seq, epoch, version, loaded, bid_count, ask_count = _HEADER.unpack_from(mapped)
+            if seq & 1:
+                self.retries += 1
+                continue
+            if not loaded:
+                return None
+
+            cached_version, by_limit = self._cache.get(ticker, (None, None))
+            if cached_version == (epoch, version) and limit in by_limit:
+                return by_limit[limit]
+
+            bids = mapped[_HEADER.size:_HEADER.size + min(bid_count, limit, depth) * _LEVEL_SIZE]
+            asks_start = _HEADER.size + depth * _LEVEL_SIZE
+            asks = mapped[asks_start:asks_start + min(ask_count, limit, depth) * _LEVEL_SIZE]
+            if _SEQ.unpack_from(mapped)[0] != seq:
+                self.retries += 1
+                continue
+
+            if cached_version != (epoch, version):
+                by_limit = {}
+                self._cache[ticker] = ((epoch, version), by_limit)
+            snapshot = (l2_etag(ticker, epoch, version, limit), orjson.dumps({
+                "bid_levels": _decode_levels(bids),
+                "ask_levels": _decode_levels(asks),
+            }))
+            by_limit[limit] = snapshot
+            return snapshot
+
+        return None
+
+    def close(self):
+        for mapped, _ in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+
+    def _open(self, ticker: str) -> Optional[Tuple[mmap.mmap, int]]:
+        mapping = self._maps.get(ticker)
+        if mapping is not None:
+            return mapping
+
+        try:
+            fd = os.open(os.path.join(self.directory, ticker), os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            size = os.fstat(fd).st_size
+            mapped = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+        mapping = (mapped, (size - _HEADER.size) // (2 * _LEVEL_SIZE))
+        self._maps[ticker] = mapping
+        return mapping
+
+
+def _map(path: str, size: int) -> mmap.mmap:
+    # An existing file is reused rather than replaced, so the mappings held
+    # by readers keep pointing at the live data
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+def _decode_levels(data: bytes) -> list:
+    values = struct.unpack(f"<{len(data) // 8}q", data)
+    return [{"price": values[index], "qty": values[index + 1]} for index in range(0, len(values), 2)]
+
+
+def start_shared_l2_writer(directory: str, depth: int):
+    global _writer
+    _writer = SharedL2Writer(directory, depth)
+
+
+def start_shared_l2_reader(directory: str):
+    global _reader
+    _reader = SharedL2Reader(directory)
+
+
+def stop_shared_l2():
+    global _writer, _reader
+    for side in (_writer, _reader):
+        if side is not None:
+            side.close()
+    _writer = _reader = None
+
+
+def publish_shared_l2(book: OrderBook):
+    if _writer is not None:
+        _writer.publish(book)
+
+
+def discard_shared_l2(ticker: str):
+    if _writer is not None:
+        _writer.discard(ticker)
+
+
+def read_shared_l2(ticker: str, limit: int) -> Optional[Tuple[str, bytes]]:
+    if _reader is None:
+        return None
+    return _reader.read(ticker, limit)
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+import httpx
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.db_models.balances import Balance_db
+from app.db_models.instruments import Instrument_db
+from app.db_models.users import User_db
+from app.config import settings
+from app.db_session_provider import AsyncSessionLocal
+from app.main import app
+from app.matching import stop_matchers
+
+TICKERS = ["BENCHBA", "BENCHBB"]
+
+
+def quotes(levels: int) -> list:
+    # Non-crossing two-sided quotes so every order rests in the book
+    return [
+        {"direction": direction, "ticker": ticker, "qty": 1, "price": price}
+        for ticker in TICKERS
+        for level in range(levels)
+        for direction, price in (("BUY", 1000 - level), ("SELL", 1001 + level))
+    ]
+
+
+async def run(client: httpx.AsyncClient, headers: dict, orders: list, rounds: int, batch_size: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for order in orders:
+            response = await client.post("/api/v1/order", json=order, headers=headers)
+            response.raise_for_status()
+    single = rounds * len(orders) / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for start in range(0, len(orders), batch_size):
+            response = await client.post(
+                "/api/v1/order/batch", json=orders[start:start + batch_size], headers=headers
+            )
+            response.raise_for_status()
+            assert all(result["success"] for result in response.json())
+    batch = rounds * len(orders) / (time.perf_counter() - started)
+
+    print(
+        f"{len(orders):4d} orders per round: single {single:8.0f} orders/s, "
+        f"batch of {batch_size} {batch:8.0f} orders/s ({batch / single:.1f}x)"
+    )
+
+
+async def main_async(dsn: str, levels: list, rounds: int, batch_size: int):
+    engine = create_async_engine(dsn)
+    AsyncSessionLocal.configure(bind=engine)
+
+    user_id = uuid4()
+    api_key = f"key-{uuid4()}"
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            db.add_all(Instrument_db(ticker=ticker, name="Batch benchmark") for ticker in TICKERS)
+            db.add(User_db(id=user_id, name="market maker", role="USER", api_key=api_key))
+            await db.flush()
+            db.add_all(Balance_db(user_id=user_id, ticker=ticker, amount=10 ** 9) for ticker in TICKERS + ["RUB"])
+
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            for count in levels:
+                await run(client, {"Authorization": f"TOKEN {api_key}"}, quotes(count), rounds, batch_size)
+    finally:
+        await stop_matchers()
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await db.execute(delete(User_db).where(User_db.id == user_id))
+                await db.execute(delete(Instrument_db).where(Instrument_db.ticker.in_(TICKERS)))
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batch order submission with one request per order")
+    parser.add_argument("--dsn", default=settings.database_url)
+    parser.add_argument("--levels", type=int, nargs="+", default=[5, 25])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args.dsn, args.levels, args.rounds, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
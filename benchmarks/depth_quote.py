@@ -0,0 +1,73 @@
+import argparse
+import time
+from uuid import uuid4
+from app.order_book import OrderBook
+
+TICKER = "BENCHQUOTE"
+MID = 1_000_000
+LEVEL_QTY = 10
+
+
+def build_book(levels: int) -> OrderBook:
+    book = OrderBook(TICKER)
+    user_id = uuid4()
+    for index in range(levels):
+        book.add(uuid4(), user_id, "BUY", MID - 1 - index, LEVEL_QTY)
+        book.add(uuid4(), user_id, "SELL", MID + index, LEVEL_QTY)
+
+    return book
+
+
+def scan_quote(book: OrderBook, direction: str, qty: int):
+    # What a quote costs without the index: walking the side best first
+    cost = 0
+    remaining = qty
+    for level in book.opposite(direction).levels():
+        taken = min(remaining, level.qty)
+        cost += taken * level.price
+        remaining -= taken
+        if remaining == 0:
+            return cost, level.price
+    return None
+
+
+def per_call(function, repeat: int) -> float:
+    started = time.perf_counter_ns()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter_ns() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Market order quotes from the cumulative depth index")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 1000, 100_000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    for levels in args.levels:
+        book = build_book(levels)
+        # Takes half the side, so a scan visits half of the levels
+        qty = levels * LEVEL_QTY // 2 or 1
+        assert book.quote("BUY", qty) == scan_quote(book, "BUY", qty)
+
+        indexed = per_call(lambda: book.quote("BUY", qty), args.repeat)
+        scanned = per_call(lambda: scan_quote(book, "BUY", qty), max(1, args.repeat * 10 // levels))
+
+        # Keeping the index current: a resting order at an indexed price
+        # arrives and leaves
+        order_id = uuid4()
+        user_id = uuid4()
+
+        def churn():
+            book.add(order_id, user_id, "SELL", MID, LEVEL_QTY)
+            book.cancel(order_id)
+
+        updated = per_call(churn, args.repeat)
+        print(
+            f"{levels:7d} levels: index {indexed:10,.0f} ns/quote  scan {scanned:14,.0f} ns/quote  "
+            f"add+cancel with index {updated:8,.0f} ns"
+        )
+
+
+if __name__ == "__main__":
+    main()
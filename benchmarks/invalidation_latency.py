@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import time
+from datetime import datetime
+from uuid import uuid4
+from app import invalidation
+from app.config import settings
+from app.db_session_provider import AsyncSessionLocal, dispose_engines
+from app.dependencies import AuthUser, user_cache
+from app.invalidation import USER, on_invalidation, publish_invalidation
+from app.order_registry import LIMIT, OrderEntry, order_registry
+
+# Benchmark-only kind: the key carries the send time, so the listener can
+# time delivery of each event on its own
+PROBE = "probe"
+MARKER = "marker"
+
+
+def listen(commands, results):
+    # The other process: caches as a worker would hold them, and a listener
+    settings.invalidation_bus = True
+    latencies = []
+    seen = []
+
+    @on_invalidation(PROBE)
+    def probe(key, order_ids):
+        if key is not None:
+            latencies.append(time.time() - float(key))
+
+    @on_invalidation(MARKER)
+    def marker(key, order_ids):
+        if key is not None:
+            results.put(("marker", key, list(seen), list(latencies)))
+
+    @on_invalidation(USER)
+    def record_user(key, order_ids):
+        if key is not None:
+            seen.append(key)
+
+    async def main():
+        invalidation.start_invalidation_listener()
+        while not invalidation.listener_stats()["connected"]:
+            await asyncio.sleep(0.01)
+
+        user_id = uuid4()
+        user_cache.put(AuthUser(id=user_id, name="cached", role="USER", api_key=f"key-{user_id}"))
+        order_registry.put(OrderEntry(
+            id=uuid4(), kind=LIMIT, user_id=user_id, ticker="PROBE", direction="BUY", qty=1, price=1,
+            timestamp=datetime.utcnow(), status="NEW"
+        ))
+        results.put(("ready", str(user_id)))
+
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(None, commands.get) != "check":
+            pass
+        results.put(("cached", user_cache.get(f"key-{user_id}") is not None, len(order_registry)))
+        await loop.run_in_executor(None, commands.get)
+        await invalidation.stop_invalidation_listener()
+
+    asyncio.run(main())
+
+
+async def publish(kind: str, key, commit: bool = True):
+    async with AsyncSessionLocal() as db:
+        await publish_invalidation(db, kind, key)
+        if commit:
+            await db.commit()
+        else:
+            await db.rollback()
+
+
+async def drive(commands, results, events: int, rate: float):
+    _, user_id = await asyncio.get_running_loop().run_in_executor(None, results.get)
+
+    # A rolled back write must not reach other processes; a committed one must
+    rolled_back = str(uuid4())
+    await publish(USER, rolled_back, commit=False)
+    await publish(USER, user_id)
+
+    interval = 1 / rate
+    for _ in range(events):
+        started = time.perf_counter()
+        await publish(PROBE, repr(time.time()))
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+    await publish(MARKER, "done")
+    _, _, seen, latencies = await asyncio.get_running_loop().run_in_executor(None, results.get)
+    commands.put("check")
+    _, still_cached, registry_size = await asyncio.get_running_loop().run_in_executor(None, results.get)
+    commands.put("stop")
+    await dispose_engines()
+
+    return seen, rolled_back, user_id, still_cached, registry_size, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delivery of cache invalidation events between processes")
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=500, help="events per second, one transaction each")
+    args = parser.parse_args()
+
+    # Spawned rather than forked: a forked child would share this process's
+    # origin and skip every event as its own
+    context = multiprocessing.get_context("spawn")
+    commands = context.Queue()
+    results = context.Queue()
+    listener = context.Process(target=listen, args=(commands, results))
+    listener.start()
+    try:
+        seen, rolled_back, user_id, still_cached, registry_size, latencies = asyncio.run(
+            drive(commands, results, args.events, args.rate)
+        )
+    finally:
+        listener.join(timeout=10)
+        if listener.is_alive():
+            listener.terminate()
+
+    failures = []
+    if rolled_back in seen:
+        failures.append("event of a rolled back transaction was delivered")
+    if user_id not in seen or still_cached or registry_size:
+        failures.append("committed user invalidation was not applied")
+    if len(latencies) != args.events:
+        failures.append(f"{args.events - len(latencies)} events lost")
+
+    latencies.sort()
+    print(f"delivered {len(latencies)}/{args.events} events at {args.rate:.0f}/s")
+    if latencies:
+        print(
+            f"latency ms: p50 {statistics.median(latencies) * 1000:.2f}  "
+            f"p99 {latencies[max(0, -(-99 * len(latencies) // 100) - 1)] * 1000:.2f}  max {latencies[-1] * 1000:.2f}"
+        )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("user cache and order registry invalidated; rolled back event not delivered")
+
+
+if __name__ == "__main__":
+    main()
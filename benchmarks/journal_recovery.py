@@ -0,0 +1,96 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from uuid import UUID
+from app.journal import (
+    SEGMENT_PREFIX, SNAPSHOT_PREFIX, encode_records, encode_snapshot, order_event, fill_event, cancel_event, recover
+)
+from app.order_book import OrderBook
+
+
+def write_journal(directory: str, events: int, tickers: list[str], segment_size: int):
+    rng = random.Random(42)
+    users = [UUID(int=rng.getrandbits(128)) for _ in range(1000)]
+    resting = {ticker: [] for ticker in tickers}
+
+    for ticker in tickers:
+        with open(os.path.join(directory, f"{SNAPSHOT_PREFIX}{ticker}.bin"), "wb") as file:
+            file.write(encode_snapshot(OrderBook(ticker), 0))
+
+    seq = 1
+    segment = None
+    batch = []
+    for _ in range(events):
+        ticker = rng.choice(tickers)
+        orders = resting[ticker]
+        roll = rng.random()
+        if roll < 0.6 or len(orders) < 100:
+            order_id = UUID(int=rng.getrandbits(128))
+            direction = "BUY" if rng.random() < 0.5 else "SELL"
+            price = rng.randint(900, 999) if direction == "BUY" else rng.randint(1001, 1100)
+            qty = rng.randint(1, 100)
+            orders.append([order_id, price, qty])
+            batch.append(order_event(ticker, order_id, rng.choice(users), direction, price, qty))
+        else:
+            index = rng.randrange(len(orders))
+            order_id, price, qty = orders[index]
+            if roll < 0.85:
+                trade_qty = rng.randint(1, qty)
+                batch.append(fill_event(ticker, UUID(int=rng.getrandbits(128)), order_id, price, trade_qty))
+                orders[index][2] -= trade_qty
+            else:
+                batch.append(cancel_event(ticker, order_id))
+                orders[index][2] = 0
+            if orders[index][2] == 0:
+                orders[index] = orders[-1]
+                orders.pop()
+
+        if len(batch) == 10000:
+            if segment is None or segment.tell() >= segment_size:
+                if segment is not None:
+                    segment.close()
+                segment = open(os.path.join(directory, f"{SEGMENT_PREFIX}{seq:020d}.bin"), "wb")
+            segment.write(encode_records(seq, batch))
+            seq += len(batch)
+            batch = []
+
+    if batch:
+        if segment is None:
+            segment = open(os.path.join(directory, f"{SEGMENT_PREFIX}{seq:020d}.bin"), "wb")
+        segment.write(encode_records(seq, batch))
+    if segment is not None:
+        segment.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure order book recovery time from the event journal")
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--tickers", type=int, default=10)
+    parser.add_argument("--segment-size", type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    tickers = [f"T{chr(ord('A') + index % 26)}{index // 26:02d}" for index in range(args.tickers)]
+
+    for events in args.events:
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            write_journal(directory, events, tickers, args.segment_size)
+            written = time.perf_counter() - started
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+            started = time.perf_counter()
+            books, _, last_seq = recover(directory)
+            elapsed = time.perf_counter() - started
+
+            resting = sum(len(book) for book in books.values())
+            print(
+                f"{events:>11,} events ({size / 2 ** 20:.0f} MiB, generated in {written:.1f}s): "
+                f"recovered {resting:,} resting orders in {elapsed:.2f}s "
+                f"({last_seq / elapsed:,.0f} events/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from uuid import uuid4
+import orjson
+from app import sharding
+from app.config import settings
+from app.matching import get_matcher
+from app.order_book import OrderBook
+from app.routers.public import _orderbook_snapshot
+from app.shared_l2 import SharedL2Reader, SharedL2Writer
+
+TICKER = "BENCHLTWO"
+MID = 1_000_000
+
+
+def build_book(levels: int, qty: int = 10) -> OrderBook:
+    book = OrderBook(TICKER)
+    user_id = uuid4()
+    for index in range(levels):
+        book.add(uuid4(), user_id, "BUY", MID - 1 - index, qty)
+        book.add(uuid4(), user_id, "SELL", MID + index, qty)
+
+    return book
+
+
+def rate(function, duration: float) -> float:
+    calls = 0
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            function()
+        calls += 100
+
+    return calls / (time.perf_counter() - started)
+
+
+def read_hits(directory: str, limit: int, duration: float, results):
+    # The published version does not change: answered from the header
+    reader = SharedL2Reader(directory)
+    results.put(rate(lambda: reader.read(TICKER, limit), duration))
+
+
+def read_misses(directory: str, limit: int, duration: float, results):
+    # Every read copies, validates and encodes the levels again
+    reader = SharedL2Reader(directory)
+
+    def read():
+        reader._cache.clear()
+        reader.read(TICKER, limit)
+
+    results.put(rate(read, duration))
+
+
+def run_readers(target, readers: int, directory: str, limit: int, duration: float) -> float:
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=target, args=(directory, limit, duration, results)) for _ in range(readers)
+    ]
+    for process in processes:
+        process.start()
+    total = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+
+    return total
+
+
+def churn(directory: str, depth: int, levels: int, stop):
+    # Republishes as fast as it can; every level of version v has qty v, so a
+    # torn snapshot shows up as mixed quantities
+    writer = SharedL2Writer(directory, depth)
+    book = build_book(levels)
+    while not stop.is_set():
+        book.version += 1
+        for side in (book.bids, book.asks):
+            for level in side.levels(depth):
+                level.qty = book.version % 1_000_000 + 1
+        writer.publish(book)
+
+
+def check_torn(directory: str, depth: int, levels: int, limit: int, duration: float) -> tuple:
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(target=churn, args=(directory, depth, levels, stop))
+    writer.start()
+    reader = SharedL2Reader(directory)
+    reads = torn = 0
+    deadline = time.perf_counter() + duration
+    try:
+        while time.perf_counter() < deadline:
+            snapshot = reader.read(TICKER, limit)
+            if snapshot is None:
+                continue
+            reads += 1
+            body = orjson.loads(snapshot[1])
+            quantities = {level["qty"] for level in body["bid_levels"] + body["ask_levels"]}
+            expected = min(limit, levels)
+            if len(quantities) != 1 or len(body["bid_levels"]) != expected or len(body["ask_levels"]) != expected:
+                torn += 1
+    finally:
+        stop.set()
+        writer.join()
+
+    return reads, torn, reader.retries
+
+
+async def ipc_rate(directory: str, book: OrderBook, limit: int, duration: float) -> float:
+    # The path shared memory replaces: a request to the owning worker over
+    # its Unix socket, served there from the cached L2 snapshot
+    settings.matching_socket_dir = directory
+    get_matcher(TICKER).book = book
+    server = await asyncio.start_unix_server(sharding._serve_connection, sharding.socket_path(0))
+    client = sharding.WorkerClient(0)
+    name = sharding._operation_name(_orderbook_snapshot)
+    try:
+        calls = 0
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        while time.perf_counter() < deadline:
+            await client.call(name, (TICKER, limit))
+            calls += 1
+        return calls / (time.perf_counter() - started)
+    finally:
+        await client.close()
+        # Lets the server side see the end of the connection
+        await asyncio.sleep(0.1)
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order book read throughput from the shared-memory L2 snapshots")
+    parser.add_argument("--levels", type=int, default=1000, help="price levels per side in the book")
+    parser.add_argument("--depth", type=int, default=settings.l2_shared_depth, help="levels published per side")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        book = build_book(args.levels)
+        SharedL2Writer(directory, args.depth).publish(book)
+
+        for readers in args.readers:
+            hits = run_readers(read_hits, readers, directory, args.limit, args.duration)
+            misses = run_readers(read_misses, readers, directory, args.limit, args.duration)
+            print(
+                f"{readers:2d} readers: unchanged {hits:12,.0f} reads/s ({hits / readers:12,.0f} per process)  "
+                f"changed {misses:10,.0f} reads/s ({misses / readers:10,.0f} per process)"
+            )
+
+        ipc = asyncio.run(ipc_rate(directory, book, args.limit, args.duration))
+        print(f"owner over IPC: {ipc:10,.0f} reads/s")
+
+        reads, torn, retries = check_torn(directory, args.depth, args.levels, args.limit, args.duration)
+        print(f"with a concurrent writer: {reads:,} reads, {torn} torn, {retries:,} seqlock retries")
+        print(f"cores: {os.cpu_count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+from uuid import uuid4
+import httpx
+
+ADMIN_API_KEY = "key-176708d1-4ab1-4c02-998c-c870dcf66ebb"
+
+# Share of each kind of action in the generated flow
+DEFAULT_MIX = {"resting": 0.5, "crossing": 0.2, "market": 0.1, "cancel": 0.2}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.dropped = 0
+
+    def record(self, endpoint: str, status: int, elapsed: float):
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][status] += 1
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            statuses = self.statuses[endpoint]
+            errors = sum(count for status, count in statuses.items() if status >= 400 or status == 0)
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "per_second": len(latencies) / duration,
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "latency_ms": {
+                    "p50": _percentile(latencies, 0.50) * 1000,
+                    "p99": _percentile(latencies, 0.99) * 1000,
+                    "p999": _percentile(latencies, 0.999) * 1000,
+                    "max": latencies[-1] * 1000,
+                },
+            }
+
+        orders = sum(
+            count
+            for endpoint, statuses in self.statuses.items() if endpoint.startswith("order.")
+            for status, count in statuses.items() if status == 200
+        )
+        return {
+            "duration_s": duration,
+            "orders_per_second": orders / duration,
+            "dropped": self.dropped,
+            "endpoints": endpoints,
+        }
+
+
+def _percentile(values: list, quantile: float) -> float:
+    # Nearest rank on sorted values
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+class Trader:
+    def __init__(self, user_id: str, api_key: str):
+        self.user_id = user_id
+        self.headers = {"Authorization": f"TOKEN {api_key}"}
+        self.resting = []
+
+
+async def timed(client: httpx.AsyncClient, stats: Stats, endpoint: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, 0
+    stats.record(endpoint, status, time.perf_counter() - started)
+
+    return response
+
+
+async def setup(client: httpx.AsyncClient, stats: Stats, users: int, tickers: list, deposit: int) -> list:
+    run_id = uuid4().hex[:8]
+    admin = {"Authorization": f"TOKEN {ADMIN_API_KEY}"}
+
+    async def create(index: int) -> Trader:
+        response = await timed(
+            client, stats, "public.register", "POST", "/api/v1/public/register", json={"name": f"load-{run_id}-{index}"}
+        )
+        response.raise_for_status()
+        user = response.json()
+        for ticker in tickers + ["RUB"]:
+            response = await timed(
+                client, stats, "admin.deposit", "POST", "/api/v1/admin/balance/deposit", headers=admin,
+                json={"user_id": user["id"], "ticker": ticker, "amount": deposit}
+            )
+            response.raise_for_status()
+        return Trader(user["id"], user["api_key"])
+
+    return await asyncio.gather(*(create(index) for index in range(users)))
+
+
+async def act(client: httpx.AsyncClient, stats: Stats, rng: random.Random, trader: Trader, action: str,
+              tickers: list, mid: int, spread: int):
+    ticker = rng.choice(tickers)
+    direction = rng.choice(("BUY", "SELL"))
+    qty = rng.randint(1, 10)
+
+    # With nothing left to cancel the action degrades to a resting order
+    if action == "cancel" and trader.resting:
+        order_id = trader.resting.pop(rng.randrange(len(trader.resting)))
+        await timed(client, stats, "order.cancel", "DELETE", f"/api/v1/order/{order_id}", headers=trader.headers)
+        return
+
+    if action == "market":
+        body = {"direction": direction, "ticker": ticker, "qty": qty}
+        endpoint = "order.market"
+    elif action == "crossing":
+        offset = rng.randint(0, spread)
+        price = mid + offset if direction == "BUY" else mid - offset
+        body = {"direction": direction, "ticker": ticker, "qty": qty, "price": price}
+        endpoint = "order.limit_crossing"
+    else:
+        offset = rng.randint(1, spread)
+        price = mid - offset if direction == "BUY" else mid + offset
+        body = {"direction": direction, "ticker": ticker, "qty": qty, "price": price}
+        endpoint = "order.limit_resting"
+
+    response = await timed(client, stats, endpoint, "POST", "/api/v1/order", headers=trader.headers, json=body)
+    if response is not None and response.status_code == 200 and "price" in body:
+        trader.resting.append(response.json()["order_id"])
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        traders = await setup(client, stats, args.users, args.tickers, args.deposit)
+
+        run_stats = Stats()
+        actions, weights = zip(*args.mix.items())
+        in_flight = set()
+        semaphore = asyncio.Semaphore(args.concurrency)
+        interval = 1 / args.rate
+        started = time.perf_counter()
+        deadline = started + args.duration
+        next_at = started
+
+        async def one():
+            try:
+                await act(
+                    client, run_stats, rng, rng.choice(traders), rng.choices(actions, weights)[0],
+                    args.tickers, args.mid, args.spread
+                )
+            finally:
+                semaphore.release()
+
+        # Open loop: requests are issued on schedule whatever the latency. When
+        # every connection is busy the request is dropped and counted, so an
+        # overloaded server shows up as drops instead of a slower offered rate.
+        while next_at < deadline:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at += rng.expovariate(1 / interval) if args.poisson else interval
+
+            if semaphore.locked():
+                run_stats.dropped += 1
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(one())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        await asyncio.gather(*in_flight)
+        duration = time.perf_counter() - started
+
+    report = run_stats.report(duration)
+    report["setup"] = stats.report(1.0)["endpoints"]
+    report["config"] = {
+        key: value for key, value in vars(args).items() if key not in ("output",)
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive mixed order flow against a running exchange instance")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--tickers", nargs="+", default=["TESTA", "TESTB"])
+    parser.add_argument("--deposit", type=int, default=1_000_000)
+    parser.add_argument("--rate", type=float, default=200, help="target actions per second")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=64, help="maximum requests in flight")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX,
+                        help='JSON weights, e.g. \'{"resting": 0.5, "crossing": 0.2, "market": 0.1, "cancel": 0.2}\'')
+    parser.add_argument("--mid", type=int, default=1000)
+    parser.add_argument("--spread", type=int, default=20)
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(data)
+    else:
+        sys.stdout.write(data + "\n")
+
+    for endpoint, result in report["endpoints"].items():
+        latency = result["latency_ms"]
+        print(
+            f"{endpoint:22s} {result['requests']:7d} req {result['per_second']:8.1f}/s "
+            f"err {result['error_rate']:6.2%}  p50 {latency['p50']:7.1f} ms  p99 {latency['p99']:7.1f} ms  "
+            f"p999 {latency['p999']:7.1f} ms",
+            file=sys.stderr
+        )
+    print(f"orders/s {report['orders_per_second']:.1f}, dropped {report['dropped']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
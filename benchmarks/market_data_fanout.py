@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+from app.market_data import Subscriber, publish_changes, subscribe
+from app.order_book import OrderBook
+
+
+async def run(subscribers: int, messages: int, slow_ratio: float, max_pending: int):
+    book = OrderBook("BENCH")
+    user_id = uuid4()
+    for price in range(900, 1000):
+        book.add(uuid4(), user_id, "BUY", price, 10)
+        book.add(uuid4(), user_id, "SELL", price + 100, 10)
+
+    delivered = 0
+    slow_every = int(1 / slow_ratio) if slow_ratio else 0
+
+    async def fast_send(data: str):
+        nonlocal delivered
+        delivered += 1
+
+    async def slow_send(data: str):
+        nonlocal delivered
+        delivered += 1
+        await asyncio.sleep(0.01)
+
+    clients = []
+    for index in range(subscribers):
+        send = slow_send if slow_every and index % slow_every == 0 else fast_send
+        subscriber = Subscriber(send, max_pending)
+        subscribe(subscriber, book)
+        clients.append((subscriber, asyncio.create_task(subscriber.run())))
+    publish_changes(book, reloaded=True)
+    await asyncio.sleep(0)
+
+    delivered = 0
+    started = time.perf_counter()
+    publish_time = 0.0
+    for index in range(messages):
+        order_id = uuid4()
+        book.add(order_id, user_id, "BUY", 900 + index % 100, 1)
+        published = time.perf_counter()
+        publish_changes(book, reloaded=False)
+        publish_time += time.perf_counter() - published
+        await asyncio.sleep(0)
+
+    while any(subscriber._queue for subscriber, _ in clients if not subscriber.conflated):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    conflated = sum(subscriber.conflated for subscriber, _ in clients)
+    for _, task in clients:
+        task.cancel()
+    await asyncio.gather(*(task for _, task in clients), return_exceptions=True)
+
+    print(
+        f"{subscribers:>6} subscribers: {messages} updates in {elapsed:.2f}s, "
+        f"{delivered / elapsed:,.0f} deliveries/s, publish {publish_time / messages * 1e6:,.1f} us/update, "
+        f"{conflated} conflated"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure market-data fan-out throughput to local subscribers")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--slow-ratio", type=float, default=0.01)
+    parser.add_argument("--max-pending", type=int, default=100)
+    args = parser.parse_args()
+
+    for subscribers in args.subscribers:
+        asyncio.run(run(subscribers, args.messages, args.slow_ratio, args.max_pending))
+
+
+if __name__ == "__main__":
+    main()
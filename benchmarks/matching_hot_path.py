@@ -0,0 +1,297 @@
+import argparse
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from uuid import uuid4
+from app.db_models.limit_orders import LimitOrder_db
+from app.db_models.market_orders import MarketOrder_db
+from app.models import LimitOrderBody, OrderStatus
+from app.order_book import OrderBook
+from app.routers.order import _add_to_orderbook, _execute_limit_order, _execute_market_order
+
+TICKER = "BENCHHOT"
+MID = 1_000_000
+LEVEL_QTY = 10
+
+
+class NullResult:
+    def __iter__(self):
+        return iter(())
+
+    def scalars(self):
+        return iter(())
+
+
+class NullSession:
+    # Stands in for AsyncSession: statements are still built by the code
+    # under test but never sent anywhere, so only matching and settlement
+    # bookkeeping is measured.
+    async def execute(self, statement, *args, **kwargs):
+        return NullResult()
+
+    async def flush(self):
+        pass
+
+    def add(self, instance):
+        pass
+
+
+def drive(coroutine):
+    # Nothing awaited on a NullSession suspends, so the coroutine runs to
+    # completion on the first send without an event loop
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("Benchmarked coroutine suspended")
+
+
+def build_book(levels: int) -> OrderBook:
+    # Bids below MID and asks from MID up, one order of LEVEL_QTY per level
+    book = OrderBook(TICKER)
+    user_id = uuid4()
+    for index in range(levels):
+        book.add(uuid4(), user_id, "BUY", MID - 1 - index, LEVEL_QTY)
+        book.add(uuid4(), user_id, "SELL", MID + index, LEVEL_QTY)
+
+    return book
+
+
+def limit_order(direction: str, price: int, qty: int) -> LimitOrder_db:
+    return LimitOrder_db(
+        id=uuid4(), user_id=uuid4(), ticker=TICKER, direction=direction, price=price, qty=qty,
+        status=OrderStatus.NEW, filled=0, timestamp=datetime.utcnow()
+    )
+
+
+def market_order(direction: str, qty: int) -> MarketOrder_db:
+    return MarketOrder_db(
+        id=uuid4(), user_id=uuid4(), ticker=TICKER, direction=direction, qty=qty,
+        status=OrderStatus.NEW, timestamp=datetime.utcnow()
+    )
+
+
+def restore_asks(book: OrderBook, prices):
+    user_id = uuid4()
+    for price in prices:
+        level = book.asks.get_level(price)
+        missing = LEVEL_QTY - (level.qty if level is not None else 0)
+        if missing > 0:
+            book.add(uuid4(), user_id, "SELL", price, missing)
+
+
+def insert_scenario(book: OrderBook, levels: int, rng: random.Random):
+    # A resting bid joins a random existing level and is cancelled afterwards
+    def setup():
+        return limit_order("BUY", MID - 1 - rng.randrange(levels), 1)
+
+    def op(db, order):
+        return _add_to_orderbook(db, book, order, 0)
+
+    def teardown(order):
+        book.cancel(order.id)
+
+    return setup, op, teardown
+
+
+def limit_insert_scenario(book: OrderBook, levels: int, rng: random.Random):
+    # The full limit path for an order that does not cross and rests
+    def setup():
+        order = limit_order("BUY", MID - 1 - rng.randrange(levels), 1)
+        return order, LimitOrderBody(direction="BUY", ticker=TICKER, qty=1, price=order.price)
+
+    def op(db, state):
+        return _execute_limit_order(db, state[0], book, state[1])
+
+    def teardown(state):
+        book.cancel(state[0].id)
+
+    return setup, op, teardown
+
+
+def sweep_scenario(book: OrderBook, levels: int, rng: random.Random, depth: int):
+    # A market buy consuming the best `depth` ask levels, refilled afterwards
+    depth = min(depth, levels)
+
+    def setup():
+        return market_order("BUY", depth * LEVEL_QTY)
+
+    def op(db, order):
+        return _execute_market_order(db, order, book)
+
+    def teardown(order):
+        restore_asks(book, range(MID, MID + depth))
+
+    return setup, op, teardown
+
+
+def book_sweep_scenario(book: OrderBook, levels: int, rng: random.Random, depth: int):
+    # The same sweep on the in-memory book alone, without settlement
+    depth = min(depth, levels)
+
+    async def match(qty: int):
+        return book.match("BUY", qty)
+
+    def setup():
+        return depth * LEVEL_QTY
+
+    def op(db, qty):
+        return match(qty)
+
+    def teardown(qty):
+        restore_asks(book, range(MID, MID + depth))
+
+    return setup, op, teardown
+
+
+def partial_fill_scenario(book: OrderBook, levels: int, rng: random.Random):
+    # A limit buy at the best ask that only half fills the maker
+    def setup():
+        order = limit_order("BUY", MID, LEVEL_QTY // 2)
+        return order, LimitOrderBody(direction="BUY", ticker=TICKER, qty=order.qty, price=MID)
+
+    def op(db, state):
+        return _execute_limit_order(db, state[0], book, state[1])
+
+    def teardown(state):
+        book.cancel(next(iter(book.asks.get_level(MID).orders)))
+        restore_asks(book, (MID,))
+
+    return setup, op, teardown
+
+
+def partial_rest_scenario(book: OrderBook, levels: int, rng: random.Random):
+    # A limit buy that takes the best ask and rests the rest of its quantity
+    def setup():
+        order = limit_order("BUY", MID, LEVEL_QTY + LEVEL_QTY // 2)
+        return order, LimitOrderBody(direction="BUY", ticker=TICKER, qty=order.qty, price=MID)
+
+    def op(db, state):
+        return _execute_limit_order(db, state[0], book, state[1])
+
+    def teardown(state):
+        book.cancel(state[0].id)
+        restore_asks(book, (MID,))
+
+    return setup, op, teardown
+
+
+def scenarios(sweep_depth: int) -> dict:
+    return {
+        "add_to_orderbook": insert_scenario,
+        "limit_insert": limit_insert_scenario,
+        "limit_partial_fill": partial_fill_scenario,
+        "limit_partial_rest": partial_rest_scenario,
+        f"market_sweep_{sweep_depth}": lambda book, levels, rng: sweep_scenario(book, levels, rng, sweep_depth),
+        f"book_sweep_{sweep_depth}": lambda book, levels, rng: book_sweep_scenario(book, levels, rng, sweep_depth),
+    }
+
+
+def measure(factory, levels: int, ops: int, seed: int) -> dict:
+    db = NullSession()
+    book = build_book(levels)
+    setup, op, teardown = factory(book, levels, random.Random(seed))
+
+    # Timing and allocation tracking run as separate passes: tracemalloc
+    # slows every allocation down by several times
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(ops):
+            state = setup()
+            coroutine = op(db, state)
+            started = time.perf_counter_ns()
+            drive(coroutine)
+            timings.append(time.perf_counter_ns() - started)
+            teardown(state)
+    finally:
+        gc.enable()
+
+    alloc_ops = max(1, ops // 10)
+    peak_bytes = 0
+    retained_bytes = 0
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_ops):
+            state = setup()
+            coroutine = op(db, state)
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            drive(coroutine)
+            after, peak = tracemalloc.get_traced_memory()
+            peak_bytes += peak - before
+            retained_bytes += after - before
+            teardown(state)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "levels": levels,
+        "ops": ops,
+        "median_ns": statistics.median(timings),
+        "mean_ns": statistics.fmean(timings),
+        "p99_ns": sorted(timings)[max(0, -(-99 * ops // 100) - 1)],
+        "peak_bytes_per_op": peak_bytes / alloc_ops,
+        "retained_bytes_per_op": retained_bytes / alloc_ops,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, by_levels in results.items():
+        for levels, result in by_levels.items():
+            previous = baseline.get(name, {}).get(levels)
+            if previous is None:
+                continue
+            for metric in ("median_ns", "peak_bytes_per_op"):
+                if result[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{name} @ {levels} levels: {metric} {previous[metric]:,.0f} -> {result[metric]:,.0f}"
+                    )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the matching hot path without a database")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--ops", type=int, default=2_000)
+    parser.add_argument("--sweep-depth", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write results as JSON, e.g. to refresh the baseline")
+    parser.add_argument("--baseline", help="JSON from an earlier --save to check against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    results = {}
+    for name, factory in scenarios(args.sweep_depth).items():
+        for levels in args.levels:
+            result = measure(factory, levels, args.ops, args.seed)
+            results.setdefault(name, {})[str(levels)] = result
+            print(
+                f"{name:20s} {levels:>7} levels: {result['median_ns']:>10,.0f} ns/op median "
+                f"{result['p99_ns']:>10,.0f} ns p99  {result['peak_bytes_per_op']:>9,.0f} B peak "
+                f"{result['retained_bytes_per_op']:>8,.0f} B retained"
+            )
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
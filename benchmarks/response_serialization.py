@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+import httpx
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.db_models.balances import Balance_db
+from app.db_models.instruments import Instrument_db
+from app.db_models.limit_orders import LimitOrder_db
+from app.db_models.resting_orders import RestingOrder_db
+from app.db_models.transactions import Transaction_db
+from app.db_models.users import User_db
+from app.config import settings
+from app.db_session_provider import AsyncSessionLocal, ReadSessionLocal
+from app.main import app
+from app.matching import stop_matchers
+
+TICKER = "BENCHSER"
+
+
+async def populate(user_id, api_key: str, rows: int):
+    # `rows` orders for the user, half of them resting so the book has
+    # `rows` / 2 levels, and `rows` transactions for the ticker
+    started = datetime.utcnow() - timedelta(days=1)
+    orders = []
+    resting = []
+    for index in range(rows):
+        order_id = uuid4()
+        direction = "BUY" if index % 2 else "SELL"
+        price = 10_000 - index if direction == "BUY" else 20_000 + index
+        timestamp = started + timedelta(seconds=index)
+        is_resting = index < rows // 2
+        orders.append({
+            "id": order_id, "status": "NEW" if is_resting else "EXECUTED", "user_id": user_id,
+            "timestamp": timestamp, "price": price, "direction": direction, "ticker": TICKER, "qty": 10,
+            "filled": 0 if is_resting else 10
+        })
+        if is_resting:
+            resting.append({
+                "order_id": order_id, "ticker": TICKER, "direction": direction, "user_id": user_id,
+                "price": price, "qty": 10, "timestamp": timestamp
+            })
+
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            db.add(Instrument_db(ticker=TICKER, name="Serialization benchmark"))
+            db.add(User_db(id=user_id, name="serialization", role="USER", api_key=api_key))
+            await db.flush()
+            db.add_all(Balance_db(user_id=user_id, ticker=ticker, amount=10 ** 9) for ticker in (TICKER, "RUB"))
+            await db.execute(insert(LimitOrder_db), orders)
+            await db.execute(insert(RestingOrder_db), resting)
+            await db.execute(insert(Transaction_db), [
+                {"ticker": TICKER, "amount": 1, "price": 15_000, "timestamp": started + timedelta(seconds=index)}
+                for index in range(rows)
+            ])
+
+
+async def cleanup(user_id):
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            await db.execute(delete(RestingOrder_db).where(RestingOrder_db.ticker == TICKER))
+            await db.execute(delete(LimitOrder_db).where(LimitOrder_db.ticker == TICKER))
+            await db.execute(delete(Transaction_db).where(Transaction_db.ticker == TICKER))
+            await db.execute(delete(User_db).where(User_db.id == user_id))
+            await db.execute(delete(Instrument_db).where(Instrument_db.ticker == TICKER))
+
+
+async def measure(client: httpx.AsyncClient, url: str, headers: dict, requests: int) -> tuple:
+    response = await client.get(url, headers=headers)
+    response.raise_for_status()
+
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000, len(response.content)
+
+
+async def main_async(dsn: str, rows: int, requests: int):
+    engine = create_async_engine(dsn)
+    AsyncSessionLocal.configure(bind=engine)
+    ReadSessionLocal.configure(bind=engine)
+
+    user_id = uuid4()
+    api_key = f"key-{uuid4()}"
+    await populate(user_id, api_key, rows)
+    headers = {"Authorization": f"TOKEN {api_key}"}
+    endpoints = {
+        "list_orders": f"/api/v1/order?limit={rows}",
+        "get_transaction_history": f"/api/v1/public/transactions/{TICKER}?limit={rows}",
+        "get_orderbook": f"/api/v1/public/orderbook/{TICKER}?limit={rows}",
+        "get_balances": "/api/v1/balance",
+    }
+
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            for name, url in endpoints.items():
+                median, p99, size = await measure(client, url, headers, requests)
+                print(f"{name:24s} {size:>9,d} B  median {median:8.2f} ms  p99 {p99:8.2f} ms")
+    finally:
+        await stop_matchers()
+        await cleanup(user_id)
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the hot read endpoints on large responses")
+    parser.add_argument("--dsn", default=settings.database_url)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args.dsn, args.rows, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+from sqlalchemy import delete, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from app.db_models.balances import Balance_db
+from app.db_models.instruments import Instrument_db
+from app.db_models.users import User_db
+from app.config import settings
+from app.db_session_provider import AsyncSessionLocal
+from app.dependencies import AuthUser
+from app.matching import get_matcher, stop_matchers
+from app.models import LimitOrderBody, MarketOrderBody
+from app.routers.order import _process_order
+
+TICKER = "BENCHSETL"
+
+
+async def create_user(name: str, balances: dict) -> AuthUser:
+    user = AuthUser(id=uuid4(), name=name, role="USER", api_key=f"key-{uuid4()}")
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            db.add(User_db(id=user.id, name=user.name, role=user.role, api_key=user.api_key))
+            await db.flush()
+            for ticker, amount in balances.items():
+                db.add(Balance_db(user_id=user.id, ticker=ticker, amount=amount))
+
+    return user
+
+
+async def run(levels: int, counter: dict) -> tuple:
+    matcher = get_matcher(TICKER)
+    makers = [await create_user(f"maker{index}", {TICKER: 10}) for index in range(levels)]
+    taker = await create_user("taker", {"RUB": 10 * levels * (1000 + levels)})
+
+    for index, maker in enumerate(makers):
+        body = LimitOrderBody(direction="SELL", ticker=TICKER, qty=10, price=1000 + index)
+        await matcher.submit(lambda m, maker=maker, body=body: _process_order(m, maker, body))
+
+    body = MarketOrderBody(direction="BUY", ticker=TICKER, qty=10 * levels)
+    counter["queries"] = 0
+    started = time.perf_counter()
+    await matcher.submit(lambda m: _process_order(m, taker, body))
+    elapsed = time.perf_counter() - started
+
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            await db.execute(delete(User_db).where(User_db.id.in_([user.id for user in makers + [taker]])))
+
+    return counter["queries"], elapsed
+
+
+async def main_async(dsn: str, sweeps: list):
+    engine = create_async_engine(dsn)
+    AsyncSessionLocal.configure(bind=engine)
+    counter = {"queries": 0}
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(*args):
+        counter["queries"] += 1
+
+    async with AsyncSessionLocal() as db:
+        async with db.begin():
+            db.add(Instrument_db(ticker=TICKER, name="Settlement benchmark"))
+
+    try:
+        for levels in sweeps:
+            queries, elapsed = await run(levels, counter)
+            print(f"sweep of {levels:4d} levels: {queries:5d} queries, {elapsed * 1000:8.1f} ms")
+    finally:
+        await stop_matchers()
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await db.execute(delete(Instrument_db).where(Instrument_db.ticker == TICKER))
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count database queries issued by a market order sweeping the book")
+    parser.add_argument("--dsn", default=settings.database_url)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 50, 200])
+    args = parser.parse_args()
+
+    asyncio.run(main_async(args.dsn, args.levels))
+
+
+if __name__ == "__main__":
+    main()
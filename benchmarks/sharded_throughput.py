@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import string
+import subprocess
+import sys
+import time
+import httpx
+
+ADMIN_API_KEY = "key-176708d1-4ab1-4c02-998c-c870dcf66ebb"
+
+
+def start_stack(workers: int, http_workers: int, port: int) -> subprocess.Popen:
+    # Rate limits are lifted so that the stack, not admission control, is measured
+    env = dict(os.environ, ORDER_RATE_USER="0", ORDER_RATE_ADMIN="0")
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "app.sharding", "serve", "--workers", str(workers),
+            "--http-workers", str(http_workers), "--host", "127.0.0.1", "--port", str(port)
+        ],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def stop_stack(process: subprocess.Popen):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Stack exited during startup")
+        try:
+            if (await client.get("/api/v1/public/instrument")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Stack did not become ready")
+
+
+async def setup(client: httpx.AsyncClient, tickers: int, users: int, deposit: int) -> tuple:
+    admin = {"Authorization": f"TOKEN {ADMIN_API_KEY}"}
+    names = ["SB" + "".join(random.choices(string.ascii_uppercase, k=6)) for _ in range(tickers)]
+    for ticker in names:
+        response = await client.post("/api/v1/admin/instrument", headers=admin, json={"name": ticker, "ticker": ticker})
+        response.raise_for_status()
+
+    headers = []
+    for index in range(users):
+        response = await client.post("/api/v1/public/register", json={"name": f"{names[0]}-{index}"})
+        response.raise_for_status()
+        user = response.json()
+        for ticker in names + ["RUB"]:
+            response = await client.post(
+                "/api/v1/admin/balance/deposit", headers=admin,
+                json={"user_id": user["id"], "ticker": ticker, "amount": deposit}
+            )
+            response.raise_for_status()
+        headers.append({"Authorization": f"TOKEN {user['api_key']}"})
+
+    return names, headers
+
+
+async def drive(client: httpx.AsyncClient, tickers: list, headers: list, concurrency: int, duration: float) -> dict:
+    # Closed loop: each of `concurrency` clients places limit orders back to
+    # back, half resting and half crossing, spread evenly over the tickers
+    statuses = {}
+    deadline = time.perf_counter() + duration
+
+    async def loop(index: int):
+        rng = random.Random(index)
+        user = headers[index % len(headers)]
+        while time.perf_counter() < deadline:
+            direction = rng.choice(("BUY", "SELL"))
+            offset = rng.randint(-5, 20)
+            body = {
+                "direction": direction,
+                "ticker": rng.choice(tickers),
+                "qty": rng.randint(1, 10),
+                "price": 1000 - offset if direction == "BUY" else 1000 + offset,
+            }
+            try:
+                status = (await client.post("/api/v1/order", headers=user, json=body)).status_code
+            except httpx.HTTPError:
+                status = 0
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(loop(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "orders_per_second": statuses.get(200, 0) / elapsed,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def measure(workers: int, args) -> dict:
+    process = start_stack(workers, args.http_workers or max(workers, 1), args.port)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=args.timeout
+        ) as client:
+            await wait_ready(client, process, args.startup_timeout)
+            tickers, headers = await setup(client, args.tickers, args.users, args.deposit)
+            await drive(client, tickers, headers, args.concurrency, args.warmup)
+            result = await drive(client, tickers, headers, args.concurrency, args.duration)
+    finally:
+        stop_stack(process)
+
+    result["workers"] = workers
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order placement throughput of the sharded stack by worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="matching worker counts to compare; 0 is the single-process mode")
+    parser.add_argument("--http-workers", type=int, default=0, help="uvicorn workers, by default as many as matching")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--tickers", type=int, default=32)
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--deposit", type=int, default=10 ** 9)
+    parser.add_argument("--concurrency", type=int, default=64, help="clients placing orders back to back")
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        result = asyncio.run(measure(workers, args))
+        results.append(result)
+        print(f"{workers:2d} workers: {result['orders_per_second']:9.1f} orders/s  {result['statuses']}")
+
+    print(f"cores: {os.cpu_count()}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import random
+import re
+import statistics
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+from app.db_models.transactions import Transaction_db
+from app.db_session_provider import AsyncSessionLocal, dispose_engines
+from app.partitions import hot_partition_start, month_start
+from app.routers.public import _latest_transactions
+
+TICKER = "BENCHHIST"
+
+
+async def populate(rows: int, months: int):
+    # Trades spread evenly over the last `months` months, most of them in
+    # partitions older than the current one
+    now = datetime.utcnow()
+    first = month_start(now, -(months - 1))
+    span = (now - first).total_seconds()
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            text("INSERT INTO instruments (name, ticker) VALUES (:ticker, :ticker) ON CONFLICT DO NOTHING"),
+            {"ticker": TICKER}
+        )
+        for months_back in range(months):
+            await db.execute(
+                text("SELECT create_transactions_partition(:month)"), {"month": month_start(now, -months_back).date()}
+            )
+        for start in range(0, rows, 10000):
+            await db.execute(Transaction_db.__table__.insert(), [
+                {
+                    "ticker": TICKER,
+                    "amount": random.randint(1, 10),
+                    "price": random.randint(90, 110),
+                    "timestamp": first + timedelta(seconds=span * index / rows)
+                }
+                for index in range(start, min(rows, start + 10000))
+            ])
+        await db.commit()
+        await db.execute(text("ANALYZE transactions"))
+
+
+async def partitions_scanned(db, query) -> int:
+    compiled = query.compile(db.bind, compile_kwargs={"literal_binds": True})
+    plan = (await db.execute(text(f"EXPLAIN {compiled}"))).scalars().all()
+    return len({match for line in plan for match in re.findall(r"on (transactions_p\d+)", line)})
+
+
+async def measure(limit: int, repeat: int):
+    query = select(
+        Transaction_db.id, Transaction_db.ticker, Transaction_db.amount, Transaction_db.price, Transaction_db.timestamp
+    ).where(Transaction_db.ticker == TICKER)
+    unbounded = query.order_by(Transaction_db.timestamp.desc(), Transaction_db.id.desc()).limit(limit)
+
+    async with AsyncSessionLocal() as db:
+        async def latest():
+            return await _latest_transactions(db, query, limit)
+
+        async def scan():
+            return (await db.execute(unbounded)).all()
+
+        assert [row.id for row in await latest()] == [row.id for row in await scan()]
+        for name, function in (("first page, hot partition", latest), ("first page, all partitions", scan)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                await function()
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            print(
+                f"{name:28s} p50 {statistics.median(timings) * 1000:7.3f} ms  "
+                f"p99 {timings[int(len(timings) * 0.99) - 1] * 1000:7.3f} ms"
+            )
+
+        start = hot_partition_start()
+        hot = unbounded.where(Transaction_db.timestamp >= start, Transaction_db.timestamp < month_start(start, 1))
+        print(
+            f"partitions in plan: hot partition {await partitions_scanned(db, hot)}, "
+            f"all partitions {await partitions_scanned(db, unbounded)}"
+        )
+
+
+async def cleanup():
+    # Cascades to the benchmark's trades in every partition
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("DELETE FROM instruments WHERE ticker = :ticker"), {"ticker": TICKER})
+        await db.commit()
+    await dispose_engines()
+
+
+async def run(rows: int, months: int, limit: int, repeat: int):
+    try:
+        await populate(rows, months)
+        await measure(limit, repeat)
+    finally:
+        await cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recent trades from the partitioned transactions table")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.rows, args.months, args.limit, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
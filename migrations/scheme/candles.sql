@@ -0,0 +1,12 @@
+-- OHLCV bars flushed from memory and rebuilt from transactions for older ranges
+CREATE TABLE if not exists candles (
+                         ticker VARCHAR(10) NOT NULL REFERENCES instruments(ticker) ON DELETE CASCADE,
+                         interval VARCHAR(3) NOT NULL CHECK (interval IN ('1s', '1m', '5m', '1h', '1d')),
+                         start TIMESTAMP NOT NULL,
+                         open INT NOT NULL,
+                         high INT NOT NULL,
+                         low INT NOT NULL,
+                         close INT NOT NULL,
+                         volume BIGINT NOT NULL,
+                         PRIMARY KEY (ticker, interval, start)
+);
@@ -0,0 +1,3 @@
+-- Serves per-user order pages filtered by status and ordered by (timestamp, id) without sorting
+CREATE INDEX if not exists ix_limit_orders_user_status_timestamp ON limit_orders (user_id, status, timestamp, id);
+CREATE INDEX if not exists ix_market_orders_user_status_timestamp ON market_orders (user_id, status, timestamp, id);
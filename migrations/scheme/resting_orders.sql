@@ -0,0 +1,34 @@
+-- Resting limit orders, one row per order instead of one JSON document per ticker
+CREATE TABLE if not exists resting_orders (
+                                order_id UUID PRIMARY KEY REFERENCES limit_orders(id) ON DELETE CASCADE,
+                                ticker VARCHAR(10) NOT NULL REFERENCES instruments(ticker) ON DELETE CASCADE,
+                                direction VARCHAR(50) NOT NULL CHECK (direction IN ('BUY', 'SELL')),
+                                user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                                price INT NOT NULL CHECK (price > 0),
+                                qty INT NOT NULL CHECK (qty > 0),
+                                timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX if not exists ix_resting_orders_book ON resting_orders (ticker, direction, price, timestamp);
+
+INSERT INTO resting_orders (order_id, ticker, direction, user_id, price, qty, timestamp)
+SELECT lo.id, lo.ticker, side.direction, lo.user_id, (level ->> 'price')::int, (level ->> 'qty')::int, lo.timestamp
+FROM orderbook ob
+         CROSS JOIN LATERAL (VALUES ('BUY', ob.bid_levels), ('SELL', ob.ask_levels)) AS side (direction, levels)
+         CROSS JOIN LATERAL json_array_elements(side.levels) AS level
+         JOIN limit_orders lo ON lo.id = (level ->> 'order_id')::uuid
+WHERE (level ->> 'qty')::int > 0
+  AND lo.user_id IS NOT NULL
+ON CONFLICT (order_id) DO NOTHING;
+
+DROP TABLE if exists orderbook;
+
+-- Per-order levels derived from resting_orders, kept for readers of the old table
+CREATE VIEW orderbook AS
+SELECT ticker,
+       COALESCE(json_agg(json_build_object('price', price, 'qty', qty, 'user_id', user_id, 'order_id', order_id)
+                         ORDER BY price DESC, timestamp) FILTER (WHERE direction = 'BUY'), '[]') AS bid_levels,
+       COALESCE(json_agg(json_build_object('price', price, 'qty', qty, 'user_id', user_id, 'order_id', order_id)
+                         ORDER BY price, timestamp) FILTER (WHERE direction = 'SELL'), '[]') AS ask_levels
+FROM resting_orders
+GROUP BY ticker;
@@ -0,0 +1,2 @@
+-- Serves per-ticker history pages ordered by (timestamp, id) without sorting
+CREATE INDEX if not exists ix_transactions_ticker_timestamp ON transactions (ticker, timestamp, id);
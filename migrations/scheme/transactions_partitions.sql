@@ -0,0 +1,55 @@
+--liquibase formatted sql
+
+--changeset me:transactions_partitions splitStatements:false
+-- Monthly range partitions of transactions on timestamp. PostgreSQL 10 allows no keys, indexes or foreign keys
+-- on the partitioned table itself, so every partition gets its own from create_transactions_partition(); ids
+-- stay unique through the shared sequence. Inserts fail for a month without a partition: the application
+-- creates them ahead of time (app/partitions.py).
+ALTER TABLE transactions RENAME TO transactions_unpartitioned;
+
+CREATE TABLE transactions (
+                              id INT NOT NULL DEFAULT nextval('transactions_id_seq'),
+                              ticker VARCHAR(10) NOT NULL,
+                              amount INT NOT NULL,
+                              price INT NOT NULL,
+                              timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (timestamp);
+
+-- Otherwise dropping the old table would drop the sequence with it
+ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id;
+
+CREATE OR REPLACE FUNCTION create_transactions_partition(month DATE) RETURNS TEXT AS $$
+DECLARE
+    partition_start DATE := date_trunc('month', month);
+    partition_name TEXT := 'transactions_p' || to_char(partition_start, 'YYYYMM');
+BEGIN
+    -- Serializes concurrent callers, which would otherwise race on the name
+    PERFORM pg_advisory_xact_lock(hashtext('create_transactions_partition'));
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF transactions ('
+            'PRIMARY KEY (id), FOREIGN KEY (ticker) REFERENCES instruments(ticker) ON DELETE CASCADE'
+            ') FOR VALUES FROM (%L) TO (%L)',
+            partition_name, partition_start, partition_start + interval '1 month'
+        );
+        -- Serves per-ticker history pages ordered by (timestamp, id) without sorting
+        EXECUTE format('CREATE INDEX %I ON %I (ticker, timestamp, id)', partition_name || '_ticker_timestamp', partition_name);
+    END IF;
+    RETURN partition_name;
+END
+$$ LANGUAGE plpgsql;
+
+-- Every month with existing trades, and three months ahead
+SELECT create_transactions_partition(month::date)
+FROM (SELECT min(timestamp) AS first, max(timestamp) AS last FROM transactions_unpartitioned) AS bounds,
+     generate_series(
+             date_trunc('month', LEAST(bounds.first, LOCALTIMESTAMP)),
+             date_trunc('month', GREATEST(bounds.last, LOCALTIMESTAMP + interval '3 months')),
+             interval '1 month'
+     ) AS month;
+
+INSERT INTO transactions (id, ticker, amount, price, timestamp)
+SELECT id, ticker, amount, price, timestamp
+FROM transactions_unpartitioned;
+
+DROP TABLE transactions_unpartitioned;
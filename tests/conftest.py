@@ -0,0 +1,97 @@
+import asyncio
+import os
+import random
+import string
+from uuid import uuid4
+import pytest
+
+# Settings are read when app modules are first imported, so the test
+# database has to be in place before any test module imports them
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+
+from sqlalchemy import delete  # noqa: E402
+from app.candles import discard_candles  # noqa: E402
+from app.db_models.balances import Balance_db  # noqa: E402
+from app.db_models.instruments import Instrument_db  # noqa: E402
+from app.db_models.users import User_db  # noqa: E402
+from app.db_session_provider import AsyncSessionLocal, dispose_engines  # noqa: E402
+from app.dependencies import AuthUser  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+
+@pytest.fixture
+def run(database):
+    # Runs a coroutine on a fresh loop; pooled connections belong to the
+    # loop that opened them, so they are closed before it ends
+    def run_until_complete(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                await dispose_engines()
+
+        return asyncio.run(main())
+
+    return run_until_complete
+
+
+@pytest.fixture
+def ticker(run):
+    # A new instrument per test; deleting it cascades to its orders, trades,
+    # candles and balances
+    ticker = "T" + "".join(random.choices(string.ascii_uppercase, k=8))
+
+    async def create():
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                db.add(Instrument_db(name=ticker, ticker=ticker))
+
+    async def remove():
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await db.execute(delete(Instrument_db).where(Instrument_db.ticker == ticker))
+
+    run(create())
+    yield ticker
+    discard_candles(ticker)
+    run(remove())
+
+
+@pytest.fixture
+def make_user(run, ticker):
+    # Users with RUB and `ticker` balances, removed after the test
+    users = []
+
+    async def create(rub: int, shares: int) -> AuthUser:
+        user = AuthUser(id=uuid4(), name="test user", role="USER", api_key=f"key-{uuid4()}")
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                db.add(User_db(id=user.id, name=user.name, role=user.role, api_key=user.api_key))
+                await db.flush()
+                db.add_all([
+                    Balance_db(user_id=user.id, ticker="RUB", amount=rub),
+                    Balance_db(user_id=user.id, ticker=ticker, amount=shares)
+                ])
+        return user
+
+    async def remove():
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                await db.execute(delete(User_db).where(User_db.id.in_([user.id for user in users])))
+
+    def make(rub: int = 0, shares: int = 0) -> AuthUser:
+        user = run(create(rub, shares))
+        users.append(user)
+        return user
+
+    yield make
+    if users:
+        run(remove())
@@ -0,0 +1,48 @@
+from datetime import datetime
+from sqlalchemy import insert
+from app.candles import CandleSeries, discard_candles, from_epoch, get_candles, seed_candles, to_epoch
+from app.db_models.transactions import Transaction_db
+from app.db_session_provider import AsyncSessionLocal
+
+
+def test_series_aggregates_trades_into_bars():
+    series = CandleSeries(60, capacity=2, since=0)
+    series.update(0, 100, 1)
+    series.update(30, 105, 2)
+    series.update(59, 95, 1)
+    bar = series.update(61, 101, 4)
+
+    first, second = series.bars
+    assert (first.start, first.open, first.high, first.low, first.close, first.volume) == (0, 100, 105, 95, 95, 4)
+    assert bar is second and (second.start, second.volume) == (60, 4)
+    assert series.range(60, 120) == [second]
+
+
+def test_full_series_moves_its_start():
+    series = CandleSeries(60, capacity=2, since=0)
+    for minute in range(3):
+        series.update(minute * 60, 100, 1)
+
+    assert [bar.start for bar in series.bars] == [60, 120]
+    assert series.since == 60
+
+
+def test_discarded_series_reads_transactions(run, ticker):
+    now = to_epoch(datetime.utcnow())
+    minute = now - now % 60 - 120
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(Transaction_db), [
+                {"ticker": ticker, "amount": 2, "price": 100, "timestamp": from_epoch(minute)},
+                {"ticker": ticker, "amount": 3, "price": 90, "timestamp": from_epoch(minute + 30)},
+            ])
+            await seed_candles(db, ticker)
+            await db.commit()
+            # Dropped by an invalidation between seeding and reading
+            discard_candles(ticker)
+            return await get_candles(db, ticker, "1m", minute, now + 1)
+
+    bars = run(scenario())
+
+    assert [(bar.start, bar.open, bar.close, bar.volume) for bar in bars] == [(minute, 100, 90, 5)]
@@ -0,0 +1,77 @@
+import random
+from uuid import uuid4
+from app.order_book import BUY, SELL, OrderBook
+
+
+def scan_quote(book: OrderBook, direction: str, qty: int):
+    # The same answer the slow way: walking the opposite side best first
+    cost = 0
+    remaining = qty
+    for level in book.opposite(direction).levels():
+        taken = min(remaining, level.qty)
+        cost += taken * level.price
+        remaining -= taken
+        if remaining == 0:
+            return cost, level.price
+    return None
+
+
+def test_quote_walks_levels_best_first():
+    book = OrderBook("TEST")
+    book.add(uuid4(), uuid4(), SELL, 101, 5)
+    book.add(uuid4(), uuid4(), SELL, 103, 5)
+    book.add(uuid4(), uuid4(), SELL, 102, 5)
+
+    assert book.quote(BUY, 1) == (101, 101)
+    assert book.quote(BUY, 5) == (505, 101)
+    assert book.quote(BUY, 6) == (607, 102)
+    assert book.quote(BUY, 15) == (1530, 103)
+
+
+def test_quote_without_enough_liquidity():
+    book = OrderBook("TEST")
+    assert book.quote(SELL, 1) is None
+
+    book.add(uuid4(), uuid4(), BUY, 100, 5)
+    assert book.quote(SELL, 6) is None
+    assert book.quote(SELL, 5) == (500, 100)
+
+
+def test_new_price_rebuilds_index():
+    book = OrderBook("TEST")
+    book.add(uuid4(), uuid4(), BUY, 100, 5)
+    assert book.quote(SELL, 5) == (500, 100)
+
+    # Better and worse prices than any indexed one
+    book.add(uuid4(), uuid4(), BUY, 105, 1)
+    book.add(uuid4(), uuid4(), BUY, 90, 2)
+
+    assert book.quote(SELL, 1) == (105, 105)
+    assert book.quote(SELL, 8) == (105 + 500 + 180, 90)
+
+
+def test_index_follows_random_changes():
+    generator = random.Random(7)
+    book = OrderBook("TEST")
+    resting = []
+    for _ in range(3000):
+        action = generator.random()
+        if action < 0.5 or not resting:
+            direction = generator.choice((BUY, SELL))
+            price = generator.randint(90, 99) if direction == BUY else generator.randint(101, 110)
+            order_id = uuid4()
+            book.add(order_id, uuid4(), direction, price, generator.randint(1, 20))
+            resting.append(order_id)
+        elif action < 0.7:
+            book.cancel(resting.pop(generator.randrange(len(resting))))
+        elif action < 0.8:
+            order_id = generator.choice(resting)
+            if book.get(order_id).qty > 1:
+                book.reduce(order_id, 1)
+        else:
+            book.match(generator.choice((BUY, SELL)), generator.randint(1, 40))
+            resting = [order_id for order_id in resting if order_id in book]
+
+        for direction in (BUY, SELL):
+            qty = generator.randint(1, book.opposite(direction).qty + 5)
+            assert book.quote(direction, qty) == scan_quote(book, direction, qty)
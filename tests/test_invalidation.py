@@ -0,0 +1,47 @@
+import asyncio
+import json
+import time
+from uuid import uuid4
+from app import invalidation
+from app.config import settings
+from app.invalidation import USER, apply_invalidation, on_invalidation, publish_invalidation
+
+received = []
+
+
+@on_invalidation("test")
+def failing(key, order_ids):
+    raise RuntimeError("handler failed")
+
+
+@on_invalidation("test")
+def record(key, order_ids):
+    received.append((key, order_ids))
+
+
+def event(origin: str) -> str:
+    return json.dumps({"kind": "test", "key": "ABC", "origin": origin, "sent": time.time(), "orders": ["1"]})
+
+
+def test_events_reach_every_handler():
+    received.clear()
+    apply_invalidation(event(uuid4().hex))
+
+    assert received == [("ABC", ["1"])]
+
+
+def test_own_events_are_ignored():
+    received.clear()
+    apply_invalidation(event(invalidation._origin))
+
+    assert received == []
+
+
+class Unreachable:
+    async def execute(self, *args, **kwargs):
+        raise AssertionError("NOTIFY sent with the invalidation bus off")
+
+
+def test_no_events_without_the_bus(monkeypatch):
+    monkeypatch.setattr(settings, "invalidation_bus", False)
+    asyncio.run(publish_invalidation(Unreachable(), USER, uuid4()))
@@ -0,0 +1,199 @@
+import asyncio
+import os
+from datetime import datetime
+from uuid import uuid4
+import pytest
+from app import matching
+from app.config import settings
+from app.db_models.limit_orders import LimitOrder_db
+from app.db_models.resting_orders import RestingOrder_db
+from app.db_session_provider import AsyncSessionLocal
+from app.journal import (
+    SNAPSHOT_PREFIX, Journal, cancel_event, encode_records, encode_snapshot, fill_event, order_event, recover
+)
+from app.models import OrderStatus
+from app.order_book import BUY, SELL, OrderBook
+
+TICKER = "TEST"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def write(directory, events, last_seq=0, snapshot_seqs=None):
+    async def append():
+        journal = Journal(str(directory), last_seq, snapshot_seqs or {}, 1024 * 1024)
+        await journal.append(events)
+        await journal.close()
+
+    run(append())
+
+
+def test_replay_rebuilds_book(tmp_path):
+    maker, taker, cancelled, user = uuid4(), uuid4(), uuid4(), uuid4()
+    write(tmp_path, [
+        order_event(TICKER, maker, user, SELL, 100, 10),
+        order_event(TICKER, cancelled, user, BUY, 90, 5),
+        order_event(TICKER, taker, user, BUY, None, 4),
+        fill_event(TICKER, taker, maker, 100, 4),
+        cancel_event(TICKER, cancelled),
+    ])
+    # A book is only recovered from its snapshot, here an empty one at seq 0
+    with open(tmp_path / f"{SNAPSHOT_PREFIX}{TICKER}.bin", "wb") as file:
+        file.write(encode_snapshot(OrderBook(TICKER), 0))
+
+    books, snapshot_seqs, last_seq = recover(str(tmp_path))
+
+    book = books[TICKER]
+    assert last_seq == 5
+    assert book.get(maker).qty == 6
+    assert cancelled not in book and taker not in book
+    assert book.best_ask == 100 and book.best_bid is None
+
+
+def test_replay_starts_after_snapshot(tmp_path):
+    user = uuid4()
+    first, second = uuid4(), uuid4()
+    book = OrderBook(TICKER)
+    book.add(first, user, BUY, 99, 1)
+    with open(tmp_path / f"{SNAPSHOT_PREFIX}{TICKER}.bin", "wb") as file:
+        file.write(encode_snapshot(book, 1))
+    # Seq 1 is already in the snapshot and must not be applied twice
+    write(tmp_path, [order_event(TICKER, first, user, BUY, 99, 1), order_event(TICKER, second, user, BUY, 98, 2)])
+
+    books, _, last_seq = recover(str(tmp_path))
+
+    assert last_seq == 2
+    assert len(books[TICKER]) == 2
+    assert books[TICKER].get(second).qty == 2
+
+
+def test_replay_stops_at_torn_record(tmp_path):
+    user = uuid4()
+    kept, torn = uuid4(), uuid4()
+    with open(tmp_path / f"{SNAPSHOT_PREFIX}{TICKER}.bin", "wb") as file:
+        file.write(encode_snapshot(OrderBook(TICKER), 0))
+    records = encode_records(1, [order_event(TICKER, kept, user, BUY, 99, 1), order_event(TICKER, torn, user, BUY, 98, 1)])
+    with open(tmp_path / f"journal-{1:020d}.bin", "wb") as file:
+        file.write(records[:-3])
+
+    books, _, last_seq = recover(str(tmp_path))
+
+    assert last_seq == 1
+    assert kept in books[TICKER] and torn not in books[TICKER]
+
+
+def test_failed_write_starts_new_segment(tmp_path, monkeypatch):
+    user = uuid4()
+    with open(tmp_path / f"{SNAPSHOT_PREFIX}{TICKER}.bin", "wb") as file:
+        file.write(encode_snapshot(OrderBook(TICKER), 0))
+
+    async def scenario():
+        journal = Journal(str(tmp_path), 0, {TICKER: 0}, 1024 * 1024)
+        write_records = journal._write
+
+        def torn_write(first_seq, events):
+            journal._file.write(encode_records(first_seq, events)[:-3])
+            journal._file.flush()
+            raise OSError("disk full")
+
+        monkeypatch.setattr(journal, "_write", torn_write)
+        with pytest.raises(OSError):
+            await journal.append([order_event(TICKER, uuid4(), user, BUY, 99, 1)])
+        monkeypatch.setattr(journal, "_write", write_records)
+        await journal.append([order_event(TICKER, uuid4(), user, BUY, 98, 1)])
+        await journal.close()
+
+    run(scenario())
+
+    books, _, last_seq = recover(str(tmp_path))
+    assert last_seq == 2
+    assert books[TICKER].best_bid == 98
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("journal-")]) == 2
+
+
+def test_journal_failure_keeps_committed_result(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "journal_snapshot_interval", 1000)
+
+    async def scenario():
+        journal = Journal(str(tmp_path), 0, {TICKER: 0}, 1024 * 1024)
+        with open(tmp_path / f"{SNAPSHOT_PREFIX}{TICKER}.bin", "wb") as file:
+            file.write(encode_snapshot(OrderBook(TICKER), 0))
+
+        def failing_write(first_seq, events):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(journal, "_write", failing_write)
+        monkeypatch.setattr(matching, "_journal", journal)
+        matcher = matching.TickerMatcher(TICKER, 10)
+        matcher.book = OrderBook(TICKER)
+
+        async def command(matcher):
+            # Stands for a placement whose transaction has committed
+            matcher.record([order_event(TICKER, uuid4(), uuid4(), BUY, 99, 1)])
+            return "committed"
+
+        try:
+            return await matcher.submit(command), matcher, journal
+        finally:
+            await matcher.stop()
+
+    result, matcher, journal = run(scenario())
+
+    assert result == "committed"
+    assert TICKER not in journal.snapshot_seqs
+    assert not os.path.exists(tmp_path / f"{SNAPSHOT_PREFIX}{TICKER}.bin")
+    assert matcher._events_since_snapshot >= settings.journal_snapshot_interval
+
+
+def resting(ticker, user_id, order_id, qty):
+    timestamp = datetime.utcnow()
+    return [
+        LimitOrder_db(
+            id=order_id, status=OrderStatus.NEW, user_id=user_id, timestamp=timestamp, direction=SELL,
+            ticker=ticker, qty=qty, price=100, filled=0
+        ),
+        RestingOrder_db(
+            order_id=order_id, ticker=ticker, direction=SELL, user_id=user_id, price=100, qty=qty, timestamp=timestamp
+        )
+    ]
+
+
+@pytest.mark.parametrize("committed_after_journal", [False, True])
+def test_recovery_checks_books_against_database(run, ticker, make_user, tmp_path, monkeypatch,
+                                                committed_after_journal):
+    user = make_user(shares=10)
+    journaled, lost = uuid4(), uuid4()
+    book = OrderBook(ticker)
+    book.add(journaled, user.id, SELL, 100, 5)
+    with open(tmp_path / f"{SNAPSHOT_PREFIX}{ticker}.bin", "wb") as file:
+        file.write(encode_snapshot(book, 0))
+    monkeypatch.setattr(settings, "journal_dir", str(tmp_path))
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                db.add_all(resting(ticker, user.id, journaled, 5))
+                if committed_after_journal:
+                    # Committed, then the process died before journaling it
+                    db.add_all(resting(ticker, user.id, lost, 3))
+
+        await matching.start_journal()
+        try:
+            recovered = matching.get_loaded_book(ticker)
+            async with AsyncSessionLocal() as db:
+                loaded = await matching.get_matcher(ticker).ensure_book(db)
+            return recovered, loaded
+        finally:
+            await matching.stop_matchers()
+
+    recovered, loaded = run(scenario())
+
+    if committed_after_journal:
+        assert recovered is None
+        assert not os.path.exists(tmp_path / f"{SNAPSHOT_PREFIX}{ticker}.bin")
+        assert lost in loaded and journaled in loaded
+    else:
+        assert recovered is loaded
+        assert journaled in loaded
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+import orjson
+from app.db_models.limit_orders import LimitOrder_db
+from app.db_models.market_orders import MarketOrder_db
+from app.db_session_provider import AsyncSessionLocal
+from app.dependencies import AuthUser
+from app.models import OrderStatus
+from app.routers.order import list_orders
+
+
+async def fetch(user: AuthUser, limit=None, cursor=None, status=None):
+    async with AsyncSessionLocal() as db:
+        response = await list_orders(
+            status=status, ticker=None, direction=None, limit=limit, cursor=cursor, user=user, db=db
+        )
+    return [order["id"] for order in orjson.loads(response.body)], response.headers.get("X-Next-Cursor")
+
+
+def test_pages_cover_every_order(run, ticker, make_user):
+    user = make_user()
+    started = datetime(2024, 1, 1)
+    orders = []
+    for index in range(7):
+        model = LimitOrder_db if index % 2 else MarketOrder_db
+        fields = {"price": 100, "filled": 0} if model is LimitOrder_db else {}
+        status = OrderStatus.CANCELLED if index == 3 else OrderStatus.NEW
+        orders.append(model(
+            id=uuid4(), status=status, user_id=user.id, timestamp=started + timedelta(minutes=index),
+            direction="BUY", ticker=ticker, qty=1, **fields
+        ))
+    newest_first = [str(order.id) for order in reversed(orders) if order.status != OrderStatus.CANCELLED]
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                db.add_all(orders)
+
+        # Without a limit or a cursor the whole list comes back in one response
+        assert await fetch(user) == (newest_first, None)
+
+        listed = []
+        cursor = None
+        while True:
+            page, cursor = await fetch(user, limit=2, cursor=cursor)
+            listed.extend(page)
+            if cursor is None:
+                break
+        assert listed == newest_first
+
+        # A cursor alone pages with the default size
+        _, cursor = await fetch(user, limit=1)
+        assert (await fetch(user, cursor=cursor))[0] == newest_first[1:]
+
+        assert (await fetch(user, status=OrderStatus.CANCELLED))[0] == [str(orders[3].id)]
+
+    run(scenario())
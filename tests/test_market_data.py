@@ -0,0 +1,53 @@
+from uuid import uuid4
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.market_data import discard_market_data, l2_snapshot
+from app.order_book import BUY, EPOCH, SELL, OrderBook
+
+TICKER = "TEST"
+
+
+@pytest.fixture
+def book():
+    book = OrderBook(TICKER)
+    for price in (97, 98, 99):
+        book.add(uuid4(), uuid4(), BUY, price, 1)
+    book.add(uuid4(), uuid4(), SELL, 101, 2)
+    yield book
+    discard_market_data(TICKER)
+
+
+def test_l2_snapshot_levels(book):
+    etag, body = l2_snapshot(book, 2)
+
+    assert orjson.loads(body) == {
+        "bid_levels": [{"price": 99, "qty": 1}, {"price": 98, "qty": 1}],
+        "ask_levels": [{"price": 101, "qty": 2}],
+    }
+
+
+def test_l2_snapshot_cached_until_book_changes(book):
+    first = l2_snapshot(book, 10)
+    assert l2_snapshot(book, 10) is first
+
+    book.add(uuid4(), uuid4(), SELL, 102, 1)
+    etag, body = l2_snapshot(book, 10)
+
+    assert etag != first[0]
+    assert len(orjson.loads(body)["ask_levels"]) == 2
+
+
+def test_etag_carries_process_epoch(book):
+    # The version alone repeats across restarts and between processes
+    etag, _ = l2_snapshot(book, 10)
+
+    assert etag == f'"{TICKER}-{EPOCH:016x}-{book.version}-10"'
+
+
+@pytest.mark.parametrize("limit", [0, -1, 1001, "x"])
+def test_orderbook_limit_is_validated(limit):
+    response = TestClient(app).get(f"/api/v1/public/orderbook/{TICKER}", params={"limit": limit})
+
+    assert response.status_code == 422
@@ -0,0 +1,148 @@
+from uuid import uuid4
+import pytest
+from app.order_book import BUY, SELL, OrderBook
+
+
+@pytest.fixture
+def book():
+    return OrderBook("TEST")
+
+
+def add(book, direction, price, qty):
+    order_id = uuid4()
+    book.add(order_id, uuid4(), direction, price, qty)
+    return order_id
+
+
+def test_fifo_within_price_level(book):
+    first = add(book, SELL, 100, 5)
+    second = add(book, SELL, 100, 5)
+    third = add(book, SELL, 100, 5)
+
+    fills = book.match(BUY, 12)
+
+    assert [(fill.maker_order_id, fill.qty) for fill in fills] == [(first, 5), (second, 5), (third, 2)]
+    assert book.get(third).qty == 3
+    assert first not in book and second not in book
+
+
+def test_better_price_matches_first(book):
+    worse = add(book, SELL, 101, 5)
+    better = add(book, SELL, 100, 5)
+
+    fills = book.match(BUY, 6)
+
+    assert [(fill.maker_order_id, fill.price, fill.qty) for fill in fills] == [(better, 100, 5), (worse, 101, 1)]
+
+
+def test_partial_fill_reports_maker_remaining(book):
+    maker = add(book, BUY, 100, 10)
+
+    fills = book.match(SELL, 4)
+
+    assert len(fills) == 1
+    assert fills[0].qty == 4
+    assert fills[0].maker_remaining == 6
+    assert book.bids.get_level(100).qty == 6
+    assert book.bids.qty == 6
+    assert book.get(maker).qty == 6
+
+
+def test_limit_price_stops_matching(book):
+    add(book, SELL, 100, 5)
+    add(book, SELL, 102, 5)
+
+    fills = book.match(BUY, 10, price=101)
+
+    assert sum(fill.qty for fill in fills) == 5
+    assert book.best_ask == 102
+
+
+def test_market_order_all_or_nothing(book):
+    add(book, SELL, 100, 5)
+    add(book, SELL, 101, 5)
+
+    assert book.can_fill(BUY, 10)
+    assert not book.can_fill(BUY, 11)
+    assert not book.can_fill(SELL, 1)
+
+
+def test_cancel_by_id(book):
+    kept = add(book, BUY, 99, 3)
+    cancelled = add(book, BUY, 100, 4)
+
+    order = book.cancel(cancelled)
+
+    assert order.order_id == cancelled and order.qty == 4
+    assert cancelled not in book and kept in book
+    assert book.best_bid == 99
+    assert book.bids.qty == 3
+    assert book.cancel(cancelled) is None
+
+
+def test_reduce(book):
+    order_id = add(book, SELL, 100, 10)
+
+    assert book.reduce(order_id, 3).qty == 7
+    assert book.asks.get_level(100).qty == 7
+    assert book.asks.qty == 7
+
+    assert book.reduce(order_id, 7).order_id == order_id
+    assert order_id not in book
+    assert book.best_ask is None
+    assert book.reduce(order_id, 1) is None
+
+
+def test_best_prices_after_levels_empty(book):
+    add(book, BUY, 100, 1)
+    add(book, BUY, 99, 1)
+    top_ask = add(book, SELL, 101, 1)
+    add(book, SELL, 102, 1)
+
+    book.match(SELL, 1)
+    book.cancel(top_ask)
+
+    # The emptied levels are still in the heaps until they surface
+    assert book.best_bid == 99
+    assert book.best_ask == 102
+    assert len(book.bids) == 1 and len(book.asks) == 1
+
+    book.match(SELL, 1)
+    assert book.best_bid is None
+    add(book, BUY, 100, 2)
+    assert book.best_bid == 100
+
+
+def test_add_rejects_duplicate_id(book):
+    order_id = add(book, BUY, 100, 1)
+
+    with pytest.raises(ValueError):
+        book.add(order_id, uuid4(), BUY, 100, 1)
+
+
+def test_version_changes_with_book(book):
+    version = book.version
+    order_id = add(book, BUY, 100, 5)
+    assert book.version > version
+
+    version = book.version
+    book.match(BUY, 1)
+    assert book.version == version
+
+    book.reduce(order_id, 1)
+    assert book.version > version
+
+
+def test_drain_changes(book):
+    add(book, BUY, 100, 5)
+    add(book, SELL, 101, 5)
+    book.drain_changes()
+
+    add(book, BUY, 99, 2)
+    book.match(SELL, 5)
+    book.match(BUY, 2)
+    levels, trades = book.drain_changes()
+
+    assert sorted(levels) == [(BUY, 99, 2), (BUY, 100, 0), (SELL, 101, 3)]
+    assert trades == [(SELL, 100, 5), (BUY, 101, 2)]
+    assert book.drain_changes() == ([], [])
@@ -0,0 +1,87 @@
+import csv
+import gzip
+from datetime import datetime
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from app.db_session_provider import engine
+from app.partitions import _ARCHIVE_LOCK, _export, archive_partitions, month_start
+
+# Months no real partition covers; old enough for any retention below
+DETACHED = "transactions_p190001"
+BROKEN = "transactions_p190002"
+RETENTION = 12 * 100
+
+
+def test_month_start():
+    assert month_start(datetime(2024, 5, 17, 12, 30)) == datetime(2024, 5, 1)
+    assert month_start(datetime(2024, 11, 3), 2) == datetime(2025, 1, 1)
+    assert month_start(datetime(2024, 1, 31), -13) == datetime(2022, 12, 1)
+
+
+async def create_detached(name: str, rows: int):
+    # What archiving finds after DETACH: a plain table shaped like transactions
+    async with engine.begin() as connection:
+        await connection.execute(text(f'CREATE TABLE "{name}" (LIKE transactions INCLUDING DEFAULTS)'))
+        await connection.execute(
+            text(
+                f'INSERT INTO "{name}" (id, ticker, amount, price, timestamp) '
+                "SELECT -n, 'TEST', n, 100, TIMESTAMP '1900-01-01' FROM generate_series(1, :rows) AS n"
+            ),
+            {"rows": rows}
+        )
+
+
+async def drop(*names: str):
+    async with engine.begin() as connection:
+        for name in names:
+            await connection.execute(text(f'DROP TABLE IF EXISTS "{name}" CASCADE'))
+
+
+@pytest.fixture
+def detached(run):
+    run(create_detached(DETACHED, 250))
+    yield DETACHED
+    run(drop(DETACHED))
+
+
+def test_export_writes_complete_archive(run, detached, tmp_path):
+    path = tmp_path / f"{detached}.csv.gz"
+
+    async def export():
+        async with engine.connect() as connection:
+            return await _export(connection, detached, str(path))
+
+    rows = run(export())
+
+    assert rows == 250
+    assert not (tmp_path / f"{detached}.csv.gz.partial").exists()
+    with gzip.open(path, "rt") as archive:
+        records = list(csv.reader(archive))
+    assert records[0] == ["id", "ticker", "amount", "price", "timestamp"]
+    assert len(records) - 1 == rows
+
+
+def test_failed_archiving_releases_the_lock(run, tmp_path):
+    async def scenario():
+        await create_detached(BROKEN, 1)
+        # DROP then fails inside the transaction, after the export
+        async with engine.begin() as connection:
+            await connection.execute(text(f'CREATE VIEW "{BROKEN}_view" AS SELECT * FROM "{BROKEN}"'))
+
+        with pytest.raises(DBAPIError, match="depend"):
+            await archive_partitions(str(tmp_path), RETENTION)
+
+        # Taken from a different connection: the failed run let it go
+        async with engine.connect() as first, engine.connect() as second:
+            for connection in (first, second):
+                locked = await connection.execute(
+                    text("SELECT pg_try_advisory_lock(hashtext(:lock))"), {"lock": _ARCHIVE_LOCK}
+                )
+                assert locked.scalar_one()
+                await connection.execute(text("SELECT pg_advisory_unlock(hashtext(:lock))"), {"lock": _ARCHIVE_LOCK})
+
+    try:
+        run(scenario())
+    finally:
+        run(drop(BROKEN))
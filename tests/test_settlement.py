@@ -0,0 +1,159 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from app.db_models.balances import Balance_db
+from app.db_models.limit_orders import LimitOrder_db
+from app.db_models.resting_orders import RestingOrder_db
+from app.db_session_provider import AsyncSessionLocal
+from app.dependencies import AuthUser
+from app.matching import TickerMatcher
+from app.models import LimitOrderBody, MarketOrderBody, OrderStatus
+from app.order_registry import order_registry
+from app.routers.order import _process_cancel, _process_order, _process_order_batch
+
+
+async def balances(user: AuthUser, ticker: str) -> dict:
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(Balance_db.ticker, Balance_db.amount)
+            .where(Balance_db.user_id == user.id, Balance_db.ticker.in_(["RUB", ticker]))
+        )
+        return dict(rows.all())
+
+
+def test_stale_book_does_not_fill_a_maker_twice(run, ticker, make_user):
+    seller = make_user(rub=0, shares=5)
+    first = make_user(rub=1000)
+    second = make_user(rub=1000)
+
+    async def scenario():
+        # Two processes matching the same ticker, both with the maker loaded
+        this, other = TickerMatcher(ticker, 10), TickerMatcher(ticker, 10)
+        maker = await this.submit(lambda matcher: _process_order(
+            matcher, seller, LimitOrderBody(direction="SELL", ticker=ticker, qty=5, price=100)
+        ))
+        async with AsyncSessionLocal() as db:
+            await other.ensure_book(db)
+
+        buy = MarketOrderBody(direction="BUY", ticker=ticker, qty=5)
+        await this.submit(lambda matcher: _process_order(matcher, first, buy))
+        with pytest.raises(HTTPException) as rejected:
+            await other.submit(lambda matcher: _process_order(matcher, second, buy))
+
+        assert rejected.value.status_code == 409
+        # The stale book is dropped and reloaded from the database
+        assert other.book is None
+        async with AsyncSessionLocal() as db:
+            assert len(await other.ensure_book(db)) == 0
+
+            order = await db.get(LimitOrder_db, maker.order_id)
+            assert (order.filled, order.status) == (5, OrderStatus.EXECUTED)
+            assert await db.get(RestingOrder_db, maker.order_id) is None
+
+        assert await balances(seller, ticker) == {"RUB": 500, ticker: 0}
+        assert await balances(first, ticker) == {"RUB": 500, ticker: 5}
+        assert await balances(second, ticker) == {"RUB": 1000, ticker: 0}
+        await this.stop()
+        await other.stop()
+
+    run(scenario())
+
+
+def test_partial_fills_settle_the_maker(run, ticker, make_user):
+    seller = make_user(rub=0, shares=10)
+    buyer = make_user(rub=1000)
+
+    async def scenario():
+        matcher = TickerMatcher(ticker, 10)
+        maker = await matcher.submit(lambda matcher: _process_order(
+            matcher, seller, LimitOrderBody(direction="SELL", ticker=ticker, qty=10, price=50)
+        ))
+        for qty in (3, 4):
+            await matcher.submit(lambda matcher: _process_order(
+                matcher, buyer, MarketOrderBody(direction="BUY", ticker=ticker, qty=qty)
+            ))
+
+        async with AsyncSessionLocal() as db:
+            order = await db.get(LimitOrder_db, maker.order_id)
+            assert (order.filled, order.status) == (7, OrderStatus.PARTIALLY_EXECUTED)
+            assert (await db.get(RestingOrder_db, maker.order_id)).qty == 3
+        assert await balances(seller, ticker) == {"RUB": 350, ticker: 3}
+        assert await balances(buyer, ticker) == {"RUB": 650, ticker: 7}
+        await matcher.stop()
+
+    run(scenario())
+
+
+def test_fills_against_one_seller_are_netted(run, ticker, make_user):
+    seller = make_user(rub=0, shares=10)
+    buyer = make_user(rub=1000)
+
+    async def scenario():
+        matcher = TickerMatcher(ticker, 10)
+        for price in (100, 101, 102):
+            await matcher.submit(lambda matcher: _process_order(
+                matcher, seller, LimitOrderBody(direction="SELL", ticker=ticker, qty=3, price=price)
+            ))
+        # One order sweeping two makers of the same seller: the fills are
+        # netted into a single change per balance
+        taker = await matcher.submit(lambda matcher: _process_order(
+            matcher, buyer, LimitOrderBody(direction="BUY", ticker=ticker, qty=8, price=101)
+        ))
+
+        async with AsyncSessionLocal() as db:
+            order = await db.get(LimitOrder_db, taker.order_id)
+            assert (order.filled, order.status) == (6, OrderStatus.PARTIALLY_EXECUTED)
+            assert (await db.get(RestingOrder_db, taker.order_id)).qty == 2
+        assert await balances(seller, ticker) == {"RUB": 603, ticker: 4}
+        assert await balances(buyer, ticker) == {"RUB": 397, ticker: 6}
+        assert matcher.book.best_bid == 101 and matcher.book.best_ask == 102
+        await matcher.stop()
+
+    run(scenario())
+
+
+def test_batch_settles_makers_of_the_same_batch(run, ticker, make_user):
+    trader = make_user(rub=1000, shares=5)
+
+    async def scenario():
+        matcher = TickerMatcher(ticker, 10)
+        maker, taker = await matcher.submit(lambda matcher: _process_order_batch(matcher, trader, [
+            LimitOrderBody(direction="SELL", ticker=ticker, qty=5, price=100),
+            LimitOrderBody(direction="BUY", ticker=ticker, qty=3, price=100)
+        ]))
+
+        # The maker was placed in the same transaction: the registry gets
+        # its settled state, not the one it was created with
+        entry = order_registry.get(maker.order_id)
+        assert (entry.filled, entry.status) == (3, OrderStatus.PARTIALLY_EXECUTED.value)
+        async with AsyncSessionLocal() as db:
+            assert (await db.get(RestingOrder_db, maker.order_id)).qty == 2
+            assert (await db.get(LimitOrder_db, taker.order_id)).status == OrderStatus.EXECUTED
+        await matcher.stop()
+
+    run(scenario())
+
+
+def test_cancel_refunds_the_unfilled_part(run, ticker, make_user):
+    buyer = make_user(rub=1000)
+    seller = make_user(rub=0, shares=2)
+
+    async def scenario():
+        matcher = TickerMatcher(ticker, 10)
+        order = await matcher.submit(lambda matcher: _process_order(
+            matcher, buyer, LimitOrderBody(direction="BUY", ticker=ticker, qty=5, price=100)
+        ))
+        await matcher.submit(lambda matcher: _process_order(
+            matcher, seller, MarketOrderBody(direction="SELL", ticker=ticker, qty=2)
+        ))
+        await matcher.submit(lambda matcher: _process_cancel(matcher, buyer.id, order.order_id))
+
+        # 200 paid for the filled part, 300 credited back for the rest
+        assert await balances(buyer, ticker) == {"RUB": 1100, ticker: 2}
+        async with AsyncSessionLocal() as db:
+            assert (await db.get(LimitOrder_db, order.order_id)).status == OrderStatus.CANCELLED
+            assert await db.get(RestingOrder_db, order.order_id) is None
+        assert len(matcher.book) == 0
+        await matcher.stop()
+
+    run(scenario())
@@ -0,0 +1,72 @@
+import asyncio
+import os
+from uuid import uuid4
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.dependencies import AuthUser
+from app.matching import _matchers
+from app.models import LimitOrderBody
+from app.routers.order import create_orders_batch
+from app.sharding import check_socket_dir, owner_of, socket_dir
+
+
+def test_owner_moves_only_tickers_of_added_worker():
+    tickers = [f"T{index:03d}" for index in range(200)]
+    before = {ticker: owner_of(ticker, 4) for ticker in tickers}
+    after = {ticker: owner_of(ticker, 5) for ticker in tickers}
+
+    assert set(before.values()) == {0, 1, 2, 3}
+    assert all(after[ticker] in (before[ticker], 4) for ticker in tickers)
+
+
+def test_socket_dir_from_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "matching_socket_dir", str(tmp_path))
+    assert socket_dir() == str(tmp_path)
+
+    monkeypatch.setattr(settings, "matching_socket_dir", None)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert socket_dir() == os.path.join(str(tmp_path), "exchange-matching")
+
+
+def test_private_socket_dir_is_accepted(tmp_path):
+    directory = tmp_path / "sockets"
+    directory.mkdir(mode=0o700)
+
+    check_socket_dir(str(directory))
+
+
+@pytest.mark.parametrize("mode", [0o755, 0o770, 0o701])
+def test_shared_socket_dir_is_refused(tmp_path, mode):
+    directory = tmp_path / "sockets"
+    directory.mkdir()
+    directory.chmod(mode)
+
+    with pytest.raises(RuntimeError):
+        check_socket_dir(str(directory))
+
+
+def test_symlinked_socket_dir_is_refused(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir(mode=0o700)
+    (tmp_path / "sockets").symlink_to(target)
+
+    with pytest.raises(RuntimeError):
+        check_socket_dir(str(tmp_path / "sockets"))
+
+
+def test_batch_shed_everywhere_is_refused(monkeypatch):
+    monkeypatch.setattr(settings, "order_max_in_flight", 0)
+    user = AuthUser(id=uuid4(), name="shed test", role="USER", api_key=f"key-{uuid4()}")
+    orders = [
+        LimitOrderBody(direction="BUY", ticker=ticker, qty=1, price=100) for ticker in ("SHEDA", "SHEDB", "SHEDA")
+    ]
+    try:
+        with pytest.raises(HTTPException) as rejected:
+            asyncio.run(create_orders_batch(orders, user=user))
+    finally:
+        _matchers.pop("SHEDA", None)
+        _matchers.pop("SHEDB", None)
+
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers == {"Retry-After": "1"}
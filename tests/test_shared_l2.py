@@ -0,0 +1,120 @@
+import multiprocessing
+import time
+from uuid import uuid4
+import orjson
+import pytest
+from app.market_data import discard_market_data, l2_snapshot
+from app.order_book import BUY, SELL, OrderBook
+from app.shared_l2 import SharedL2Reader, SharedL2Writer
+
+TICKER = "TEST"
+DEPTH = 5
+
+
+def build_book(levels: int = 8, qty: int = 1) -> OrderBook:
+    book = OrderBook(TICKER)
+    for index in range(levels):
+        book.add(uuid4(), uuid4(), BUY, 100 - index, qty)
+        book.add(uuid4(), uuid4(), SELL, 101 + index, qty)
+    return book
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = SharedL2Writer(str(tmp_path), DEPTH)
+    yield writer
+    writer.close()
+
+
+@pytest.fixture
+def reader(tmp_path):
+    reader = SharedL2Reader(str(tmp_path))
+    yield reader
+    reader.close()
+
+
+def test_matches_owner_snapshot(writer, reader):
+    # Front-ends answer from shared memory with the owner's exact body and ETag
+    book = build_book()
+    writer.publish(book)
+    try:
+        for limit in (1, 3, DEPTH):
+            assert reader.read(TICKER, limit) == l2_snapshot(book, limit)
+    finally:
+        discard_market_data(TICKER)
+
+
+def test_limits_outside_published_depth(writer, reader):
+    writer.publish(build_book())
+
+    assert reader.read(TICKER, 0) is None
+    assert reader.read(TICKER, DEPTH + 1) is None
+    assert reader.read("MISSING", 1) is None
+
+
+def test_follows_book_changes(writer, reader):
+    book = build_book()
+    writer.publish(book)
+    first = reader.read(TICKER, 2)
+    assert reader.read(TICKER, 2) is first
+
+    book.match(BUY, 1)
+    writer.publish(book)
+    etag, body = reader.read(TICKER, 2)
+
+    assert etag != first[0]
+    assert orjson.loads(body)["ask_levels"][0]["price"] == 102
+
+
+def test_discarded_book_is_not_served(writer, reader):
+    writer.publish(build_book())
+    writer.discard(TICKER)
+
+    assert reader.read(TICKER, 1) is None
+
+
+def test_write_in_progress_is_not_served(writer, reader):
+    writer.publish(build_book())
+    # A writer stopped between the two seqlock bumps leaves the counter odd
+    writer._begin(TICKER)
+
+    assert reader.read(TICKER, 1) is None
+    assert reader.retries > 0
+
+
+def churn(directory: str, stop):
+    # Every level of version v has qty v, so a torn read shows mixed quantities
+    writer = SharedL2Writer(directory, DEPTH)
+    book = build_book()
+    while not stop.is_set():
+        book.version += 1
+        for side in (book.bids, book.asks):
+            for level in side.levels(DEPTH):
+                level.qty = book.version % 1_000_000 + 1
+        writer.publish(book)
+
+
+def test_concurrent_writer_never_tears(tmp_path):
+    SharedL2Writer(str(tmp_path), DEPTH).publish(build_book())
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=churn, args=(str(tmp_path), stop))
+    process.start()
+    reader = SharedL2Reader(str(tmp_path))
+    reads = 0
+    try:
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            snapshot = reader.read(TICKER, DEPTH)
+            if snapshot is None:
+                continue
+            reads += 1
+            body = orjson.loads(snapshot[1])
+            levels = body["bid_levels"] + body["ask_levels"]
+            assert len(levels) == 2 * DEPTH
+            assert len({level["qty"] for level in levels}) == 1
+    finally:
+        stop.set()
+        process.join()
+        reader.close()
+
+    assert reads > 0